@@ -0,0 +1,470 @@
+"""Change-gated scheduling of the analysis call.
+
+update_state_from_output costs a full LLM round trip every turn, even when
+the turn only moves known characters around known places. The gate diffs
+each generated turn against the story state (world, characters, facts,
+items and previous turns) without any model call:
+- era terms: words of ERA_TERMS or of anachronisms already detected in the
+  story -> analyze now;
+- new entities: capitalized words (not at the start of a sentence) never
+  seen before -> defer at least;
+- novelty: share of the key term stems of the turn never seen before
+  (see violations.text_stems) -> analyze now above analyze_ratio, defer
+  above defer_ratio, skip below it.
+
+Generated prose is never repetitive (on final_results the novelty of a turn
+stays between ~0.3 and ~0.9 and every turn yields new facts), so the default
+thresholds mostly defer: the savings come from analyzing turns in pairs,
+while turns with era terms, where the violations are, are analyzed at once
+and Method A gets their feedback in time.
+
+Deferred turns wait for the next analysis and go with it in one batched
+request (reanalyze.analyze_batch, the format of `run.py reanalyze`), up to
+max_batch turns. After max_skipped consecutive skipped turns the next one is
+deferred anyway, so the state never drifts for long. Turns still pending at
+the end of the session are analyzed then (flush). With speculative prefetch
+(speculative.py) the gate runs in the background analysis.
+
+A batch that fails does not lose the turns deferred into it: after a
+timeout they go back to pending (the turn being generated follows the
+degraded path of the session, see deadlines.py), after other errors or a
+failed flush they are counted as unanalyzed.
+
+Gates are set per method (classes.set_analysis_gate): give both methods the
+same gate settings, or none, to keep the A/B comparison fair. get_stats()
+reports the decisions and the analysis calls saved.
+
+Recall versus per-turn analysis is measured, not assumed:
+- live (measure_recall=True): every batched or skipped turn is also analyzed
+  alone (shadow call, billed to the gate's own UsageRecorder, not to the run)
+  and its violations are matched against those the gate kept for the turn
+  (same ViolationIndex cluster);
+- offline (evaluate_runs with measure=True): the batches of the replay are
+  re-analyzed with analyze_batch and matched against the stored violations,
+  which come from analyzing every turn. Without measure only the coverage
+  (share of the stored violations on turns the gate analyzes) is reported.
+
+Usage:
+    from classes import set_analysis_gate
+    from analysis_gate import AnalysisGate
+
+    set_analysis_gate("A", AnalysisGate())
+    set_analysis_gate("B", AnalysisGate())
+
+    python run.py compare --runs 3 --analysis-gate A B --gate-recall
+    python analysis_gate.py --input final_results/              # calls saved and coverage on stored runs
+    python analysis_gate.py --input final_results/ --measure    # + recall of the batched analyses (model calls)
+"""
+
+import argparse
+import re
+import threading
+
+import generation_settings
+import tracing
+from classes import apply_analysis_result, build_analysis_prompt, call_gemini, update_state_from_output
+from deadlines import DeadlineExceeded
+from usage import UsageRecorder
+from violations import DEFAULT_THRESHOLD, ViolationIndex, character_terms, session_index, text_stems
+
+
+DEFAULT_ANALYZE_RATIO = 0.7
+DEFAULT_DEFER_RATIO = 0.3
+DEFAULT_MAX_BATCH = 2
+DEFAULT_MAX_SKIPPED = 2
+ACTIONS = ("analyze", "defer", "skip")
+
+# Objects the analysis usually reports as anachronisms in a pre-modern setting
+ERA_TERMS = text_stems(
+    "cannocchiale telescopio occhiali orologio pistola fucile moschetto archibugio cannone sparo "
+    "motore macchina elettricità telefono radio treno vapore fotografia giornale"
+)
+
+_CAPITALIZED = re.compile(r"\b[A-ZÀ-Ý][a-zà-ÿ]{2,}")
+_SENTENCE_START = ".!?:;\"«»“”—-\n"
+
+# Key of the pending/skipped bookkeeping in story_state (removed by flush)
+STATE_KEY = "analysis_gate"
+
+
+def known_terms(story_state):
+    """Key term stems already in the story: world, characters, facts, items and previous turns."""
+    world = story_state.get("world", {})
+    texts = [world.get("name", ""), world.get("setting", ""), world.get("description", "")]
+    texts += [str(rule) for rule in world.get("rules_explicit", []) + world.get("implicit_rules", [])]
+    for character in story_state.get("characters", []):
+        texts += [str(value) for value in character.values() if isinstance(value, str)]
+    texts += [fact.get("description", "") for fact in story_state.get("facts", [])]
+    for item in story_state.get("items", []):
+        texts += [item.get("name", ""), item.get("location", ""), item.get("status", "")]
+    for entry in story_state.get("history", []):
+        texts += [entry.get("user", ""), entry.get("assistant", "")]
+    return text_stems("\n".join(texts))
+
+
+def new_entities(chunk, known):
+    """Capitalized words of chunk (not starting a sentence) whose stem is not known."""
+    found = []
+    for match in _CAPITALIZED.finditer(chunk):
+        i = match.start() - 1
+        while i >= 0 and chunk[i] in " \t":
+            i -= 1
+        if i < 0 or chunk[i] in _SENTENCE_START:
+            continue
+        stems = text_stems(match.group(0))
+        if stems and not stems <= known and match.group(0) not in found:
+            found.append(match.group(0))
+    return found
+
+
+def parsed_violations(analysis_text, chunk, turn_id):
+    """Violations of one analysis answer, parsed as apply_analysis_result does (scratch state)."""
+    scratch = {"facts": [], "items": [], "inconsistencies": []}
+    apply_analysis_result(scratch, analysis_text, chunk, turn_id)
+    return scratch["inconsistencies"]
+
+
+def matched_violations(reference, detected, ignore_terms=frozenset()):
+    """Number of reference violations with a near-duplicate (same ViolationIndex cluster) in detected."""
+    index = ViolationIndex.from_violations(detected, ignore_terms=ignore_terms)
+    return sum(1 for violation in reference if index.match(violation) is not None)
+
+
+class AnalysisGate:
+    """Per-turn decision to analyze now, defer (batch with the next turn) or skip.
+
+    Args:
+        analyze_ratio: novelty (share of unseen key terms) at or above which a turn is analyzed now
+        defer_ratio: novelty at or above which a turn is deferred (skipped below it)
+        max_batch: turns analyzed together in one request
+        max_skipped: consecutive skipped turns before the next one is deferred anyway
+        era_terms: stems that always trigger an analysis (besides the anachronisms of the story)
+        measure_recall: also analyze batched and skipped turns alone (shadow calls) to measure recall
+    """
+
+    def __init__(self, analyze_ratio=DEFAULT_ANALYZE_RATIO, defer_ratio=DEFAULT_DEFER_RATIO,
+                 max_batch=DEFAULT_MAX_BATCH, max_skipped=DEFAULT_MAX_SKIPPED, era_terms=ERA_TERMS,
+                 measure_recall=False):
+        self.analyze_ratio = analyze_ratio
+        self.defer_ratio = defer_ratio
+        self.max_batch = max(1, max_batch)
+        self.max_skipped = max_skipped
+        self.era_terms = frozenset(era_terms)
+        self.measure_recall = measure_recall
+        self._shadow_usage = UsageRecorder()
+        self._lock = threading.Lock()
+        self._stats = {
+            "turns": 0,
+            "analyze": 0,
+            "defer": 0,
+            "skip": 0,
+            "forced": 0,          # deferred after max_skipped skipped turns
+            "requests": 0,        # analysis requests sent (batched ones count once)
+            "batched_turns": 0,   # turns analyzed in a request with other turns
+            "novelty_sum": 0.0,
+            "requeued": 0,        # deferred turns put back into pending after a timed-out batch
+            "unanalyzed": 0,      # turns whose analysis failed (error, failed flush)
+            "shadow_calls": 0,    # per-turn analyses made to measure recall
+            "reference_violations": 0,
+            "matched_violations": 0,
+        }
+
+    def novelty(self, story_state, chunk):
+        """Local diff of a turn against the story state (no model call).
+
+        Returns:
+            dict with era_terms, new_entities, new_terms, terms and novelty (share of new terms)
+        """
+        known = known_terms(story_state)
+        stems = text_stems(chunk, character_terms(story_state.get("characters")))
+        era_hits = sorted(stems & self.era_terms)
+        era_hits += [cluster["label"] for cluster in session_index(story_state).clusters_of("anacronismo")
+                     if cluster["terms"] and len(cluster["terms"] & stems) / len(cluster["terms"]) >= DEFAULT_THRESHOLD]
+        new_terms = stems - known
+        return {
+            "era_terms": era_hits,
+            "new_entities": new_entities(chunk, known),
+            "new_terms": len(new_terms),
+            "terms": len(stems),
+            "novelty": round(len(new_terms) / len(stems), 3) if stems else 0.0,
+        }
+
+    def decide(self, story_state, chunk, skipped=0):
+        """Action for a turn ("analyze", "defer" or "skip") and its novelty features.
+
+        Args:
+            skipped: consecutive turns skipped just before this one
+        """
+        features = self.novelty(story_state, chunk)
+        if features["era_terms"] or features["novelty"] >= self.analyze_ratio:
+            action = "analyze"
+        elif features["new_entities"] or features["novelty"] >= self.defer_ratio:
+            action = "defer"
+        elif skipped >= self.max_skipped:
+            action = "defer"
+            features["forced"] = True
+        else:
+            action = "skip"
+        return action, features
+
+    def schedule(self, pending, turn_id, chunk, action):
+        """Turns to analyze now after the action on a turn, and the turns left pending.
+
+        Args:
+            pending: list of (turn_id, chunk) deferred so far
+
+        Returns:
+            (list of (turn_id, chunk) to analyze now, possibly empty; new pending list)
+        """
+        if action == "analyze":
+            return pending + [(turn_id, chunk)], []
+        if action == "defer":
+            pending = pending + [(turn_id, chunk)]
+            if len(pending) >= self.max_batch:
+                return pending, []
+            return [], pending
+        # Deferred turns keep waiting for a turn to share the request with (max_skipped bounds the wait)
+        return [], pending
+
+    def analyze(self, story_state, chunk, turn_id):
+        """Gated replacement of update_state_from_output for one turn (state updated in place)."""
+        gate_state = story_state.setdefault(STATE_KEY, {"pending": [], "skipped": 0})
+        action, features = self.decide(story_state, chunk, gate_state["skipped"])
+        batch, gate_state["pending"] = self.schedule(
+            [tuple(entry) for entry in gate_state["pending"]], turn_id, chunk, action)
+        gate_state["skipped"] = gate_state["skipped"] + 1 if action == "skip" else 0
+        with self._lock:
+            self._stats["turns"] += 1
+            self._stats[action] += 1
+            self._stats["forced"] += 1 if features.get("forced") else 0
+            self._stats["novelty_sum"] += features["novelty"]
+        if action == "skip" and self.measure_recall:
+            # Everything a per-turn analysis finds in a skipped turn is missed
+            self._measure(story_state, [self._shadow(story_state, chunk, turn_id)], [])
+        if batch:
+            try:
+                self._run(story_state, batch, chunk)
+            except DeadlineExceeded:
+                # The turns deferred earlier wait for the next batch (or the flush);
+                # the current one follows the degraded path of the session
+                requeued = [entry for entry in batch if entry[0] != turn_id]
+                gate_state["pending"] = requeued + gate_state["pending"]
+                with self._lock:
+                    self._stats["requeued"] += len(requeued)
+                raise
+
+    def flush(self, story_state):
+        """Analyze the turns still deferred (end of session) and drop the gate bookkeeping."""
+        gate_state = story_state.pop(STATE_KEY, None)
+        if gate_state and gate_state["pending"]:
+            batch = [tuple(entry) for entry in gate_state["pending"]]
+            try:
+                self._run(story_state, batch, None)
+            except DeadlineExceeded:
+                with self._lock:
+                    self._stats["unanalyzed"] += len(batch)
+                raise
+
+    def _run(self, story_state, batch, current_chunk):
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["batched_turns"] += len(batch) if len(batch) > 1 else 0
+        from reanalyze import analyze_batch
+        before = len(story_state.get("inconsistencies", []))
+        try:
+            if len(batch) == 1:
+                turn_id, chunk = batch[0]
+                update_state_from_output(story_state, chunk, turn_id)
+                if self.measure_recall:
+                    # Analyzed alone: the gate keeps exactly what a per-turn analysis finds
+                    found = story_state.get("inconsistencies", [])[before:]
+                    self._measure(story_state, [found], found)
+                return
+            with tracing.span("analysis_batch", turns=len(batch)):
+                sections, calls = analyze_batch(story_state, batch)
+        except DeadlineExceeded as e:
+            # Degraded path of run_story_session: the turn being generated keeps its chunk
+            e.phase = "analysis"
+            e.story_chunk = current_chunk
+            raise
+        except Exception as e:
+            print(f"[WARNING] Unable to analyze turns {batch[0][0]}-{batch[-1][0]}: {e}")
+            with self._lock:
+                self._stats["unanalyzed"] += len(batch)
+            return
+        with self._lock:
+            self._stats["requests"] += calls - 1  # single-turn retries of missing sections
+        with tracing.span("state_merge"):
+            for turn_id, chunk in batch:
+                apply_analysis_result(story_state, sections[turn_id], chunk, turn_id)
+        if self.measure_recall:
+            found = story_state["inconsistencies"][before:]
+            self._measure(story_state, [self._shadow(story_state, chunk, turn_id) for turn_id, chunk in batch],
+                          found)
+
+    def _shadow(self, story_state, chunk, turn_id):
+        """Violations of a per-turn analysis of a turn (None if the call failed), outside the run usage."""
+        try:
+            with self._shadow_usage.activate():
+                answer = call_gemini(build_analysis_prompt(story_state, chunk),
+                                     temperature=generation_settings.get("analysis_temperature"),
+                                     call_type="analysis")
+        except Exception as e:
+            print(f"[WARNING] Recall measurement failed on turn {turn_id}: {e}")
+            return None
+        with self._lock:
+            self._stats["shadow_calls"] += 1
+        return parsed_violations(answer, chunk, turn_id)
+
+    def _measure(self, story_state, references, detected):
+        """Add per-turn reference violations (lists, None = not measured) and how many the gate kept."""
+        ignore_terms = character_terms(story_state.get("characters"))
+        for reference in references:
+            if reference is None:
+                continue
+            turns = {violation.get("turn") for violation in reference}
+            kept = [violation for violation in detected if violation.get("turn") in turns]
+            matched = matched_violations(reference, kept, ignore_terms)
+            with self._lock:
+                self._stats["reference_violations"] += len(reference)
+                self._stats["matched_violations"] += matched
+
+    def get_stats(self):
+        """Decision counts, requests sent and the analysis calls saved versus one per turn."""
+        with self._lock:
+            stats = dict(self._stats)
+        turns = stats["turns"]
+        stats["mean_novelty"] = round(stats.pop("novelty_sum") / turns, 3) if turns else None
+        stats["calls_saved"] = turns - stats["requests"]
+        stats["calls_saved_rate"] = round(stats["calls_saved"] / turns, 3) if turns else None
+        reference = stats["reference_violations"]
+        stats["violation_recall"] = round(stats["matched_violations"] / reference, 3) if reference else None
+        if self.measure_recall:
+            stats["shadow_cost_usd"] = self._shadow_usage.summary()["cost_usd"]
+        return stats
+
+
+def evaluate_runs(runs, config, gate, measure=False):
+    """Replay a gate over stored runs (analyzed every turn).
+
+    The state before turn t is rebuilt from the stored facts, items and
+    inconsistencies created before t; a turn is covered if the gate analyzes
+    it now or in a later batch. Coverage is the share of the stored
+    inconsistencies (and facts) on covered turns: an upper bound of recall,
+    since it assumes a batched analysis finds what a per-turn one found.
+
+    With measure, every batch of more than one turn is analyzed again with
+    analyze_batch (model calls, through the configured client) and recall is
+    the share of the stored inconsistencies matched (same ViolationIndex
+    cluster) by the batched answer of their turn. Turns analyzed alone count
+    as found, skipped turns as missed.
+
+    Args:
+        runs: list of (method, run) with story_text and story_state
+        config: story config (world, characters, plot)
+        measure: re-run the batched analyses to measure recall
+
+    Returns:
+        dict method -> turns, requests, calls_saved_rate, inconsistency_coverage, fact_coverage,
+        inconsistency_recall (None without measure), measure_calls, decisions
+    """
+    from reanalyze import analyze_batch, initial_state, split_story_text
+
+    ignore_terms = character_terms(config.get("characters"))
+    totals = {}
+    for method, run in runs:
+        chunks = split_story_text(run.get("story_text"))
+        stored = run.get("story_state") or {}
+        base = initial_state(config)
+        initial_facts = len(base["facts"])
+        entry = totals.setdefault(method, {"turns": 0, "requests": 0, "inconsistencies": 0, "covered": 0,
+                                           "matched": 0, "measure_calls": 0, "facts": 0, "facts_kept": 0,
+                                           "decisions": {action: 0 for action in ACTIONS}})
+        batches = []
+        pending, skipped = [], 0
+        for turn, chunk in enumerate(chunks):
+            state = dict(base)
+            state["facts"] = base["facts"] + [f for f in stored.get("facts", [])[initial_facts:]
+                                              if f.get("turn_created", 0) < turn]
+            state["items"] = [i for i in stored.get("items", []) if i.get("discovered_turn", 0) < turn]
+            state["inconsistencies"] = [i for i in stored.get("inconsistencies", []) if i.get("turn", 0) < turn]
+            state["history"] = [{"user": "", "assistant": text} for text in chunks[:turn]]
+            action, _ = gate.decide(state, chunk, skipped)
+            batch, pending = gate.schedule(pending, turn, chunk, action)
+            skipped = skipped + 1 if action == "skip" else 0
+            entry["decisions"][action] += 1
+            if batch:
+                batches.append(batch)
+        if pending:
+            batches.append(pending)
+
+        inconsistencies = stored.get("inconsistencies", [])
+        by_turn = {}
+        for inc in inconsistencies:
+            by_turn.setdefault(inc.get("turn"), []).append(inc)
+        analyzed = set()
+        for batch in batches:
+            analyzed.update(turn_id for turn_id, _ in batch)
+            if len(batch) == 1:
+                entry["matched"] += len(by_turn.get(batch[0][0], []))
+            elif measure:
+                sections, calls = analyze_batch(base, batch)
+                entry["measure_calls"] += calls
+                for turn_id, chunk in batch:
+                    detected = parsed_violations(sections[turn_id], chunk, turn_id)
+                    entry["matched"] += matched_violations(by_turn.get(turn_id, []), detected, ignore_terms)
+
+        entry["requests"] += len(batches)
+        entry["turns"] += len(chunks)
+        entry["inconsistencies"] += len(inconsistencies)
+        entry["covered"] += sum(1 for inc in inconsistencies if inc.get("turn") in analyzed)
+        facts = stored.get("facts", [])[initial_facts:]
+        entry["facts"] += len(facts)
+        entry["facts_kept"] += sum(1 for fact in facts if fact.get("turn_created") in analyzed)
+
+    report = {}
+    for method, entry in sorted(totals.items()):
+        report[method] = {
+            "turns": entry["turns"],
+            "requests": entry["requests"],
+            "calls_saved_rate": round(1 - entry["requests"] / entry["turns"], 3) if entry["turns"] else None,
+            "inconsistency_coverage": round(entry["covered"] / entry["inconsistencies"], 3)
+            if entry["inconsistencies"] else None,
+            "fact_coverage": round(entry["facts_kept"] / entry["facts"], 3) if entry["facts"] else None,
+            "inconsistency_recall": round(entry["matched"] / entry["inconsistencies"], 3)
+            if measure and entry["inconsistencies"] else None,
+            "measure_calls": entry["measure_calls"],
+            "decisions": entry["decisions"],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    from persona_utils import load_story_config
+    from reanalyze import load_run_files
+
+    parser = argparse.ArgumentParser(description="Calls saved and recall of the analysis gate on stored runs")
+    parser.add_argument("--input", type=str, required=True, help="Results directory (method_X_run_N.json files)")
+    parser.add_argument("--analyze-ratio", type=float, default=DEFAULT_ANALYZE_RATIO,
+                        help=f"Novelty to analyze a turn now. Default: {DEFAULT_ANALYZE_RATIO}")
+    parser.add_argument("--defer-ratio", type=float, default=DEFAULT_DEFER_RATIO,
+                        help=f"Novelty to defer a turn (skip below). Default: {DEFAULT_DEFER_RATIO}")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help=f"Turns per batched analysis request. Default: {DEFAULT_MAX_BATCH}")
+    parser.add_argument("--max-skipped", type=int, default=DEFAULT_MAX_SKIPPED,
+                        help=f"Consecutive skipped turns before forcing an analysis. Default: {DEFAULT_MAX_SKIPPED}")
+    parser.add_argument("--measure", action="store_true",
+                        help="Re-run the batched analyses (model calls) to measure recall against the stored ones")
+    args = parser.parse_args()
+
+    gate = AnalysisGate(args.analyze_ratio, args.defer_ratio, args.max_batch, args.max_skipped)
+    report = evaluate_runs(load_run_files(args.input), load_story_config(verbose=False), gate, measure=args.measure)
+    for method, entry in report.items():
+        decisions = ", ".join(f"{action} {count}" for action, count in entry["decisions"].items())
+        print(f"Method {method}: {entry['turns']} turns -> {entry['requests']} analysis requests "
+              f"({entry['calls_saved_rate']:.0%} saved; {decisions})")
+        print(f"  Coverage of the always-on analysis: inconsistencies {entry['inconsistency_coverage']}, "
+              f"facts {entry['fact_coverage']}")
+        if args.measure:
+            print(f"  Measured inconsistency recall: {entry['inconsistency_recall']} "
+                  f"({entry['measure_calls']} analysis calls)")
@@ -1,43 +1,72 @@
 """
 Script to analyze metrics and generate comparative graphs.
-Reads results from comparison_results.json and produces visualizations.
+Reads results from the columnar store written by compare (columnar/, see
+columnar_store.py) or, for older results, from comparison_results.json, and
+produces visualizations.
+
+Charts whose input columns did not change since the last run are not
+redrawn (content hashes in <output>/.chart_cache.json); the others render in
+parallel worker processes. Previews go to <output>/preview/ with their own
+cache manifest, so they never replace the full-resolution charts.
 
 Usage:
     python analyze_metrics.py --input comparison_results/comparison_results.json
     python analyze_metrics.py --input comparison_results/ --output graphs/
+    python analyze_metrics.py --input comparison_results/ --preview   # fast 72-dpi charts in <output>/preview/
 """
 
 import argparse
+import hashlib
+import inspect
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import matplotlib
+matplotlib.use("Agg")  # Non-interactive backend: also used by the plot worker processes
 import matplotlib.pyplot as plt
 import numpy as np
 
+from blob_store import load_results
+from columnar_store import STORE_DIRNAME, from_results, open_store
+from experiment_stats import bootstrap_ci, compare_methods, cumulative_curve, method_stats
+
+def _ci_errors(data, method, columns, scales):
+    """Asymmetric error bars (2 x len(columns)) from bootstrap CIs of the means."""
+    errors = np.zeros((2, len(columns)))
+    for i, (column, scale) in enumerate(zip(columns, scales)):
+        values = data.column(column, method)
+        low, high = bootstrap_ci(values, rng=np.random.default_rng(0))
+        mean = np.nanmean(values) if values.size else np.nan
+        if not np.isnan(low):
+            errors[:, i] = [(mean - low) * scale, (high - mean) * scale]
+    return errors
+
 def load_comparison_data(input_path):
-    """Load comparison data."""
+    """Load comparison data as ColumnarResults.
+    
+    A directory with a columnar store is memory-mapped (story text is only read
+    on demand); JSON results are loaded (blob references resolved) and converted
+    in memory.
+    """
     path = Path(input_path)
     
     if path.is_file():
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return from_results(load_results(path))
     elif path.is_dir():
-        # Try full file first (has story_state)
-        results_file_full = path / "comparison_results_full.json"
-        if results_file_full.exists():
-            with open(results_file_full, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        # Otherwise use light version
-        results_file = path / "comparison_results.json"
-        if results_file.exists():
-            with open(results_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        if (path / STORE_DIRNAME / "meta.json").exists():
+            return open_store(path / STORE_DIRNAME)
+        # Full file first (has story_state), otherwise the light version
+        if (path / "comparison_results_full.json").exists() or (path / "comparison_results.json").exists():
+            return from_results(load_results(path))
     
     raise FileNotFoundError(f"Results file not found in: {input_path}")
 
-def plot_inconsistencies_comparison(data, output_dir):
+def plot_inconsistencies_comparison(data, output_dir, dpi=300):
     """Bar chart: total inconsistencies Method A vs B."""
-    stats_a = data["summary"]["method_A_stats"]
-    stats_b = data["summary"]["method_B_stats"]
+    stats_a = method_stats(data, "A")
+    stats_b = method_stats(data, "B")
     
     categories = ['Total\nInconsistencies', 'Repeated\nInconsistencies', 'Inconsistency\nRate/Turn']
     method_a_values = [
@@ -55,10 +84,15 @@ def plot_inconsistencies_comparison(data, output_dir):
     width = 0.35
     
     fig, ax = plt.subplots(figsize=(10, 6))
-    bars1 = ax.bar(x - width/2, method_a_values, width, label='Method A (with learning)', color='#2ecc71')
-    bars2 = ax.bar(x + width/2, method_b_values, width, label='Method B (without learning)', color='#e74c3c')
-    
-    ax.set_ylabel('Average Value')
+    # Error bars: 95% bootstrap CI of the mean
+    ci_columns = ["total_inconsistencies", "repeated_inconsistencies", "inconsistency_rate"]
+    ci_scales = [1, 1, 10]
+    bars1 = ax.bar(x - width/2, method_a_values, width, label='Method A (with learning)', color='#2ecc71',
+                   yerr=_ci_errors(data, "A", ci_columns, ci_scales), capsize=4)
+    bars2 = ax.bar(x + width/2, method_b_values, width, label='Method B (without learning)', color='#e74c3c',
+                   yerr=_ci_errors(data, "B", ci_columns, ci_scales), capsize=4)
+    
+    ax.set_ylabel('Average Value (95% CI)')
     ax.set_title('Inconsistencies Comparison: Method A vs B')
     ax.set_xticks(x)
     ax.set_xticklabels(categories)
@@ -74,14 +108,13 @@ def plot_inconsistencies_comparison(data, output_dir):
                    ha='center', va='bottom', fontsize=9)
     
     plt.tight_layout()
-    plt.savefig(Path(output_dir) / 'inconsistencies_comparison.png', dpi=300)
-    print(f"Saved: inconsistencies_comparison.png")
+    plt.savefig(Path(output_dir) / 'inconsistencies_comparison.png', dpi=dpi)
     plt.close()
 
-def plot_facts_objects_comparison(data, output_dir):
+def plot_facts_objects_comparison(data, output_dir, dpi=300):
     """Bar chart: facts and objects."""
-    stats_a = data["summary"]["method_A_stats"]
-    stats_b = data["summary"]["method_B_stats"]
+    stats_a = method_stats(data, "A")
+    stats_b = method_stats(data, "B")
     
     categories = ['Facts', 'Objects']
     method_a_values = [stats_a['avg_facts'], stats_a['avg_objects']]
@@ -109,20 +142,15 @@ def plot_facts_objects_comparison(data, output_dir):
                    ha='center', va='bottom', fontsize=10)
     
     plt.tight_layout()
-    plt.savefig(Path(output_dir) / 'facts_objects_comparison.png', dpi=300)
-    print(f"Saved: facts_objects_comparison.png")
+    plt.savefig(Path(output_dir) / 'facts_objects_comparison.png', dpi=dpi)
     plt.close()
 
-def plot_turn_length_distribution(data, output_dir):
+def plot_turn_length_distribution(data, output_dir, dpi=300):
     """Boxplot: turn length distribution."""
-    all_lengths_a = []
-    all_lengths_b = []
-    
-    for run in data["method_A"]:
-        all_lengths_a.extend(run["turn_lengths"])
-    
-    for run in data["method_B"]:
-        all_lengths_b.extend(run["turn_lengths"])
+    all_lengths_a = data.column("turn_lengths", "A")
+    all_lengths_b = data.column("turn_lengths", "B")
+    all_lengths_a = all_lengths_a[~np.isnan(all_lengths_a)]
+    all_lengths_b = all_lengths_b[~np.isnan(all_lengths_b)]
     
     fig, ax = plt.subplots(figsize=(10, 6))
     bp = ax.boxplot([all_lengths_a, all_lengths_b], 
@@ -139,117 +167,152 @@ def plot_turn_length_distribution(data, output_dir):
     ax.grid(axis='y', alpha=0.3)
     
     plt.tight_layout()
-    plt.savefig(Path(output_dir) / 'turn_length_distribution.png', dpi=300)
-    print(f"Saved: turn_length_distribution.png")
+    plt.savefig(Path(output_dir) / 'turn_length_distribution.png', dpi=dpi)
     plt.close()
 
-def plot_facts_accumulation(data, output_dir):
-    """Line chart: facts accumulation over time for each run."""
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
-    
-    # Method A
-    for i, run in enumerate(data["method_A"]):
-        # Skip if no story_state (light version)
-        if "story_state" not in run:
-            continue
-        facts_per_turn = {}
-        for fact in run["story_state"]["facts"]:
-            turn = fact.get("turn_created", 0)
-            facts_per_turn[turn] = facts_per_turn.get(turn, 0) + 1
+def plot_facts_accumulation(data, output_dir, dpi=300):
+    """Line chart: facts accumulation over time for each run, with the mean and its 95% CI."""
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    
+    for ax, method in zip(axes, ["A", "B"]):
+        facts_by_turn = data.column("facts_by_turn", method)
+        turns = np.arange(facts_by_turn.shape[1])
+        for i, per_turn in enumerate(facts_by_turn):
+            # Skip if no story_state (light version)
+            if np.isnan(per_turn).all():
+                continue
+            ax.plot(turns, np.cumsum(per_turn), marker='o', label=f'Run {i+1}', alpha=0.4)
         
-        if facts_per_turn:
-            turns = sorted(facts_per_turn.keys())
-            cumulative = np.cumsum([facts_per_turn[t] for t in turns])
-            ax1.plot(turns, cumulative, marker='o', label=f'Run {i+1}', alpha=0.7)
-    
-    ax1.set_xlabel('Turn')
-    ax1.set_ylabel('Accumulated Facts')
-    ax1.set_title('Method A: Facts Accumulation')
-    ax1.legend()
-    ax1.grid(alpha=0.3)
-    
-    # Method B
-    for i, run in enumerate(data["method_B"]):
-        # Skip if no story_state (light version)
-        if "story_state" not in run:
-            continue
-        facts_per_turn = {}
-        for fact in run["story_state"]["facts"]:
-            turn = fact.get("turn_created", 0)
-            facts_per_turn[turn] = facts_per_turn.get(turn, 0) + 1
+        curve = cumulative_curve(facts_by_turn, rng=np.random.default_rng(0))
+        if curve is not None:
+            ax.plot(turns, curve["mean"], color='black', linewidth=2, label='Mean')
+            ax.fill_between(turns, curve["low"], curve["high"], color='black', alpha=0.15, label='95% CI')
         
-        if facts_per_turn:
-            turns = sorted(facts_per_turn.keys())
-            cumulative = np.cumsum([facts_per_turn[t] for t in turns])
-            ax2.plot(turns, cumulative, marker='o', label=f'Run {i+1}', alpha=0.7)
-    
-    ax2.set_xlabel('Turn')
-    ax2.set_ylabel('Accumulated Facts')
-    ax2.set_title('Method B: Facts Accumulation')
-    ax2.legend()
-    ax2.grid(alpha=0.3)
+        ax.set_xlabel('Turn')
+        ax.set_ylabel('Accumulated Facts')
+        ax.set_title(f'Method {method}: Facts Accumulation')
+        ax.legend()
+        ax.grid(alpha=0.3)
     
     plt.tight_layout()
-    plt.savefig(Path(output_dir) / 'facts_accumulation.png', dpi=300)
-    print(f"Saved: facts_accumulation.png")
+    plt.savefig(Path(output_dir) / 'facts_accumulation.png', dpi=dpi)
     plt.close()
 
-def plot_inconsistencies_by_turn(data, output_dir):
+def plot_inconsistencies_by_turn(data, output_dir, dpi=300):
     """Chart: when inconsistencies appear."""
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    
+    for ax, method, color in zip(axes, ["A", "B"], ['#2ecc71', '#e74c3c']):
+        # Runs without story_state are NaN and count as zero
+        totals = np.nansum(data.column("inconsistencies_by_turn", method), axis=0)
+        if totals.any():
+            last = int(np.flatnonzero(totals)[-1])
+            ax.bar(np.arange(last + 1), totals[:last + 1], width=1, align='edge',
+                   edgecolor='black', color=color, alpha=0.7)
+        ax.set_xlabel('Turn')
+        ax.set_ylabel('Number of Inconsistencies')
+        ax.set_title(f'Method {method}: Inconsistencies Distribution by Turn')
+        ax.grid(axis='y', alpha=0.3)
     
-    # Method A
-    turns_a = []
-    for run in data["method_A"]:
-        # Skip if no story_state
-        if "story_state" not in run:
-            continue
-        for inc in run["story_state"]["inconsistencies"]:
-            turns_a.append(inc["turn"])
-    
-    if turns_a:
-        ax1.hist(turns_a, bins=range(0, max(turns_a)+2), edgecolor='black', color='#2ecc71', alpha=0.7)
-    ax1.set_xlabel('Turn')
-    ax1.set_ylabel('Number of Inconsistencies')
-    ax1.set_title('Method A: Inconsistencies Distribution by Turn')
-    ax1.grid(axis='y', alpha=0.3)
-    
-    # Method B
-    turns_b = []
-    for run in data["method_B"]:
-        # Skip if no story_state
-        if "story_state" not in run:
+    plt.tight_layout()
+    plt.savefig(Path(output_dir) / 'inconsistencies_by_turn.png', dpi=dpi)
+    plt.close()
+
+def plot_tokens_per_turn(data, output_dir, dpi=300):
+    """Line chart: average prompt and output tokens per turn, Method A vs B."""
+    if np.isnan(data.column("prompt_tokens_by_turn")).all():
+        print("Skipped: tokens_per_turn.png (no token usage in results)")
+        return False
+    
+    fig, ax = plt.subplots(figsize=(10, 6))
+    turns = np.arange(1, data.max_turns + 1)
+    for method, color in [("A", '#2ecc71'), ("B", '#e74c3c')]:
+        prompt = data.column("prompt_tokens_by_turn", method)
+        output = data.column("output_tokens_by_turn", method)
+        # Turns no run of this method reached stay out of the lines
+        reached = ~np.isnan(prompt).all(axis=0)
+        if not reached.any():
             continue
-        for inc in run["story_state"]["inconsistencies"]:
-            turns_b.append(inc["turn"])
+        ax.plot(turns[reached], np.nanmean(prompt[:, reached], axis=0), marker='o', color=color,
+                label=f'Method {method} - prompt tokens')
+        ax.plot(turns[reached], np.nanmean(output[:, reached], axis=0), marker='s', linestyle='--', color=color,
+                label=f'Method {method} - output tokens')
+    
+    ax.set_xlabel('Turn')
+    ax.set_ylabel('Average Tokens (generation + analysis)')
+    ax.set_title('Tokens per Turn: Method A vs B')
+    ax.legend()
+    ax.grid(alpha=0.3)
+    
+    plt.tight_layout()
+    plt.savefig(Path(output_dir) / 'tokens_per_turn.png', dpi=dpi)
+    plt.close()
+
+def _mean_cost(data, method):
+    """Average cost per run of a method (None without token usage)."""
+    costs = data.column("cost_usd", method)
+    costs = costs[~np.isnan(costs)]
+    return float(costs.mean()) if costs.size else None
+
+def cost_per_avoided_inconsistency(data):
+    """Extra cost per run of Method A divided by the inconsistencies it avoids per run.
+    
+    Returns None without token usage or if Method A avoids no inconsistency.
+    """
+    cost_a = _mean_cost(data, "A")
+    cost_b = _mean_cost(data, "B")
+    if cost_a is None or cost_b is None:
+        return None
+    avoided = (data.column("total_inconsistencies", "B").mean()
+               - data.column("total_inconsistencies", "A").mean())
+    if avoided <= 0:
+        return None
+    return float((cost_a - cost_b) / avoided)
+
+def plot_cost_comparison(data, output_dir, dpi=300):
+    """Bar chart: average cost per run, with the cost per avoided inconsistency."""
+    cost_a = _mean_cost(data, "A")
+    cost_b = _mean_cost(data, "B")
+    if cost_a is None or cost_b is None:
+        print("Skipped: cost_comparison.png (no token usage in results)")
+        return False
     
-    if turns_b:
-        ax2.hist(turns_b, bins=range(0, max(turns_b)+2), edgecolor='black', color='#e74c3c', alpha=0.7)
-    ax2.set_xlabel('Turn')
-    ax2.set_ylabel('Number of Inconsistencies')
-    ax2.set_title('Method B: Inconsistencies Distribution by Turn')
-    ax2.grid(axis='y', alpha=0.3)
+    per_avoided = cost_per_avoided_inconsistency(data)
+    
+    fig, ax = plt.subplots(figsize=(8, 6))
+    bars = ax.bar(['Method A', 'Method B'], [cost_a, cost_b], color=['#2ecc71', '#e74c3c'], alpha=0.8)
+    for bar in bars:
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height, f'${height:.5f}',
+                ha='center', va='bottom', fontsize=10)
+    
+    if per_avoided is not None:
+        subtitle = f'Cost per avoided inconsistency: ${per_avoided:.5f}'
+    else:
+        subtitle = 'Cost per avoided inconsistency: n/a (no inconsistency avoided)'
+    ax.set_ylabel('Average Cost per Run (USD)')
+    ax.set_title('Cost Comparison: Method A vs B\n' + subtitle)
+    ax.grid(axis='y', alpha=0.3)
     
     plt.tight_layout()
-    plt.savefig(Path(output_dir) / 'inconsistencies_by_turn.png', dpi=300)
-    print(f"Saved: inconsistencies_by_turn.png")
+    plt.savefig(Path(output_dir) / 'cost_comparison.png', dpi=dpi)
     plt.close()
 
 def generate_summary_report(data, output_dir):
     """Generate text summary report."""
     report_path = Path(output_dir) / "analysis_report.txt"
     
-    stats_a = data["summary"]["method_A_stats"]
-    stats_b = data["summary"]["method_B_stats"]
+    stats_a = method_stats(data, "A")
+    stats_b = method_stats(data, "B")
     
     with open(report_path, 'w', encoding='utf-8') as f:
         f.write("="*70 + "\n")
         f.write("COMPARATIVE ANALYSIS REPORT: METHOD A vs B\n")
         f.write("="*70 + "\n\n")
         
-        f.write(f"Experiment date: {data['experiment']['date']}\n")
-        f.write(f"Runs per method: {data['experiment']['runs_per_method']}\n")
-        f.write(f"Turns per story: {data['experiment']['turns_per_story']}\n\n")
+        f.write(f"Experiment date: {data.experiment['date']}\n")
+        f.write(f"Runs per method: {data.experiment['runs_per_method']}\n")
+        f.write(f"Turns per story: {data.experiment['turns_per_story']}\n\n")
         
         f.write("AGGREGATED METRICS\n")
         f.write("-"*70 + "\n\n")
@@ -272,11 +335,126 @@ def generate_summary_report(data, output_dir):
         if stats_b['avg_repeated_inconsistencies'] > 0:
             improvement_rep = ((stats_b['avg_repeated_inconsistencies'] - stats_a['avg_repeated_inconsistencies']) / stats_b['avg_repeated_inconsistencies'] * 100)
             f.write(f"  - Repeated inconsistency reduction: {improvement_rep:.1f}%\n")
+        
+        # Token usage (missing in results saved before token accounting)
+        if _mean_cost(data, "A") is not None and _mean_cost(data, "B") is not None:
+            f.write(f"\nTOKEN USAGE AND COST\n")
+            f.write("-"*70 + "\n")
+            f.write(f"{'Avg prompt tokens/run':<40} {stats_a['avg_prompt_tokens']:<15} {stats_b['avg_prompt_tokens']:<15}\n")
+            f.write(f"{'Avg output tokens/run':<40} {stats_a['avg_output_tokens']:<15} {stats_b['avg_output_tokens']:<15}\n")
+            f.write(f"{'Avg cost/run (USD)':<40} {stats_a['avg_cost_usd']:<15} {stats_b['avg_cost_usd']:<15}\n")
+            per_avoided = cost_per_avoided_inconsistency(data)
+            if per_avoided is not None:
+                f.write(f"{'Cost per avoided inconsistency (USD)':<40} {per_avoided:.6f}\n")
+        
+        # Uncertainty: bootstrap CIs of the means and permutation tests of A - B
+        comparison = compare_methods(data)
+        if comparison:
+            f.write(f"\nSTATISTICAL COMPARISON (95% bootstrap CI, permutation test)\n")
+            f.write("-"*70 + "\n")
+            for metric, c in comparison.items():
+                f.write(f"{metric}\n")
+                f.write(f"  Method A: mean {c['mean_A']:.4g} [{c['ci_A'][0]:.4g}, {c['ci_A'][1]:.4g}], median {c['median_A']:.4g}\n")
+                f.write(f"  Method B: mean {c['mean_B']:.4g} [{c['ci_B'][0]:.4g}, {c['ci_B'][1]:.4g}], median {c['median_B']:.4g}\n")
+                f.write(f"  A - B:    {c['diff']:.4g} [{c['ci_diff'][0]:.4g}, {c['ci_diff'][1]:.4g}], p = {c['p_value']:.4f}\n")
     
     print(f"Saved: analysis_report.txt")
 
-def analyze_and_plot(input_path, output_dir):
-    """Main function for complete analysis."""
+# Chart file -> (plot function, columns it reads): the columns feed the cache key
+CHARTS = {
+    "inconsistencies_comparison.png": (plot_inconsistencies_comparison,
+                                       ["method", "total_inconsistencies", "repeated_inconsistencies",
+                                        "inconsistency_rate"]),
+    "facts_objects_comparison.png": (plot_facts_objects_comparison, ["method", "total_facts", "total_objects"]),
+    "turn_length_distribution.png": (plot_turn_length_distribution, ["method", "turn_lengths"]),
+    "facts_accumulation.png": (plot_facts_accumulation, ["method", "facts_by_turn"]),
+    "inconsistencies_by_turn.png": (plot_inconsistencies_by_turn, ["method", "inconsistencies_by_turn"]),
+    "tokens_per_turn.png": (plot_tokens_per_turn, ["method", "prompt_tokens_by_turn", "output_tokens_by_turn"]),
+    "cost_comparison.png": (plot_cost_comparison, ["method", "cost_usd", "total_inconsistencies"]),
+}
+
+CACHE_FILENAME = ".chart_cache.json"
+PREVIEW_DPI = 72
+PREVIEW_DIRNAME = "preview"  # previews (and their cache manifest) live in <output>/preview/
+
+def chart_hash(data, chart, dpi):
+    """Content hash of what a chart depends on: its input columns, dpi and plot code."""
+    function, columns = CHARTS[chart]
+    digest = hashlib.sha256()
+    digest.update(f"{chart}|{dpi}|".encode("utf-8"))
+    digest.update(inspect.getsource(function).encode("utf-8"))
+    for name in columns:
+        values = np.ascontiguousarray(data.column(name))
+        digest.update(f"|{name}|{values.dtype}|{values.shape}|".encode("utf-8"))
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+def _render_chart(data, chart, output_dir, dpi):
+    """Draw one chart; returns (chart, seconds, rendered)."""
+    function, _ = CHARTS[chart]
+    start = time.perf_counter()
+    rendered = function(data, output_dir, dpi=dpi) is not False
+    plt.close('all')
+    return chart, time.perf_counter() - start, rendered
+
+def render_charts(data, output_dir, dpi=300, workers=None, force=False):
+    """Render the charts whose inputs changed, in parallel processes.
+    
+    Args:
+        data: ColumnarResults
+        output_dir: directory of the PNG files (and of the cache manifest)
+        dpi: resolution (PREVIEW_DPI for quick previews)
+        workers: worker processes (None = one per chart up to the CPU count, 1 = inline)
+        force: redraw every chart regardless of the cache
+        
+    Returns:
+        dict chart -> seconds spent rendering (0.0 when cached or skipped)
+    """
+    output_path = Path(output_dir)
+    cache_path = output_path / CACHE_FILENAME
+    cache = {}
+    if cache_path.exists() and not force:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    
+    hashes = {chart: chart_hash(data, chart, dpi) for chart in CHARTS}
+    to_render = []
+    timings = {}
+    for chart, digest in hashes.items():
+        if cache.get(chart) == digest and (output_path / chart).exists():
+            timings[chart] = 0.0
+            print(f"Cached: {chart}")
+        else:
+            to_render.append(chart)
+    
+    if workers is None:
+        workers = min(len(to_render), os.cpu_count() or 1)
+    if workers <= 1:
+        results = [_render_chart(data, chart, output_path, dpi) for chart in to_render]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_render_chart, data, chart, output_path, dpi) for chart in to_render]
+            results = [future.result() for future in futures]
+    
+    for chart, seconds, rendered in results:
+        if rendered:
+            timings[chart] = seconds
+            cache[chart] = hashes[chart]
+            print(f"Saved: {chart} ({seconds:.2f} s)")
+        else:
+            timings[chart] = 0.0
+            cache.pop(chart, None)
+    
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2)
+    return timings
+
+def analyze_and_plot(input_path, output_dir, preview=False, workers=None, force=False):
+    """Main function for complete analysis.
+    
+    preview: low-dpi charts for a quick look, written to <output_dir>/preview/
+    (own files and cache manifest: the full-resolution charts stay as they are)
+    """
     print(f"\nMETRICS ANALYSIS")
     print(f"   Input: {input_path}")
     print(f"   Output: {output_dir}\n")
@@ -290,24 +468,33 @@ def analyze_and_plot(input_path, output_dir):
     
     # Generate all charts
     print("Generating charts...")
-    plot_inconsistencies_comparison(data, output_path)
-    plot_facts_objects_comparison(data, output_path)
-    plot_turn_length_distribution(data, output_path)
-    plot_facts_accumulation(data, output_path)
-    plot_inconsistencies_by_turn(data, output_path)
+    start = time.perf_counter()
+    charts_path = output_path / PREVIEW_DIRNAME if preview else output_path
+    charts_path.mkdir(exist_ok=True)
+    timings = render_charts(data, charts_path, dpi=PREVIEW_DPI if preview else 300,
+                            workers=workers, force=force)
+    print(f"Charts ready in {time.perf_counter() - start:.2f} s")
+    slowest = max(timings, key=timings.get)
+    if timings[slowest] > 0:
+        print(f"Slowest chart: {slowest} ({timings[slowest]:.2f} s)")
     
     # Generate text report
     generate_summary_report(data, output_path)
     
     print(f"\nANALYSIS COMPLETE")
-    print(f"   Charts saved in: {output_path}")
+    print(f"   Charts saved in: {charts_path}")
     print(f"   Text report: {output_path / 'analysis_report.txt'}")
+    return timings
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Analyze metrics and generate charts")
     parser.add_argument("--input", type=str, required=True, help="File or directory with comparison_results.json")
     parser.add_argument("--output", type=str, default="analysis_graphs", help="Output directory for charts")
+    parser.add_argument("--preview", action="store_true", help=f"Fast low-resolution charts ({PREVIEW_DPI} dpi)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Chart worker processes (1 = render inline). Default: one per chart, up to the CPU count")
+    parser.add_argument("--force", action="store_true", help="Redraw every chart, ignoring the cache")
     
     args = parser.parse_args()
     
-    analyze_and_plot(args.input, args.output)
+    analyze_and_plot(args.input, args.output, preview=args.preview, workers=args.workers, force=args.force)
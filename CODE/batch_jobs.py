@@ -0,0 +1,230 @@
+"""Batch runs over many story configurations (JSONL job file).
+
+Each line of the job file is one job: a story configuration, a user-input
+script and how many runs of which methods to make with it.
+
+    {"id": "wuxia", "config": "story_config.json", "inputs": "inputs/wuxia.txt", "runs": 3}
+    {"id": "noir", "world": "worlds/noir.json", "plot": {...}, "characters": "cast/noir.json",
+     "inputs": ["Il detective entra nel bar.", "..."], "methods": ["A"], "turns": 6,
+     "settings": {"temperature": 0.9}}
+
+- config: a full story config file; world / plot / characters (inline or a
+  JSON file each) override its sections or replace it entirely;
+- inputs: list of user inputs, a .json list or a .txt file (one input per
+  line); default: classes.DEFAULT_INPUTS;
+- methods, runs, turns: default A and B, 1 run, 10 turns (overridable from
+  the command line);
+- settings: generation settings of the job (see generation_settings.py).
+
+Paths are relative to the job file. Every file is read and every config
+validated once, before any run starts: all the problems of the file are
+reported together. The runs of all jobs share one worker pool.
+
+Usage:
+    python run.py batch --jobs jobs.jsonl --workers 4 --output batch_results/
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import generation_settings
+from persona_utils import load_story_config, validate_story_config
+
+
+DEFAULT_METHODS = ["A", "B"]
+DEFAULT_RUNS = 1
+DEFAULT_TURNS = 10
+SECTIONS = ("world", "plot", "characters")
+JOB_KEYS = {"id", "config", "inputs", "methods", "runs", "turns", "settings", *SECTIONS}
+
+
+class _FileCache:
+    """Files of a job file, each read (and parsed) once."""
+
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+        self._files = {}
+
+    def path(self, name):
+        return (self.base_dir / name).resolve()
+
+    def load(self, name, reader):
+        path = self.path(name)
+        if path not in self._files:
+            self._files[path] = reader(path)
+        return self._files[path]
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_inputs(path):
+    if path.suffix == ".json":
+        return _read_json(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _parse_job(entry, files, defaults):
+    """Job dict of one job file entry (ValueError listing its problems)."""
+    problems = [f"unknown key '{key}'" for key in entry if key not in JOB_KEYS]
+
+    config = {}
+    if entry.get("config"):
+        config = dict(files.load(entry["config"], lambda path: load_story_config(path, verbose=False)))
+    for section in SECTIONS:
+        value = entry.get(section)
+        if isinstance(value, str):
+            value = files.load(value, _read_json)
+        if value is not None:
+            config[section] = value
+    problems += validate_story_config(config)
+
+    inputs = entry.get("inputs")
+    if isinstance(inputs, str):
+        inputs = files.load(inputs, _read_inputs)
+    if inputs is not None and (not isinstance(inputs, list) or not inputs
+                               or not all(isinstance(i, str) and i.strip() for i in inputs)):
+        problems.append("'inputs' must be a non-empty list of strings")
+
+    methods = entry.get("methods", defaults["methods"])
+    if isinstance(methods, str):
+        methods = [methods]
+    if not methods or any(m not in ("A", "B") for m in methods):
+        problems.append(f"invalid methods: {methods}")
+    runs = entry.get("runs", defaults["runs"])
+    turns = entry.get("turns", defaults["turns"])
+    for name, value in (("runs", runs), ("turns", turns)):
+        if not isinstance(value, int) or value < 1:
+            problems.append(f"'{name}' must be a positive integer")
+
+    settings = {}
+    try:
+        settings = generation_settings.validate(entry.get("settings") or {})
+    except (TypeError, ValueError) as e:
+        problems.append(str(e))
+
+    if problems:
+        raise ValueError("; ".join(problems))
+    return {"config": config, "inputs": inputs, "methods": list(methods), "runs": runs, "turns": turns,
+            "settings": settings}
+
+
+def load_jobs(path, methods=None, runs=None, turns=None):
+    """Parse and validate a JSONL job file.
+
+    Args:
+        methods, runs, turns: defaults for the jobs that do not set them
+
+    Returns:
+        list of job dicts (id, config, inputs, methods, runs, turns, settings)
+
+    Raises:
+        ValueError listing the problems of every invalid line
+    """
+    path = Path(path)
+    files = _FileCache(path.parent)
+    defaults = {"methods": methods or DEFAULT_METHODS, "runs": runs or DEFAULT_RUNS, "turns": turns or DEFAULT_TURNS}
+    jobs, errors, ids = [], [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            try:
+                entry = json.loads(line)
+                if not isinstance(entry, dict):
+                    raise ValueError("a job must be a JSON object")
+                job_id = str(entry.get("id") or f"job{line_no}")
+                if job_id in ids:
+                    raise ValueError(f"duplicate id '{job_id}'")
+                ids.add(job_id)
+                jobs.append({"id": job_id, **_parse_job(entry, files, defaults)})
+            except (ValueError, OSError) as e:
+                errors.append(f"line {line_no}: {e}")
+    if errors:
+        raise ValueError(f"Invalid job file {path}:\n  " + "\n  ".join(errors))
+    return jobs
+
+
+def job_runs(jobs):
+    """(job index, method, run_id) of every run, job by job."""
+    return [(index, method, run_id)
+            for index, job in enumerate(jobs)
+            for method in job["methods"]
+            for run_id in range(1, job["runs"] + 1)]
+
+
+def run_jobs(jobs, run_one, workers=1, on_result=None):
+    """Run every job on one shared pool.
+
+    Args:
+        jobs: list of job dicts (see load_jobs)
+        run_one: callable(job, method, run_id) -> run metrics
+        workers: runs executed in parallel
+        on_result: optional callback(job, method, run_id, metrics) called as runs complete
+
+    Returns:
+        dict job id -> {"runs": [metrics], "throughput": {...}}
+    """
+    lock = threading.Lock()
+    state = {job["id"]: {"runs": [], "failed": 0, "start": None, "end": None, "busy_seconds": 0.0}
+             for job in jobs}
+
+    def timed(job, method, run_id):
+        start = time.time()
+        with lock:
+            entry = state[job["id"]]
+            entry["start"] = start if entry["start"] is None else min(entry["start"], start)
+        try:
+            return run_one(job, method, run_id)
+        finally:
+            end = time.time()
+            with lock:
+                entry["end"] = end if entry["end"] is None else max(entry["end"], end)
+                entry["busy_seconds"] += end - start
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(timed, jobs[index], method, run_id): (index, method, run_id)
+                   for index, method, run_id in job_runs(jobs)}
+        for future in as_completed(futures):
+            index, method, run_id = futures[future]
+            job = jobs[index]
+            try:
+                metrics = future.result()
+            except Exception as e:
+                with lock:
+                    state[job["id"]]["failed"] += 1
+                print(f"[WARNING] Job {job['id']} method {method} run #{run_id} failed: {e}")
+                continue
+            with lock:
+                state[job["id"]]["runs"].append(metrics)
+            if on_result:
+                on_result(job, method, run_id, metrics)
+
+    return {job_id: {"runs": entry["runs"], "throughput": throughput(entry)} for job_id, entry in state.items()}
+
+
+def throughput(entry):
+    """Throughput of a job: runs, turns and output tokens over its wall-clock span."""
+    runs = entry["runs"]
+    wall = (entry["end"] - entry["start"]) if entry["start"] is not None else 0.0
+    turns = sum(run.get("turns_completed", len(run.get("turn_lengths", []))) for run in runs)
+    output_tokens = sum((run.get("usage") or {}).get("output_tokens", 0) for run in runs)
+    calls = sum((run.get("usage") or {}).get("calls", 0) for run in runs)
+    per_minute = 60 / wall if wall > 0 else 0.0
+    return {
+        "runs": len(runs),
+        "failed_runs": entry["failed"],
+        "turns": turns,
+        "calls": calls,
+        "wall_seconds": round(wall, 2),
+        "busy_seconds": round(entry["busy_seconds"], 2),  # summed over the workers that ran the job
+        "runs_per_minute": round(len(runs) * per_minute, 2),
+        "turns_per_minute": round(turns * per_minute, 2),
+        "output_tokens_per_second": round(output_tokens / wall, 2) if wall > 0 else 0.0,
+    }
@@ -0,0 +1,214 @@
+"""Local fake Gemini-compatible endpoint for load tests.
+
+Serves POST .../models/<model>:generateContent with the REST response format
+of the real API, so google.genai.Client can be pointed at it with
+HttpOptions(base_url=...). Configurable:
+- RPM limit per API key (sliding 60 s window, 429 RESOURCE_EXHAUSTED beyond it)
+- latency distribution (latency models of local_backend.py)
+- 429 bursts: periods during which every request is rejected
+- blocked responses (finishReason SAFETY, no content)
+
+Usage:
+    python benchmarks/fake_gemini_server.py --port 8765 --rpm 60 --median 0.5
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from local_backend import CANNED_ANALYSIS, constant_latency, estimate_tokens, heavy_tailed_latency  # noqa: E402
+
+
+_STORY_TEXT = (
+    "Li Wei risale il sentiero del monastero mentre la tempesta si placa. "
+    "Mei Lin percepisce il chi della Fenice di Giada verso la città imperiale, "
+    "e Zhang Hao esita, diviso tra la lealtà al padre e il giuramento ai monaci. "
+) * 4
+
+
+class FakeGeminiState:
+    """Shared server configuration and counters.
+
+    Args:
+        rpm: accepted requests per minute per API key (None = unlimited)
+        latency: latency model, callable(random.Random) -> seconds
+        blocked_rate: probability of a blocked (SAFETY) response
+        burst_every: seconds between the start of two 429 bursts (None = no bursts)
+        burst_duration: seconds each burst lasts
+        seed: random seed
+    """
+
+    def __init__(self, rpm=None, latency=None, blocked_rate=0.0, burst_every=None,
+                 burst_duration=5.0, seed=None):
+        self.rpm = rpm
+        self.latency = latency or constant_latency(0.0)
+        self.blocked_rate = blocked_rate
+        self.burst_every = burst_every
+        self.burst_duration = burst_duration
+        self.started = time.time()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.windows = {}  # api key -> deque of accepted timestamps
+        self.stats = {
+            "requests": 0,
+            "accepted": 0,
+            "rate_limited": 0,
+            "burst_rejected": 0,
+            "blocked": 0,
+            "prompt_tokens": 0,
+            "output_tokens": 0,
+        }
+
+    def in_burst(self, now):
+        if not self.burst_every:
+            return False
+        return (now - self.started) % self.burst_every < self.burst_duration
+
+    def admit(self, api_key):
+        """'ok', 'rate_limited' or 'burst' for a new request."""
+        with self.lock:
+            now = time.time()
+            self.stats["requests"] += 1
+            if self.in_burst(now):
+                self.stats["burst_rejected"] += 1
+                return "burst"
+            if self.rpm is not None:
+                window = self.windows.setdefault(api_key, deque())
+                while window and window[0] <= now - 60:
+                    window.popleft()
+                if len(window) >= self.rpm:
+                    self.stats["rate_limited"] += 1
+                    return "rate_limited"
+                window.append(now)
+            self.stats["accepted"] += 1
+            return "ok"
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            elapsed_minutes = max((time.time() - self.started) / 60, 1e-9)
+            keys = max(len(self.windows), 1)
+            if self.rpm:
+                stats["quota_utilisation"] = round(
+                    min(1.0, stats["accepted"] / (self.rpm * keys * max(elapsed_minutes, 1.0))), 3
+                )
+            return stats
+
+
+def _make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.split("?")[0].endswith(":generateContent"):
+                self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                return
+
+            api_key = self.headers.get("x-goog-api-key", "anonymous")
+            admission = state.admit(api_key)
+            if admission != "ok":
+                self._send(429, {"error": {"code": 429, "message": f"Quota exceeded ({admission})",
+                                           "status": "RESOURCE_EXHAUSTED"}})
+                return
+
+            with state.lock:
+                delay = state.latency(state.rng)
+                blocked = state.rng.random() < state.blocked_rate
+            time.sleep(delay)
+
+            prompt = "".join(
+                part.get("text", "")
+                for content in request.get("contents", [])
+                for part in content.get("parts", [])
+            )
+            prompt_tokens = estimate_tokens(prompt)
+            if blocked:
+                with state.lock:
+                    state.stats["blocked"] += 1
+                self._send(200, {
+                    "candidates": [{"finishReason": "SAFETY"}],
+                    "usageMetadata": {"promptTokenCount": prompt_tokens, "totalTokenCount": prompt_tokens},
+                })
+                return
+
+            text = CANNED_ANALYSIS if "Analizza questo frammento" in prompt else _STORY_TEXT
+            output_tokens = estimate_tokens(text)
+            with state.lock:
+                state.stats["prompt_tokens"] += prompt_tokens
+                state.stats["output_tokens"] += output_tokens
+            self._send(200, {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                }],
+                "usageMetadata": {
+                    "promptTokenCount": prompt_tokens,
+                    "candidatesTokenCount": output_tokens,
+                    "totalTokenCount": prompt_tokens + output_tokens,
+                },
+            })
+
+    return Handler
+
+
+def start_server(state, host="127.0.0.1", port=0):
+    """Start the fake server in a background thread and return (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), _make_handler(state))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def latency_from_args(median, tail_prob, tail_factor):
+    if median <= 0:
+        return constant_latency(0.0)
+    return heavy_tailed_latency(median=median, tail_prob=tail_prob, tail_factor=tail_factor)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Gemini-compatible endpoint")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute per API key")
+    parser.add_argument("--median", type=float, default=0.5, help="Median latency (seconds)")
+    parser.add_argument("--tail-prob", type=float, default=0.05, help="Probability of a slow call")
+    parser.add_argument("--tail-factor", type=float, default=10.0, help="Slow call / median ratio")
+    parser.add_argument("--blocked-rate", type=float, default=0.0, help="Probability of a blocked response")
+    parser.add_argument("--burst-every", type=float, default=None, help="Seconds between 429 bursts")
+    parser.add_argument("--burst-duration", type=float, default=5.0, help="Seconds each 429 burst lasts")
+    args = parser.parse_args()
+
+    state = FakeGeminiState(
+        rpm=args.rpm,
+        latency=latency_from_args(args.median, args.tail_prob, args.tail_factor),
+        blocked_rate=args.blocked_rate,
+        burst_every=args.burst_every,
+        burst_duration=args.burst_duration,
+    )
+    server, url = start_server(state, port=args.port)
+    print(f"Fake Gemini server listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(state.get_stats()))
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,273 @@
+"""Offline benchmark of the non-LLM hot paths at scale.
+
+Builds synthetic story states with 10, 1k and 100k facts, items and
+inconsistencies (plus a history of the same length) and measures, without
+calling the model:
+- format_state_for_prompt
+- create_cacheable_context
+- build_prompt_prefix_method_A (Method A prompt builder)
+- apply_analysis_result (parser of update_state_from_output, canned response)
+- compute_story_metrics (metric loops of run_single_experiment)
+- session_index (first build of the violation index of a session)
+
+and, on synthetic continuous metrics (gamma-distributed costs) of 1k and 5k
+runs per method, the resampling of the A-vs-B comparison:
+- bootstrap_means, permutation_test and compare_metric (10k resamples)
+
+The states carry their session violation index already built, as in a
+running session where it is updated one turn at a time: the other operations
+measure the per-turn cost, session_index the one-off build.
+
+Per-operation latency (median of repeated calls) and peak memory (tracemalloc)
+are compared with a stored baseline: an operation slower than
+baseline * (1 + tolerance) is a regression and the script exits with code 1.
+Latencies are compared relative to the machine: a fixed calibration workload
+runs in the same process and is stored with the baseline, and the baseline
+latencies are scaled by the ratio of the two calibration times, so a slower
+(or faster) machine does not show up as regressions.
+
+Usage (from CODE/):
+    python benchmarks/hot_paths.py                       # compare with baseline
+    python benchmarks/hot_paths.py --sizes 10 1000       # skip the 100k states
+    python benchmarks/hot_paths.py --stats-sizes         # skip the statistics
+    python benchmarks/hot_paths.py --update-baseline     # store new baseline
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from classes import (  # noqa: E402
+    apply_analysis_result,
+    build_characters_from_config,
+    build_prompt_prefix_method_A,
+    create_cacheable_context,
+    format_state_for_prompt,
+    init_story_state,
+)
+from experiment_stats import bootstrap_means, compare_metric, permutation_test  # noqa: E402
+from persona_utils import load_story_config  # noqa: E402
+from run import compute_story_metrics  # noqa: E402
+from violations import SESSION_INDEX_KEY, session_index  # noqa: E402
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / "hot_paths_baseline.json"
+CALIBRATION_KEY = "_calibration"
+DEFAULT_SIZES = [10, 1000, 100000]
+DEFAULT_STATS_SIZES = [1000, 5000]  # runs per method
+
+# Canned analysis response (same format as the model answer)
+CANNED_ANALYSIS = "\n".join(
+    ["FATTI:"]
+    + [f"- Li Wei scopre l'indizio numero {i} sulla Fenice di Giada" for i in range(8)]
+    + ["", "OGGETTI:"]
+    + [f"- Spada del Drago {i} | Mei Lin | custodita" for i in range(6)]
+    + ["", "VIOLAZIONI:",
+       "- ANACRONISMO: Lin Yao usa un cannocchiale, inesistente nel 1380",
+       "- CONTRADDIZIONE: Zhang Hao era al monastero ma ora è nella capitale"]
+)
+
+_SYNTHETIC_TURN = (
+    "Li Wei avanza tra le montagne innevate mentre il vento porta l'odore del fuoco. "
+    "Mei Lin lo segue in silenzio e percepisce il chi dell'artefatto rubato."
+)
+
+
+def build_synthetic_state(size, config):
+    """Story state with `size` facts, items, inconsistencies and history entries."""
+    state = init_story_state(
+        characters=build_characters_from_config(config["characters"]),
+        world_config=config["world"],
+        initial_facts=[],
+    )
+    violation_types = ["anacronismo", "impossibilità_storica", "contraddizione", "altro"]
+    state["facts"] = [
+        {"id": i + 1, "description": f"Fatto sintetico numero {i}", "turn_created": i % 50}
+        for i in range(size)
+    ]
+    state["items"] = [
+        {"name": f"Oggetto {i}", "location": "monastero", "status": "menzionato", "discovered_turn": i % 50}
+        for i in range(size)
+    ]
+    state["inconsistencies"] = [
+        {"turn": i % 50, "type": violation_types[i % 4],
+         "description": f"ANACRONISMO: cannocchiale numero {i}", "story_chunk": _SYNTHETIC_TURN[:150]}
+        for i in range(size)
+    ]
+    state["history"] = [
+        {"user": "Continua.", "assistant": _SYNTHETIC_TURN} for _ in range(size)
+    ]
+    session_index(state)
+    return state
+
+
+def _operations(config):
+    plot = config.get("plot")
+    return {
+        "format_state_for_prompt": lambda st: format_state_for_prompt(st),
+        "create_cacheable_context": lambda st: create_cacheable_context(st, plot),
+        "build_prompt_prefix_method_A": lambda st: build_prompt_prefix_method_A(st, plot, 5, 10),
+        "apply_analysis_result": lambda st: apply_analysis_result(st, CANNED_ANALYSIS, _SYNTHETIC_TURN, 5),
+        "compute_story_metrics": lambda st: compute_story_metrics(st, 10),
+        "session_index": lambda st: session_index({k: v for k, v in st.items() if k != SESSION_INDEX_KEY}),
+    }
+
+
+def build_synthetic_metric(size):
+    """Continuous metric (cost per run, USD) of `size` runs for methods A and B."""
+    rng = np.random.default_rng(0)
+    return {"A": rng.gamma(2.0, 1e-4, size), "B": rng.gamma(2.0, 1.1e-4, size)}
+
+
+def _stats_operations():
+    return {
+        "bootstrap_means": lambda m: bootstrap_means(m["A"], rng=np.random.default_rng(0)),
+        "permutation_test": lambda m: permutation_test(m["A"], m["B"], rng=np.random.default_rng(0)),
+        "compare_metric": lambda m: compare_metric(m["A"], m["B"]),
+    }
+
+
+def calibration_workload(_=None):
+    """Fixed mix of the work of the hot paths: string formatting, dict/list operations, NumPy."""
+    rows = [{"id": i, "description": f"Fatto sintetico numero {i}", "turn": i % 50} for i in range(20000)]
+    text = "\n".join(f"- {row['description']} (turno {row['turn']})" for row in rows if row["turn"] % 2 == 0)
+    ordered = sorted(rows, key=lambda row: (row["turn"], -row["id"]))
+    values = np.sort(np.arange(200000, dtype=float)[::-1])
+    return len(text) + len(ordered) + float(values.sum())
+
+
+def measure(operation, state, min_time=0.2, min_repeat=3, max_repeat=1000):
+    """Median seconds per call and peak traced memory (bytes) of one call."""
+    # apply_analysis_result mutates the state: work on a copy of the lists it grows
+    def fresh():
+        st = dict(state)
+        for key in ("facts", "items", "inconsistencies"):
+            if key in state:
+                st[key] = list(state[key])
+        return st
+
+    timings = []
+    total = 0.0
+    while len(timings) < min_repeat or (total < min_time and len(timings) < max_repeat):
+        st = fresh()
+        start = time.perf_counter()
+        operation(st)
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+
+    st = fresh()
+    tracemalloc.start()
+    operation(st)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def run_benchmarks(sizes, stats_sizes=()):
+    config = load_story_config()
+    cases = [(_operations(config), lambda size: build_synthetic_state(size, config), sizes),
+             (_stats_operations(), build_synthetic_metric, stats_sizes)]
+    results = {}
+    for operations, build, case_sizes in cases:
+        for size in case_sizes:
+            state = build(size)
+            for name, operation in operations.items():
+                seconds, peak = measure(operation, state)
+                results[f"{name}@{size}"] = {"seconds": seconds, "peak_bytes": peak}
+                print(f"{name:<32} {size:>7}  {seconds*1000:>10.3f} ms  {peak/1024:>10.1f} KiB")
+    return results
+
+
+def machine_scale(results, baseline):
+    """Calibration time of this machine / of the baseline machine (1.0 without calibration)."""
+    current, base = results.get(CALIBRATION_KEY), baseline.get(CALIBRATION_KEY)
+    if current is None or base is None:
+        return 1.0
+    return current["seconds"] / base["seconds"]
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """List of regressions (name, current, scaled baseline) beyond the tolerance.
+
+    Baseline latencies are scaled to this machine (see machine_scale); memory is compared as is.
+    """
+    scale = machine_scale(results, baseline)
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None or name == CALIBRATION_KEY:
+            continue
+        if current["seconds"] > base["seconds"] * scale * (1 + tolerance):
+            regressions.append((name, "seconds", current["seconds"], base["seconds"] * scale))
+        if current["peak_bytes"] > base["peak_bytes"] * (1 + tolerance):
+            regressions.append((name, "peak_bytes", current["peak_bytes"], base["peak_bytes"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the non-LLM hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Synthetic state sizes. Default: 10 1000 100000")
+    parser.add_argument("--stats-sizes", type=int, nargs="*", default=DEFAULT_STATS_SIZES,
+                        help="Runs per method of the statistics benchmarks (none to skip). Default: 1000 5000")
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_PATH),
+                        help="Baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="Allowed slowdown before failing (1.0 = 2x the baseline). Default: 1.0")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Write the current results as the new baseline")
+    args = parser.parse_args()
+
+    print(f"{'Operation':<32} {'Size':>7}  {'Latency':>13}  {'Peak memory':>14}")
+    print("-" * 72)
+    seconds, peak = measure(calibration_workload, {}, min_time=0.5, min_repeat=5)
+    print(f"{'calibration':<32} {'':>7}  {seconds*1000:>10.3f} ms  {peak/1024:>10.1f} KiB")
+    results = {CALIBRATION_KEY: {"seconds": seconds, "peak_bytes": peak}}
+    results.update(run_benchmarks(args.sizes, args.stats_sizes))
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline = {}
+        if baseline_path.exists():
+            with open(baseline_path, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        # Entries not measured now are rescaled to this machine, so the file keeps one calibration
+        scale = machine_scale(results, baseline)
+        for name, entry in baseline.items():
+            if name not in results:
+                entry["seconds"] *= scale
+        baseline.update(results)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved in: {baseline_path}")
+        sys.exit(0)
+
+    if not baseline_path.exists():
+        print(f"\nNo baseline found ({baseline_path}): run with --update-baseline first")
+        sys.exit(0)
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if CALIBRATION_KEY in baseline:
+        print(f"\nMachine scale: {machine_scale(results, baseline):.2f}x the baseline machine "
+              f"(calibration {results[CALIBRATION_KEY]['seconds']*1000:.1f} ms, "
+              f"baseline {baseline[CALIBRATION_KEY]['seconds']*1000:.1f} ms)")
+    else:
+        print("\n[WARNING] Baseline without calibration: latencies compared unscaled "
+              "(re-run with --update-baseline)")
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for name, field, current, base in regressions:
+            print(f"  - {name} {field}: {current:.6g} (baseline {base:.6g})")
+        sys.exit(1)
+    print("\nNo regressions against the baseline.")
@@ -0,0 +1,206 @@
+"""End-to-end throughput harness against a simulated Gemini server.
+
+Starts benchmarks/fake_gemini_server.py in-process, points the real
+google.genai client at it and drives N concurrent sessions through the real
+code paths (run_single_experiment / compare_methods_mode). Emits a JSON
+report with throughput, p50/p95/p99 turn latency (successful turns only;
+failed turns are counted and timed apart) and quota utilisation, to be
+tracked over time.
+
+Usage (from CODE/):
+    python benchmarks/load_test.py --sessions 4 --turns 5 --rpm 120 --median 0.2
+    python benchmarks/load_test.py --mode compare --sessions 4 --keys 2 --rpm 30
+    python benchmarks/load_test.py --burst-every 30 --burst-duration 5 --blocked-rate 0.05 \\
+        --report load_reports/latest.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google import genai  # noqa: E402
+from google.genai import types  # noqa: E402
+
+import classes  # noqa: E402
+import run  # noqa: E402
+from fake_gemini_server import FakeGeminiState, latency_from_args, start_server  # noqa: E402
+from hedging import percentile  # noqa: E402
+from key_pool import KeyPool  # noqa: E402
+
+
+class TurnTimer:
+    """Records the duration of every run_story_turn call (successful and failed turns apart)."""
+
+    def __init__(self):
+        self.latencies = []
+        self.failed_latencies = []
+        self._lock = threading.Lock()
+        self._original = classes.run_story_turn
+
+    def __enter__(self):
+        original = self._original
+
+        def timed_turn(*args, **kwargs):
+            start = time.time()
+            try:
+                result = original(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self.failed_latencies.append(time.time() - start)
+                raise
+            with self._lock:
+                self.latencies.append(time.time() - start)
+            return result
+
+        classes.run_story_turn = timed_turn
+        return self
+
+    def __exit__(self, *exc):
+        classes.run_story_turn = self._original
+
+
+def _client_factory(base_url):
+    def factory(api_key):
+        return genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(base_url=base_url, api_version='v1beta'),
+        )
+    return factory
+
+
+def _run_sessions(sessions, turns, method):
+    """N concurrent single-method runs; returns (completed, failed)."""
+    completed, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        futures = [executor.submit(run.run_single_experiment, method, turns, i + 1) for i in range(sessions)]
+        for future in futures:
+            try:
+                metrics = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[WARNING] Session failed: {e}", file=sys.stderr)
+                continue
+            # Runs that stop midway return partial metrics with the error
+            if metrics["error"]:
+                failed += 1
+            else:
+                completed += 1
+    return completed, failed
+
+
+def _run_compare(sessions, turns):
+    """compare_methods_mode with sessions/2 runs per method on `sessions` workers."""
+    runs_per_method = max(1, sessions // 2)
+    with tempfile.TemporaryDirectory() as output_dir:
+        try:
+            results = run.compare_methods_mode(runs_per_method, turns, output_dir, workers=sessions)
+            failed = sum(1 for m in results["method_A"] + results["method_B"] if m["error"])
+            return runs_per_method * 2 - failed, failed
+        except Exception as e:
+            print(f"[WARNING] Compare failed: {e}", file=sys.stderr)
+            return 0, runs_per_method * 2
+
+
+def run_load_test(args):
+    state = FakeGeminiState(
+        rpm=args.rpm,
+        latency=latency_from_args(args.median, args.tail_prob, args.tail_factor),
+        blocked_rate=args.blocked_rate,
+        burst_every=args.burst_every,
+        burst_duration=args.burst_duration,
+        seed=args.seed,
+    )
+    server, base_url = start_server(state)
+    factory = _client_factory(base_url)
+
+    pool = None
+    if args.keys > 0:
+        pool = KeyPool(
+            [{"name": f"key_{i+1}", "api_key": f"load-test-{i+1}", "rpm": args.rpm or 1000}
+             for i in range(args.keys)],
+            client_factory=factory,
+        )
+        classes.set_key_pool(pool)
+    else:
+        classes.set_client(factory("load-test"))
+    classes.RATE_LIMIT_DELAY = args.client_delay
+
+    start = time.time()
+    # Sessions print the whole story: keep the console for the report
+    with TurnTimer() as timer, contextlib.redirect_stdout(io.StringIO()):
+        if args.mode == "compare":
+            completed, failed = _run_compare(args.sessions, args.turns)
+        else:
+            completed, failed = _run_sessions(args.sessions, args.turns, args.method)
+    wall = time.time() - start
+    server.shutdown()
+    classes.set_key_pool(None)
+
+    # Throughput and latency of the successful turns only: failed turns are reported apart
+    lat = timer.latencies
+    failed_lat = timer.failed_latencies
+    report = {
+        "date": datetime.now().isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k != "report"},
+        "wall_seconds": round(wall, 2),
+        "runs_completed": completed,
+        "runs_failed": failed,
+        "turns": len(lat),
+        "failed_turns": len(failed_lat),
+        "turns_per_minute": round(len(lat) / wall * 60, 2) if wall > 0 else 0,
+        "turn_latency_seconds": {
+            "p50": round(percentile(lat, 50), 3),
+            "p95": round(percentile(lat, 95), 3),
+            "p99": round(percentile(lat, 99), 3),
+            "max": round(max(lat), 3) if lat else 0,
+        },
+        "failed_turn_latency_seconds": {
+            "p50": round(percentile(failed_lat, 50), 3),
+            "max": round(max(failed_lat), 3) if failed_lat else 0,
+        },
+        "server": state.get_stats(),
+    }
+    if pool is not None:
+        report["key_pool"] = pool.get_stats()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput harness with a simulated Gemini server")
+    parser.add_argument("--mode", choices=["session", "compare"], default="session",
+                        help="session: N concurrent runs of one method; compare: compare_methods_mode")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent sessions (workers)")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--method", choices=["A", "B"], default="A", help="Method for session mode")
+    parser.add_argument("--keys", type=int, default=0, help="API keys in a KeyPool (0 = single client)")
+    parser.add_argument("--rpm", type=int, default=None, help="Server RPM limit per key")
+    parser.add_argument("--median", type=float, default=0.1, help="Median server latency (seconds)")
+    parser.add_argument("--tail-prob", type=float, default=0.05, help="Probability of a slow call")
+    parser.add_argument("--tail-factor", type=float, default=10.0, help="Slow call / median ratio")
+    parser.add_argument("--blocked-rate", type=float, default=0.0, help="Probability of a blocked response")
+    parser.add_argument("--burst-every", type=float, default=None, help="Seconds between 429 bursts")
+    parser.add_argument("--burst-duration", type=float, default=5.0, help="Seconds each 429 burst lasts")
+    parser.add_argument("--client-delay", type=float, default=0.0,
+                        help="Min seconds between two calls of the process, shared by the sessions "
+                             "(classes.RATE_LIMIT_DELAY). Default: 0")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the server")
+    parser.add_argument("--report", type=str, default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        path = Path(args.report)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
@@ -0,0 +1,96 @@
+"""Startup time of the run.py subcommands.
+
+Each case starts a fresh interpreter (median wall time of --repeat runs) and
+lists, from `python -X importtime`, the heavy packages it imported:
+- google.genai: only needed by the first LLM call
+- numpy: aggregation of compare results and analysis
+- matplotlib: charts (analyze only)
+
+The --help cases of every subcommand must not import any of them; the
+analyze case (run in-process on --input, low-dpi charts in a temporary
+directory) may only import numpy and matplotlib. A case that imports a heavy
+package it does not need makes the script exit with code 1.
+
+Usage (from CODE/):
+    python benchmarks/startup.py                          # all cases
+    python benchmarks/startup.py --input ../final_results --repeat 10
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+CODE_DIR = Path(__file__).resolve().parent.parent
+HEAVY_PACKAGES = ["google.genai", "numpy", "matplotlib"]
+
+# case -> (run.py arguments, heavy packages allowed)
+HELP_CASES = {
+    "help": (["--help"], set()),
+    "single --help": (["single", "--help"], set()),
+    "compare --help": (["compare", "--help"], set()),
+    "analyze --help": (["analyze", "--help"], set()),
+}
+ANALYZE_ALLOWED = {"numpy", "matplotlib"}
+
+
+def _run(args, importtime=False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["run.py"] + args
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=CODE_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed:\n{proc.stderr[-2000:]}")
+    return elapsed, proc.stderr
+
+
+def heavy_imports(importtime_output):
+    """Heavy packages (HEAVY_PACKAGES) found in the output of -X importtime."""
+    modules = set()
+    for line in importtime_output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return {package for package in HEAVY_PACKAGES if package in modules}
+
+
+def measure(args, repeat):
+    """Median wall time (s) of run.py args and the heavy packages it imports."""
+    times = [_run(args)[0] for _ in range(repeat)]
+    _, importtime_output = _run(args, importtime=True)
+    return statistics.median(times), heavy_imports(importtime_output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup time of the run.py subcommands")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case (median)")
+    parser.add_argument("--input", type=str, default=str(CODE_DIR.parent / "final_results"),
+                        help="Results directory for the analyze case (skipped if missing)")
+    args = parser.parse_args()
+
+    cases = dict(HELP_CASES)
+    tmp_dir = tempfile.TemporaryDirectory()
+    if Path(args.input).exists():
+        # --force: measure the rendering, not the chart cache of a previous run
+        cases["analyze"] = (["analyze", "--input", args.input, "--output", tmp_dir.name,
+                             "--preview", "--workers", "1", "--force"], ANALYZE_ALLOWED)
+    else:
+        print(f"[WARNING] {args.input} not found: analyze case skipped", file=sys.stderr)
+
+    failed = []
+    print(f"{'case':<16} {'median s':>9}  heavy imports")
+    with tmp_dir:
+        for name, (run_args, allowed) in cases.items():
+            median, heavy = measure(run_args, args.repeat)
+            unexpected = heavy - allowed
+            flag = f"  <-- unexpected: {', '.join(sorted(unexpected))}" if unexpected else ""
+            print(f"{name:<16} {median:>9.3f}  {', '.join(sorted(heavy)) or '-'}{flag}")
+            if unexpected:
+                failed.append(name)
+
+    if failed:
+        print(f"[WARNING] Heavy imports not needed by: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,250 @@
+"""Best-of-N generation for Method A, with local scoring of the candidates.
+
+Method A only learns about an anachronism after it has been generated and
+caught by the analysis call, one turn too late. The selector fires N
+generations of the same prompt concurrently and keeps the best one by a
+cheap local score, so that only the winner is analyzed
+(update_state_from_output):
+- banned terms: anachronism clusters already detected in the story (the
+  same ViolationIndex clusters listed as OGGETTI VIETATI in the prompt)
+  whose key terms the candidate mentions;
+- entity-state conflicts: items or characters whose status says they are
+  gone (destroyed, lost, dead...) mentioned again;
+- length fit: words outside +-LENGTH_TOLERANCE of the median length of the
+  previous turns (DEFAULT_WORDS before the first one).
+
+Candidates are considered until `budget` seconds after the first one arrived
+(all of them if budget is None); later ones are discarded. Ties go to the
+earliest arrival, so with no penalty anywhere the turn costs no extra latency.
+Every candidate is a regular call_gemini request (rate limits, key pool and
+usage accounting apply), so N multiplies the generation calls. Without a key
+pool the candidates share the single-key limiter, one call every
+RATE_LIMIT_DELAY: only the candidates whose slot can fall within the budget
+are fired (with the 12 s free-tier delay and a 2 s budget, just one).
+
+get_stats() reports the arrival rank of the accepted candidates, the
+latency added waiting for better ones (and how much of it the winners
+actually needed) and the penalties avoided, to tune N and the budget
+against throughput.
+
+Usage:
+    from classes import set_best_of_n
+    from best_of_n import BestOfNSelector
+
+    set_best_of_n(BestOfNSelector(n=3, budget=2.0))
+
+    python run.py compare --runs 3 --best-of 3 --best-of-budget 2
+"""
+
+import contextvars
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import classes
+import openmetrics
+from classes import call_gemini
+from hedging import percentile
+from violations import DEFAULT_THRESHOLD, character_terms, session_index, text_stems
+
+
+DEFAULT_WORDS = (80, 300)  # acceptable turn length before any turn exists ("1-2 paragrafi")
+LENGTH_TOLERANCE = 0.5     # +-50% of the median length of the previous turns
+LENGTH_HISTORY = 5         # previous turns used for the median length
+
+# Penalty weights: a repeated anachronism is what the selection is for
+BANNED_WEIGHT = 3.0
+CONFLICT_WEIGHT = 2.0
+LENGTH_WEIGHT = 1.0
+
+# Status words of an entity that can no longer appear
+GONE_STATUS_TERMS = text_stems(
+    "distrutto distrutta perso persa rotto rotta morto morta consumato consumata scomparso scomparsa "
+    "bruciato bruciata dead destroyed lost"
+)
+
+
+def scoring_context(story_state):
+    """What the candidates of a turn are scored against (computed once per turn).
+
+    Returns:
+        dict with banned (list of term sets), gone (list of (name, term set)),
+        words (min, max) and ignore_terms
+    """
+    ignore_terms = character_terms(story_state.get("characters"))
+    banned = [cluster["terms"] for cluster in session_index(story_state).clusters_of("anacronismo")
+              if cluster["terms"]]
+
+    gone = []
+    for entity in story_state.get("items", []) + story_state.get("characters", []):
+        if text_stems(str(entity.get("status", ""))) & GONE_STATUS_TERMS:
+            name_terms = text_stems(entity.get("name", ""))
+            if name_terms:
+                gone.append((entity.get("name"), name_terms))
+
+    lengths = [len(entry["assistant"].split()) for entry in story_state.get("history", [])[-LENGTH_HISTORY:]
+               if entry.get("assistant")]
+    if lengths:
+        median = statistics.median(lengths)
+        words = (median * (1 - LENGTH_TOLERANCE), median * (1 + LENGTH_TOLERANCE))
+    else:
+        words = DEFAULT_WORDS
+    return {"banned": banned, "gone": gone, "words": words, "ignore_terms": ignore_terms}
+
+
+def score_candidate(text, context):
+    """Local penalties of a candidate (lower is better).
+
+    Returns:
+        dict with banned_hits, conflicts, words, length_penalty and penalty (weighted sum)
+    """
+    stems = text_stems(text, context["ignore_terms"])
+    banned_hits = sum(1 for terms in context["banned"] if len(terms & stems) / len(terms) >= DEFAULT_THRESHOLD)
+    conflicts = sum(1 for _, terms in context["gone"] if terms <= stems)
+    words = len(text.split())
+    low, high = context["words"]
+    if words < low:
+        length_penalty = (low - words) / low
+    elif words > high:
+        length_penalty = (words - high) / high
+    else:
+        length_penalty = 0.0
+    return {
+        "banned_hits": banned_hits,
+        "conflicts": conflicts,
+        "words": words,
+        "length_penalty": round(length_penalty, 3),
+        "penalty": BANNED_WEIGHT * banned_hits + CONFLICT_WEIGHT * conflicts + LENGTH_WEIGHT * length_penalty,
+    }
+
+
+class BestOfNSelector:
+    """Concurrent candidate generations, best local score wins.
+
+    Args:
+        n: candidates per turn
+        budget: seconds to wait for more candidates after the first one (None: wait for all)
+        window: recent added latencies kept for the stats
+        max_workers: threads available for in-flight candidates (shared by parallel runs)
+    """
+
+    def __init__(self, n=3, budget=2.0, window=200, max_workers=32):
+        self.n = max(1, n)
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="best-of-n")
+        self._lock = threading.Lock()
+        self._added_seconds = deque(maxlen=window)
+        self._winner_delays = deque(maxlen=window)
+        self._warned_clamp = False
+        self._stats = {
+            "turns": 0,
+            "candidates_fired": 0,
+            "candidates_scored": 0,
+            "candidates_failed": 0,
+            "candidates_discarded": 0,  # arrived after the budget
+            "candidates_not_fired": 0,  # could not be sent within the budget on the single key
+            "accepted_ranks": {},       # arrival rank (1 = first) -> turns
+            "winner_penalty": 0.0,
+            "first_penalty": 0.0,       # what always taking the first arrival would have cost
+            "banned_hits_avoided": 0,
+            "conflicts_avoided": 0,
+        }
+
+    def candidates(self):
+        """Candidates to fire now: n, or without a key pool the single-key slots within the budget."""
+        delay = classes.RATE_LIMIT_DELAY
+        if classes.key_pool is not None or self.budget is None or delay <= 0:
+            return self.n
+        fired = min(self.n, 1 + int(self.budget // delay))
+        if fired < self.n and not self._warned_clamp:
+            self._warned_clamp = True
+            print(f"[WARNING] Best-of-{self.n} without a key pool: one call every {delay:g}s, "
+                  f"only {fired} candidate(s) per turn fit the {self.budget:g}s budget")
+        return fired
+
+    def generate(self, story_state, prompt, cached_context=None, temperature=None, phase=None):
+        """Text of the best of n generations of prompt.
+
+        Raises:
+            the error of the first candidate if all of them failed
+        """
+        context = scoring_context(story_state)
+        fired = self.candidates()
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, call_gemini, prompt,
+                                  cached_context=cached_context, temperature=temperature, phase=phase)
+            for _ in range(fired)
+        ]
+
+        arrived = []  # (text, score, arrival time) in arrival order
+        first_error = None
+        first_arrival = None
+        failed = 0
+        pending = set(futures)
+        while pending:
+            timeout = None
+            if first_arrival is not None and self.budget is not None:
+                timeout = max(0.0, first_arrival + self.budget - time.time())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break  # budget spent
+            for future in done:
+                try:
+                    text = future.result()
+                except Exception as e:
+                    failed += 1
+                    first_error = first_error or e
+                    continue
+                now = time.time()
+                if first_arrival is None:
+                    first_arrival = now
+                arrived.append((text, score_candidate(text, context), now))
+        decided = time.time()
+        for future in pending:
+            # Not started yet: never sent. Running ones finish in background, ignored.
+            future.cancel()
+        if not arrived:
+            raise first_error
+
+        rank, (text, score, arrived_at) = min(enumerate(arrived), key=lambda item: item[1][1]["penalty"])
+        added = decided - first_arrival  # waited for better candidates (budget or all arrived)
+        first_score = arrived[0][1]
+        with self._lock:
+            stats = self._stats
+            stats["turns"] += 1
+            stats["candidates_fired"] += fired
+            stats["candidates_not_fired"] += self.n - fired
+            stats["candidates_scored"] += len(arrived)
+            stats["candidates_failed"] += failed
+            stats["candidates_discarded"] += fired - len(arrived) - failed
+            stats["accepted_ranks"][rank + 1] = stats["accepted_ranks"].get(rank + 1, 0) + 1
+            stats["winner_penalty"] += score["penalty"]
+            stats["first_penalty"] += first_score["penalty"]
+            stats["banned_hits_avoided"] += first_score["banned_hits"] - score["banned_hits"]
+            stats["conflicts_avoided"] += first_score["conflicts"] - score["conflicts"]
+            self._added_seconds.append(added)
+            self._winner_delays.append(arrived_at - first_arrival)
+        openmetrics.observe("best_of_n_accepted_rank", rank + 1)
+        openmetrics.observe("best_of_n_added_latency_seconds", added)
+        return text
+
+    def get_stats(self):
+        """Counters, accepted-rank distribution and the latency added by waiting for candidates."""
+        with self._lock:
+            stats = {**self._stats, "accepted_ranks": dict(sorted(self._stats["accepted_ranks"].items()))}
+            added = list(self._added_seconds)
+            delays = list(self._winner_delays)
+        turns = stats["turns"]
+        stats["n"] = self.n
+        stats["budget_seconds"] = self.budget
+        stats["first_accepted_rate"] = round(stats["accepted_ranks"].get(1, 0) / turns, 3) if turns else None
+        stats["mean_winner_penalty"] = round(stats.pop("winner_penalty") / turns, 3) if turns else None
+        stats["mean_first_penalty"] = round(stats.pop("first_penalty") / turns, 3) if turns else None
+        stats["mean_added_seconds"] = round(statistics.mean(added), 3) if added else 0.0
+        stats["p95_added_seconds"] = round(percentile(added, 95), 3)
+        # Part of the added latency the winners needed: the rest was spent waiting in vain
+        stats["mean_winner_delay_seconds"] = round(statistics.mean(delays), 3) if delays else 0.0
+        stats["p95_winner_delay_seconds"] = round(percentile(delays, 95), 3)
+        return stats
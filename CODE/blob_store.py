@@ -0,0 +1,256 @@
+"""Content-addressed, compressed storage of the large values of compare results.
+
+Every run used to be written three times with its full story text and state
+(method_X_run_N.json, comparison_results_full.json and the columnar text
+sidecar), pretty-printed. Now the large values of a run record (BLOB_FIELDS
+and any other string of at least MIN_BLOB_CHARS characters) are written once
+into a blob store and the JSON files keep a reference in their place:
+
+    blobs/
+        ab/ab3f...e1.z      zlib-compressed JSON of the value, named by its sha256
+
+    "story_text": {"$blob": "ab3f...e1"}
+
+The same value is stored once however many files (or runs) reference it.
+Readers go through load_results: the runs are BlobView mappings that read
+and decompress a blob only when its field is accessed, so reading a few
+numbers of thousands of runs does not touch the story texts. Results without
+references (older experiments) load unchanged.
+
+Usage:
+    python blob_store.py --input comparison_results/ --export plain/   # self-contained JSON copy
+    python blob_store.py --input final_results/ --pack packed/         # blob-backed copy of old results
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
+
+BLOB_DIRNAME = "blobs"
+REF_KEY = "$blob"
+BLOB_FIELDS = ("story_text", "story_state")  # always stored as blobs
+MIN_BLOB_CHARS = 1024  # other strings at least this long are stored as blobs too
+COMPRESSION_LEVEL = 1  # fastest: story text still shrinks ~5x, level 6 only saves ~10% more
+CACHE_SIZE = 32  # decoded blobs kept in memory per store
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def is_ref(value):
+    """True if value is a blob reference."""
+    return isinstance(value, dict) and len(value) == 1 and REF_KEY in value
+
+
+class BlobStore:
+    """Directory of zlib-compressed values addressed by the sha256 of their JSON.
+
+    Args:
+        path: blob directory (created on the first put)
+        level: zlib compression level
+    """
+
+    def __init__(self, path, level=COMPRESSION_LEVEL):
+        self.path = Path(path)
+        self.level = level
+        self._lock = threading.Lock()
+        self._known = set()        # digests known to be on disk
+        self._cache = OrderedDict()  # digest -> decoded value (LRU)
+
+    def __getstate__(self):
+        # Worker processes reopen the store: locks and caches are not copied
+        return {"path": self.path, "level": self.level}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["level"])
+
+    def _file(self, digest):
+        return self.path / digest[:2] / f"{digest}.z"
+
+    def put(self, value):
+        """Store a JSON-serializable value (once per content) and return its reference."""
+        data = _dumps(value)
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._known:
+                return {REF_KEY: digest}
+        target = self._file(digest)
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # Write then rename: a reader never sees a partial blob, concurrent writers agree on content
+            temp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(temp, "wb") as f:
+                f.write(zlib.compress(data, self.level))
+            os.replace(temp, target)
+        with self._lock:
+            self._known.add(digest)
+        return {REF_KEY: digest}
+
+    def get(self, ref):
+        """Value of a blob reference (or digest)."""
+        digest = ref[REF_KEY] if isinstance(ref, dict) else ref
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+        try:
+            with open(self._file(digest), "rb") as f:
+                value = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            raise KeyError(f"Blob {digest} not found in {self.path}") from None
+        with self._lock:
+            self._cache[digest] = value
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return value
+
+    def get_stats(self):
+        """Number of blobs and compressed bytes on disk."""
+        files = list(self.path.glob("*/*.z")) if self.path.exists() else []
+        return {"blobs": len(files), "bytes": sum(f.stat().st_size for f in files)}
+
+
+def pack(record, store, fields=BLOB_FIELDS, min_chars=MIN_BLOB_CHARS):
+    """Copy of a run record with its large values replaced by blob references."""
+    packed = {}
+    for key, value in record.items():
+        if value is not None and not is_ref(value) and (
+                key in fields or isinstance(value, str) and len(value) >= min_chars):
+            value = store.put(value)
+        packed[key] = value
+    return packed
+
+
+def resolve(record, store):
+    """Copy of a run record with its blob references replaced by their values."""
+    return {key: store.get(value) if is_ref(value) else value for key, value in record.items()}
+
+
+class BlobView(Mapping):
+    """Read-only run record whose blob references are resolved on first access.
+
+    Args:
+        record: run record as stored (references in place of the large values)
+        store: BlobStore the references point to
+    """
+
+    def __init__(self, record, store):
+        self._record = record
+        self._store = store
+        self._resolved = {}
+
+    def __getitem__(self, key):
+        value = self._record[key]
+        if not is_ref(value):
+            return value
+        if key not in self._resolved:
+            self._resolved[key] = self._store.get(value)
+        return self._resolved[key]
+
+    def __iter__(self):
+        return iter(self._record)
+
+    def __len__(self):
+        return len(self._record)
+
+    def stored(self):
+        """The record as stored, references included."""
+        return dict(self._record)
+
+
+def open_store(results_dir):
+    """BlobStore of a results directory."""
+    return BlobStore(Path(results_dir) / BLOB_DIRNAME)
+
+
+def load_results(path):
+    """Compare results (a JSON file, or a directory with comparison_results_full.json
+    or comparison_results.json) with the runs as lazy BlobViews.
+    """
+    path = Path(path)
+    if path.is_dir():
+        source = path / "comparison_results_full.json"
+        if not source.exists():
+            source = path / "comparison_results.json"
+    else:
+        source = path
+    with open(source, "r", encoding="utf-8") as f:
+        results = json.load(f)
+    store = open_store(source.parent)
+    for key in ("method_A", "method_B"):
+        if key in results:
+            results[key] = [BlobView(run, store) for run in results[key]]
+    return results
+
+
+def _plain(results):
+    """results with the runs as plain resolved dicts (JSON-serializable)."""
+    return {key: [dict(run) for run in value] if key in ("method_A", "method_B") else value
+            for key, value in results.items()}
+
+
+def export(input_dir, output_dir):
+    """Write a self-contained (blob-free, pretty-printed) copy of blob-backed results."""
+    input_dir, output_dir = Path(input_dir), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    store = open_store(input_dir)
+    for source in sorted(input_dir.glob("*.json")):
+        with open(source, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and ("method_A" in data or "method_B" in data):
+            data = _plain({key: [BlobView(run, store) for run in value] if key in ("method_A", "method_B")
+                           else value for key, value in data.items()})
+        elif isinstance(data, dict):
+            data = resolve(data, store)
+        with open(output_dir / source.name, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def pack_dir(input_dir, output_dir):
+    """Write a blob-backed copy of plain compare results (run files and result files)."""
+    input_dir, output_dir = Path(input_dir), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    store = open_store(output_dir)
+    for source in sorted(input_dir.glob("*.json")):
+        with open(source, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and ("method_A" in data or "method_B" in data):
+            data = {key: [pack(run, store) for run in value] if key in ("method_A", "method_B") else value
+                    for key, value in data.items()}
+        elif isinstance(data, dict) and "run_id" in data:
+            data = pack(data, store)
+        with open(output_dir / source.name, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    return store
+
+
+def _disk_usage(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or pack blob-backed compare results")
+    parser.add_argument("--input", type=str, required=True, help="Results directory")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--export", type=str, metavar="DIR",
+                       help="Write a self-contained JSON copy (story text and state inline)")
+    group.add_argument("--pack", type=str, metavar="DIR",
+                       help="Write a blob-backed copy of results saved without blobs")
+    args = parser.parse_args()
+
+    if args.export:
+        export(args.input, args.export)
+        print(f"[INFO] Exported results saved in: {args.export}")
+    else:
+        stats = pack_dir(args.input, args.pack).get_stats()
+        print(f"[INFO] Packed results saved in: {args.pack} ({stats['blobs']} blobs)")
+        print(f"[INFO] Disk usage: {_disk_usage(args.input) / 1024:.0f} KB -> "
+              f"{_disk_usage(args.pack) / 1024:.0f} KB")
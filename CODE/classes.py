@@ -9,22 +9,153 @@ Contains:
 
 import json
 import os
+import threading
 import time
+from contextlib import nullcontext
 
-from google import genai
-from google.genai import types
+import deadlines
+import generation_settings
+import openmetrics
+import progress
+import tracing
+import usage
+from deadlines import DeadlineExceeded
+from violations import session_index
 
 # API key from environment variable (more secure) or fallback for development
 API_KEY = os.environ.get("GEMINI_API_KEY", "xxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx")
 
-client = genai.Client(
-    api_key=API_KEY,
-    http_options=types.HttpOptions(api_version='v1beta')
-)
+# google-genai is slow to import: the client is built on the first LLM call (see get_client)
+client = None
+_client_lock = threading.Lock()
 
 # Gemini 1.5 Flash Lite model - good cost/quality tradeoff
 GEMINI_MODEL = "models/gemini-flash-lite-latest"
 
+# Min seconds between two calls on the single key (free tier: 5 requests/minute).
+# Shared by every thread of the process (workers, best-of-N candidates), see wait_rate_limit
+RATE_LIMIT_DELAY = float(os.environ.get("GEMINI_RATE_LIMIT_DELAY", "12"))
+_rate_limit_lock = threading.Lock()
+_next_call_at = 0.0  # earliest start of the next call on the single key
+
+# Optional HedgePolicy (see hedging.py) used by call_gemini
+hedge_policy = None
+
+# Optional KeyPool (see key_pool.py): several keys with their own RPM/TPM limits
+key_pool = None
+
+# Optional OutputGovernor (see output_governor.py): learned max_output_tokens per call type/phase
+output_governor = None
+
+# Optional BestOfNSelector (see best_of_n.py): N concurrent Method A generations, best local score wins
+best_of_n = None
+
+# Optional AnalysisGate per method (see analysis_gate.py): analyze, defer or skip the analysis of a turn
+analysis_gates = {}
+
+# Default inputs for automatic fantasy mode
+# NOTE: Turn 2 contains an anachronistic element (telescope) to test error detection
+# NOTE: Turn 4 FORCES the telescope again - TEST if model learned from previous error
+DEFAULT_INPUTS = [
+    "Li Wei scopre le prime tracce del ladro e decide di inseguirlo, mentre gli altri monaci si preparano alla partenza.",
+    "Lin Yao usa il suo cannocchiale per osservare le truppe del Generale Zhao in lontananza. I monaci preparano un piano.",
+    "Mei Lin percepisce che Zhang Hao è in conflitto tra la lealtà al padre e il rispetto per i monaci.",
+    "Il Generale Zhao ordina ai suoi uomini di bloccare i monaci prima che raggiungano la capitale.",
+    "Lin Yao consulta di nuovo il suo fidato cannocchiale per cercare una via di fuga sicura attraverso le montagne.",
+    "Zhang Hao deve fare una scelta: proteggere suo padre o salvare migliaia di innocenti.",
+]
+
+
+def get_client():
+    """The LLM client, built (and google-genai imported) on first use."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from google import genai
+                from google.genai import types
+
+                client = genai.Client(
+                    api_key=API_KEY,
+                    http_options=types.HttpOptions(api_version='v1beta')
+                )
+    return client
+
+
+def set_client(new_client):
+    """Replace the LLM client (e.g. with local_backend.LocalBackendClient for offline runs)."""
+    global client
+    client = new_client
+
+
+def set_hedge_policy(policy):
+    """Enable hedged requests in call_gemini (None disables them)."""
+    global hedge_policy
+    hedge_policy = policy
+
+
+def wait_rate_limit():
+    """Wait for the next call slot of the single key (no key pool).
+    
+    Slots are RATE_LIMIT_DELAY apart for the whole process, so N worker
+    threads share the single-key rate instead of multiplying it. If the
+    turn/run deadline expires first, DeadlineExceeded is raised and the slot
+    is given back when no later call reserved one after it.
+    
+    Returns:
+        seconds waited
+    """
+    global _next_call_at
+    with _rate_limit_lock:
+        now = time.time()
+        slot = max(now, _next_call_at)
+        _next_call_at = slot + RATE_LIMIT_DELAY
+    try:
+        deadlines.sleep(slot - now)
+    except DeadlineExceeded:
+        with _rate_limit_lock:
+            if _next_call_at == slot + RATE_LIMIT_DELAY:
+                _next_call_at = slot
+        raise
+    return slot - now
+
+
+def try_rate_limit():
+    """Take the next call slot of the single key only if it is free now (no wait): True if taken."""
+    global _next_call_at
+    with _rate_limit_lock:
+        now = time.time()
+        if _next_call_at > now:
+            return False
+        _next_call_at = now + RATE_LIMIT_DELAY
+        return True
+
+
+def set_key_pool(pool):
+    """Route calls through a KeyPool instead of the single client (None disables it)."""
+    global key_pool
+    key_pool = pool
+
+
+def set_output_governor(governor):
+    """Learn max_output_tokens per call type and plot phase (None: always the setting)."""
+    global output_governor
+    output_governor = governor
+
+
+def set_best_of_n(selector):
+    """Generate Method A turns through a BestOfNSelector (None: one generation per turn)."""
+    global best_of_n
+    best_of_n = selector
+
+
+def set_analysis_gate(strategy, gate):
+    """Gate the analysis calls of a method ("A" or "B") with an AnalysisGate (None: analyze every turn)."""
+    if gate is None:
+        analysis_gates.pop(strategy, None)
+    else:
+        analysis_gates[strategy] = gate
+
 
 def build_characters_from_config(config_characters):
     """Prepare characters from JSON configuration for story_state.
@@ -95,17 +226,35 @@ def init_story_state(characters=None, world_config=None, initial_facts=None):
 
 
 # Direct prompt for Gemini: narrative text only, no JSON, no header
-def call_gemini(prompt, model=GEMINI_MODEL, temperature=0.7, cached_context=None):
+def call_gemini(prompt, model=GEMINI_MODEL, temperature=None, cached_context=None, call_type="generation",
+                phase=None):
     """Call Gemini with prompt caching support.
     
     Args:
         prompt: The main prompt
         model: Model name
-        temperature: Generation temperature
+        temperature: Generation temperature (default: the "temperature" generation setting)
         cached_context: (not used for now - free API doesn't support caching well)
+        call_type: "generation" or "analysis" (used for tracing and accounting)
+        phase: plot phase of a generation call (output length learned per phase, see output_governor.py)
     """
-    # Add delay to respect rate limits
-    time.sleep(12)
+    with tracing.span("llm_call", call_type=call_type):
+        try:
+            return _call_gemini(prompt, model, temperature, cached_context, call_type, phase)
+        except Exception as e:
+            progress.record_error(type(e).__name__)
+            raise
+
+
+def _call_gemini(prompt, model, temperature, cached_context, call_type, phase=None):
+    from google.genai import types
+    
+    if temperature is None:
+        temperature = generation_settings.get("temperature")
+    ceiling = generation_settings.get("max_output_tokens")
+    governor = output_governor
+    max_output_tokens = governor.cap(call_type, phase, ceiling) if governor is not None else ceiling
+    api_seconds = []  # API time of the last attempt (rate-limit waits excluded)
     
     # If there's cacheable context, prepend to prompt (simple concatenation)
     if cached_context:
@@ -113,15 +262,140 @@ def call_gemini(prompt, model=GEMINI_MODEL, temperature=0.7, cached_context=None
     else:
         full_prompt = prompt
     
-    response = client.models.generate_content(
-        model=model,
-        contents=full_prompt,
-        config=types.GenerateContentConfig(
-            temperature=temperature,
-            max_output_tokens=2048,
+    def generate(llm_client):
+        # Remaining budget (deadlines.py, call budget included): passed to the HTTP layer as request timeout
+        _, remaining = deadlines.tightest()
+        http_options = None
+        if remaining is not None:
+            http_options = types.HttpOptions(timeout=max(1, int(remaining * 1000)))
+        return llm_client.models.generate_content(
+            model=model,
+            contents=full_prompt,
+            config=types.GenerateContentConfig(
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+                http_options=http_options,
+            )
         )
-    )
     
+    estimated_tokens = None
+    if key_pool is not None:
+        from key_pool import estimate_prompt_tokens
+        estimated_tokens = estimate_prompt_tokens(full_prompt)
+    
+    def acquire_key():
+        wait_start = time.time()
+        with tracing.span("rate_limit_wait"):
+            key, reservation = key_pool.acquire(estimated_tokens)
+        progress.record_throttle(time.time() - wait_start)
+        return key, reservation
+    
+    def send(llm_client, key, reservation, cancel):
+        # One request (primary or hedge duplicate), accounted in usage and in the key pool
+        if cancel.is_set():
+            # The caller gave up while we were waiting for the rate limiter
+            raise DeadlineExceeded("call", "Call cancelled before being sent")
+        start = time.time()
+        try:
+            with tracing.span("request"):
+                response = generate(llm_client)
+        except Exception as e:
+            if key is not None:
+                # Quota/auth errors quarantine the key: the caller may retry on another one
+                e.retry_other_key = key_pool.report_error(key, e)
+            raise
+        elapsed = time.time() - start
+        api_seconds.append(elapsed)
+        progress.record_call(elapsed)
+        openmetrics.observe("llm_call_duration_seconds", elapsed, call_type=call_type)
+        if key is not None:
+            response_usage = getattr(response, "usage_metadata", None)
+            key_pool.report_success(key, reservation,
+                                    getattr(response_usage, "total_token_count", None) or estimated_tokens)
+        usage.record_response(response, call_type, full_prompt)
+        openmetrics.observe_response(response, call_type, full_prompt)
+        return response
+    
+    def duplicate(cancel):
+        # A hedge is a request of its own: own key reservation, or (single key) the rate-limit
+        # slot taken by try_rate_limit before it was fired
+        if key_pool is None:
+            return send(get_client(), None, None, cancel)
+        key, reservation = acquire_key()
+        return send(key.client, key, reservation, cancel)
+    
+    def dispatch(llm_client, key, reservation, cancel):
+        # Hedged requests: duplicate slow calls, first answer wins
+        if hedge_policy is None:
+            return send(llm_client, key, reservation, cancel)
+        return hedge_policy.call(lambda: send(llm_client, key, reservation, cancel),
+                                 hedge_fn=lambda: duplicate(cancel),
+                                 may_hedge=try_rate_limit if key_pool is None else None)
+    
+    def obtain():
+        # The rate-limit wait and the key reservation are bounded by the turn/run deadlines only:
+        # the call budget starts when the request is dispatched
+        if key_pool is None:
+            # One call per RATE_LIMIT_DELAY across every thread of the process
+            with tracing.span("rate_limit_wait"):
+                waited = wait_rate_limit()
+            progress.record_throttle(waited)
+            return deadlines.run_with_timeout(lambda cancel: dispatch(get_client(), None, None, cancel))
+        
+        # The pool enforces per-key RPM/TPM limits instead of the fixed delay
+        for attempt in range(len(key_pool.keys)):
+            key, reservation = deadlines.run_with_timeout(lambda cancel: acquire_key(), call_budget=False)
+            try:
+                return deadlines.run_with_timeout(lambda cancel: dispatch(key.client, key, reservation, cancel))
+            except Exception as e:
+                if getattr(e, "retry_other_key", False) and attempt + 1 < len(key_pool.keys):
+                    openmetrics.inc("llm_retries", reason="key_pool")
+                    continue
+                raise
+    
+    while True:
+        # Bounded by the active call/turn/run deadlines (inline when there are none)
+        response = obtain()
+        if governor is None:
+            break
+        
+        # Tight cap hit: accept (trimmed) or retry with a larger one
+        try:
+            text = _response_text(response)
+        except ValueError:
+            text = ""
+        action, value = governor.review(
+            call_type, phase, text, usage.response_tokens(response, full_prompt)[2],
+            _finish_reason(response) == "MAX_TOKENS", max_output_tokens, ceiling,
+            api_seconds[-1] if api_seconds else 0.0,
+        )
+        if action == "trim":
+            openmetrics.inc("llm_early_stops", call_type=call_type)
+            return value
+        if action == "accept":
+            break
+        openmetrics.inc("llm_retries", reason="max_tokens")
+        max_output_tokens = value
+    
+    with tracing.span("response_parse"):
+        try:
+            return _response_text(response)
+        except ValueError:
+            openmetrics.inc("llm_blocked_responses", call_type=call_type)
+            raise
+
+
+def _finish_reason(response):
+    """Name of the finish reason of the first candidate (e.g. "STOP", "MAX_TOKENS"), or None."""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return None
+    reason = getattr(candidates[0], "finish_reason", None)
+    return getattr(reason, "name", reason)
+
+
+def _response_text(response):
+    """Text of a generate_content response (raises ValueError if empty or blocked)."""
     # Handle empty or blocked response
     if response.text is None or not response.text:
         # Try to access candidates directly
@@ -148,7 +422,7 @@ def _format_world(world):
     if world.get('description'):
         text += f"{world['description']}\n"
     if rules:
-        text += "Regole: " + " | ".join(rules[:5])  # Max 5 rules, compact
+        text += "Regole: " + " | ".join(rules[:generation_settings.get("rules_window")])  # Compact
     return text
 
 
@@ -177,7 +451,7 @@ def _format_facts(facts):
     if not facts:
         return "Nessun fatto."
     lines = []
-    for f in facts[-10:]:  # Max last 10 facts
+    for f in facts[-generation_settings.get("facts_window"):]:  # Last facts only
         if isinstance(f, dict):
             lines.append(f"- T{f.get('turn_created', '?')}: {f.get('description', '')}")
         else:
@@ -230,23 +504,33 @@ PERSONAGGI:
     
     return context
 
-def generate_story_step_method_B(story_state, user_input):
+def generate_story_step_method_B(story_state, user_input, current_turn=0, max_turns=10):
     """Generate story WITHOUT feedback on inconsistencies (baseline for comparison).
     
     Inconsistencies are still RECORDED in update_state_from_output,
     but they are NOT passed to the model as input.
     This allows comparing method_A (which learns) vs method_B (which doesn't learn).
+    The prompt has no plot guidance; the plot phase is only passed to call_gemini
+    (output length learned per phase, as in the speculative path).
     """
+    with tracing.span("prompt_build"):
+        prompt = build_prompt_prefix_method_B(story_state) + format_user_input_section(user_input)
+    output = call_gemini(prompt, phase=plot_phase(current_turn, max_turns))
+    return output
+
+def build_prompt_prefix_method_B(story_state):
+    """Build the part of the Method B prompt that does not depend on the user input."""
     state_text = format_state_for_prompt(story_state)
 
     # Simple prompt, WITHOUT feedback on inconsistencies (this is method_B)
-    prompt = (
+    return (
         "Continua la storia in italiano, 1-2 paragrafi. "
-        "Stato attuale:\n" + state_text + "\n\n" +
-        "Input dell'utente:\n" + user_input + "\n"
+        "Stato attuale:\n" + state_text + "\n\n"
     )
-    output = call_gemini(prompt)
-    return output
+
+def format_user_input_section(user_input):
+    """Final section of every generation prompt (the only part that depends on the user)."""
+    return "Input dell'utente:\n" + user_input + "\n"
 
 def append_to_history(story_state, user_input, model_output):
     story_state["history"].append({
@@ -259,20 +543,40 @@ def update_state_from_output(story_state, new_story_chunk, turn_id):
     
     IMPORTANT: Reports ONLY anachronisms and physical impossibilities, NOT character behaviors."""
     
-    # Prepare info for unified prompt
-    explicit_rules = story_state["world"].get("rules_explicit", [])
-    setting = story_state["world"].get("setting", "")
+    with tracing.span("prompt_build", call_type="analysis"):
+        unified_prompt = build_analysis_prompt(story_state, new_story_chunk)
     
-    # Simplified prompt: only facts, objects, and VIOLATIONS
-    unified_prompt = f"""Analizza questo frammento di storia ambientato in: {setting}
-
-REGOLE ESPLICITE DEL MONDO:
-{chr(10).join(f"- {r}" for r in explicit_rules) if explicit_rules else "Nessuna regola esplicita."}
+    try:
+        unified_result = call_gemini(unified_prompt, temperature=generation_settings.get("analysis_temperature"),
+                                     call_type="analysis")
+        with tracing.span("state_merge"):
+            try:
+                apply_analysis_result(story_state, unified_result, new_story_chunk, turn_id)
+            except Exception:
+                openmetrics.inc("analysis_parse_failures", reason="error")
+                raise
+        
+    except DeadlineExceeded as e:
+        # Let the session decide the degraded path (see deadlines.py)
+        e.phase = "analysis"
+        e.story_chunk = new_story_chunk
+        raise
+    except Exception as e:
+        print(f"[WARNING] Unable to analyze story: {e}")
+    
+    return story_state, new_story_chunk
 
-Storia da analizzare:
-{new_story_chunk}
+def analyze_turn(strategy, story_state, new_story_chunk, turn_id):
+    """Analysis of a generated turn: update_state_from_output, unless the method has an AnalysisGate."""
+    gate = analysis_gates.get(strategy)
+    if gate is None:
+        return update_state_from_output(story_state, new_story_chunk, turn_id)
+    gate.analyze(story_state, new_story_chunk, turn_id)
+    return story_state, new_story_chunk
 
-COMPITI:
+# Tasks and answer format of the analysis call (shared with the batched
+# re-analysis of stored runs, see reanalyze.py)
+ANALYSIS_TASKS = """COMPITI:
 
 1. FATTI: Eventi importanti per la trama (scoperte, scontri, rivelazioni, decisioni)
 
@@ -287,111 +591,139 @@ COMPITI:
    - Comportamenti dei personaggi
    - Decisioni tattiche
    - Violazioni di protocolli/regole interne
-   - Oggetti plausibili per l'epoca (es. cristalli levigati, strumenti rudimentali in Cina 1380)
+   - Oggetti plausibili per l'epoca (es. cristalli levigati, strumenti rudimentali in Cina 1380)"""
 
-Rispondi in questo formato:
-
-FATTI:
+ANALYSIS_FORMAT = """FATTI:
 - [fatto 1]
 
 OGGETTI:
 - [nome] | [chi lo ha] | [stato]
 
 VIOLAZIONI:
-- [ANACRONISMO/IMPOSSIBILITÀ/CONTRADDIZIONE]: [descrizione] oppure NESSUNA
+- [ANACRONISMO/IMPOSSIBILITÀ/CONTRADDIZIONE]: [descrizione] oppure NESSUNA"""
+
+def format_world_rules(world):
+    """Explicit world rules as a bullet list (analysis prompts)."""
+    explicit_rules = world.get("rules_explicit", [])
+    return chr(10).join(f"- {r}" for r in explicit_rules) if explicit_rules else "Nessuna regola esplicita."
+
+def build_analysis_prompt(story_state, new_story_chunk):
+    """Prompt of the analysis call (facts, objects and violations of a story chunk)."""
+    setting = story_state["world"].get("setting", "")
+    
+    # Simplified prompt: only facts, objects, and VIOLATIONS
+    return f"""Analizza questo frammento di storia ambientato in: {setting}
+
+REGOLE ESPLICITE DEL MONDO:
+{format_world_rules(story_state["world"])}
+
+Storia da analizzare:
+{new_story_chunk}
+
+{ANALYSIS_TASKS}
+
+Rispondi in questo formato:
+
+{ANALYSIS_FORMAT}
 
 Risposta:"""
+
+def apply_analysis_result(story_state, unified_result, new_story_chunk, turn_id):
+    """Parse the analysis response and merge facts, objects and violations into story_state."""
+    # Initialize structures
+    if "inconsistencies" not in story_state:
+        story_state["inconsistencies"] = []
     
-    try:
-        unified_result = call_gemini(unified_prompt, temperature=0.2)
-        
-        # Initialize structures
-        if "inconsistencies" not in story_state:
-            story_state["inconsistencies"] = []
+    # Parsing
+    lines = unified_result.strip().split('\n')
+    in_facts = False
+    in_objects = False
+    in_violations = False
+    new_facts = []
+    new_items = []
+    sections_found = False
+    inconsistencies_before = len(story_state["inconsistencies"])
+    
+    for line in lines:
+        line = line.strip()
         
-        # Parsing
-        lines = unified_result.strip().split('\n')
-        in_facts = False
-        in_objects = False
-        in_violations = False
-        new_facts = []
-        new_items = []
+        if "FATTI:" in line.upper():
+            in_facts = True
+            in_objects = False
+            in_violations = False
+            sections_found = True
+            continue
+        elif "OGGETTI:" in line.upper():
+            in_facts = False
+            in_objects = True
+            in_violations = False
+            sections_found = True
+            continue
+        elif "VIOLAZIONI" in line.upper():
+            in_facts = False
+            in_objects = False
+            in_violations = True
+            sections_found = True
+            continue
         
-        for line in lines:
-            line = line.strip()
-            
-            if "FATTI:" in line.upper():
-                in_facts = True
-                in_objects = False
-                in_violations = False
-                continue
-            elif "OGGETTI:" in line.upper():
-                in_facts = False
-                in_objects = True
-                in_violations = False
-                continue
-            elif "VIOLAZIONI" in line.upper():
-                in_facts = False
-                in_objects = False
-                in_violations = True
+        if line.startswith('-') or line.startswith('•'):
+            content = line[1:].strip()
+            if not content:
                 continue
             
-            if line.startswith('-') or line.startswith('•'):
-                content = line[1:].strip()
-                if not content:
-                    continue
+            if in_facts:
+                new_facts.append({
+                    "id": len(story_state["facts"]) + len(new_facts) + 1,
+                    "description": content,
+                    "turn_created": turn_id
+                })
+            
+            elif in_objects:
+                parts = [p.strip() for p in content.split('|')]
+                if len(parts) >= 3:
+                    item_name, location, status = parts[0], parts[1], parts[2]
+                elif len(parts) == 2:
+                    item_name, location, status = parts[0], parts[1], "menzionato"
+                else:
+                    item_name, location, status = content, "sconosciuta", "menzionato"
                 
-                if in_facts:
-                    new_facts.append({
-                        "id": len(story_state["facts"]) + len(new_facts) + 1,
-                        "description": content,
-                        "turn_created": turn_id
+                if not any(it.get("name") == item_name for it in story_state["items"]):
+                    new_items.append({
+                        "name": item_name,
+                        "location": location,
+                        "status": status,
+                        "discovered_turn": turn_id
                     })
-                
-                elif in_objects:
-                    parts = [p.strip() for p in content.split('|')]
-                    if len(parts) >= 3:
-                        item_name, location, status = parts[0], parts[1], parts[2]
-                    elif len(parts) == 2:
-                        item_name, location, status = parts[0], parts[1], "menzionato"
+            
+            elif in_violations:
+                if "NESSUNA" not in content.upper():
+                    # Determine type
+                    if "ANACRONISMO" in content.upper():
+                        viol_type = "anacronismo"
+                    elif "IMPOSSIBILITÀ" in content.upper() or "IMPOSSIBILITA" in content.upper():
+                        viol_type = "impossibilità_storica"
+                    elif "CONTRADDIZIONE" in content.upper():
+                        viol_type = "contraddizione"
                     else:
-                        item_name, location, status = content, "sconosciuta", "menzionato"
+                        viol_type = "altro"
                     
-                    if not any(it.get("name") == item_name for it in story_state["items"]):
-                        new_items.append({
-                            "name": item_name,
-                            "location": location,
-                            "status": status,
-                            "discovered_turn": turn_id
-                        })
-                
-                elif in_violations:
-                    if "NESSUNA" not in content.upper():
-                        # Determine type
-                        if "ANACRONISMO" in content.upper():
-                            viol_type = "anacronismo"
-                        elif "IMPOSSIBILITÀ" in content.upper() or "IMPOSSIBILITA" in content.upper():
-                            viol_type = "impossibilità_storica"
-                        elif "CONTRADDIZIONE" in content.upper():
-                            viol_type = "contraddizione"
-                        else:
-                            viol_type = "altro"
-                        
-                        story_state["inconsistencies"].append({
-                            "turn": turn_id,
-                            "type": viol_type,
-                            "description": content,
-                            "story_chunk": new_story_chunk[:150] + "..."
-                        })
-        
-        # Add facts and objects
-        story_state["facts"].extend(new_facts)
-        story_state["items"].extend(new_items)
-        
-    except Exception as e:
-        print(f"[WARNING] Unable to analyze story: {e}")
+                    story_state["inconsistencies"].append({
+                        "turn": turn_id,
+                        "type": viol_type,
+                        "description": content,
+                        "story_chunk": new_story_chunk[:150] + "..."
+                    })
     
-    return story_state, new_story_chunk
+    # Add facts and objects
+    story_state["facts"].extend(new_facts)
+    story_state["items"].extend(new_items)
+    
+    if not sections_found:
+        openmetrics.inc("analysis_parse_failures", reason="no_sections")
+    openmetrics.observe("story_facts_extracted", len(new_facts))
+    openmetrics.observe("story_items_extracted", len(new_items))
+    openmetrics.observe("story_inconsistencies_detected",
+                        len(story_state["inconsistencies"]) - inconsistencies_before)
 
 def generate_story_step_method_A(story_state, user_input, plot_config=None, current_turn=0, max_turns=10, use_caching=True):
     """Complete pipeline with ERROR LEARNING and PLOT STRUCTURE.
@@ -403,6 +735,49 @@ def generate_story_step_method_A(story_state, user_input, plot_config=None, curr
     - Guides narrative pacing based on plot phase
     - USES CACHING to save costs (70% discount on fixed part)
     """
+    with tracing.span("prompt_build"):
+        parts = build_prompt_prefix_method_A(story_state, plot_config, current_turn, max_turns, use_caching)
+    
+    # 1) Generate story WITH feedback and caching (optionally the best of N candidates)
+    story_chunk = generate_from_parts("A", story_state, user_input, parts)
+
+    # 2) Update state + detect inconsistencies
+    story_state, memory_raw = analyze_turn("A", story_state, story_chunk, turn_id=len(story_state["history"]))
+
+    # 3) Update story log
+    append_to_history(story_state, user_input, story_chunk)
+    return story_chunk, story_state, memory_raw
+
+def generate_from_parts(strategy, story_state, user_input, parts):
+    """Generation call of a turn from its prompt parts (best of N for Method A when enabled)."""
+    prompt = parts["prefix"] + format_user_input_section(user_input)
+    if strategy == "A" and best_of_n is not None:
+        return best_of_n.generate(story_state, prompt, cached_context=parts["cached_context"],
+                                  temperature=parts["temperature"], phase=parts["phase"])
+    return call_gemini(prompt, cached_context=parts["cached_context"], temperature=parts["temperature"],
+                       phase=parts["phase"])
+
+def plot_phase(current_turn, max_turns):
+    """Plot phase of a turn: FASE INIZIALE / CENTRALE / CLIMAX / FINALE (by completion percentage)."""
+    completion = current_turn / max_turns if max_turns > 0 else 0
+    if completion < 0.3:
+        return "FASE INIZIALE"
+    elif completion < 0.6:
+        return "FASE CENTRALE"
+    elif completion < 0.85:
+        return "FASE CLIMAX"
+    return "FASE FINALE"
+
+def build_prompt_prefix_method_A(story_state, plot_config=None, current_turn=0, max_turns=10, use_caching=True):
+    """Build everything Method A needs for a generation call, except the user input.
+    
+    Returns:
+        dict with:
+        - prefix: variable prompt (plot phase, state, learning feedback)
+        - cached_context: fixed context (world, characters, plot) or None
+        - temperature: generation temperature for this plot phase
+        - phase: plot phase (see plot_phase)
+    """
     # Create cacheable context (world, characters, plot) - FIXED for all turns
     cached_context = create_cacheable_context(story_state, plot_config) if use_caching else None
     
@@ -415,31 +790,25 @@ def generate_story_step_method_A(story_state, user_input, plot_config=None, curr
     
     # PLOT STRUCTURE GUIDANCE
     plot_text = ""
+    phase = plot_phase(current_turn, max_turns)
     if plot_config:
-        # Calculate completion percentage
-        progress = current_turn / max_turns if max_turns > 0 else 0
-        
-        if progress < 0.3:
+        if phase == "FASE INIZIALE":
             # Initial phase: setup and inciting incident
-            phase = "FASE INIZIALE"
             plot_text = f"\n\n{phase}: Introduci conflitti e sviluppa la situazione. "
             if plot_config.get("inciting_incident"):
                 plot_text += f"Evento scatenante: {plot_config['inciting_incident']}\n"
-        elif progress < 0.6:
+        elif phase == "FASE CENTRALE":
             # Central phase: complications
-            phase = "FASE CENTRALE"
             plot_text = f"\n\n{phase}: Aumenta la tensione, introduci ostacoli e complicazioni. "
             if plot_config.get("complications"):
                 plot_text += f"Complicazioni: {plot_config['complications']}\n"
-        elif progress < 0.85:
+        elif phase == "FASE CLIMAX":
             # Climax phase
-            phase = "FASE CLIMAX"
             plot_text = f"\n\n{phase}: Stiamo avvicinandoci al climax. Prepara lo scontro decisivo. "
             if plot_config.get("climax"):
                 plot_text += f"Climax previsto: {plot_config['climax']}\n"
         else:
             # Final phase: resolution - MUST conclude
-            phase = "FASE FINALE"
             plot_text = f"\n\n{phase}: TURNO FINALE - CONCLUDI LA STORIA ORA!\n"
             plot_text += "OBBLIGATORIO: Questo è l'ultimo turno disponibile. Devi:\n"
             plot_text += "1. Risolvere il conflitto principale (recupero artefatto)\n"
@@ -456,54 +825,106 @@ def generate_story_step_method_A(story_state, user_input, plot_config=None, curr
     implicit_rules = story_state["world"].get("implicit_rules", [])
     if implicit_rules:
         learning_text += "\n\nREGOLE IMPLICITE (dedotte dal contesto, da rispettare):\n"
-        learning_text += "\n".join(f"- {r}" for r in implicit_rules[-5:])  # Max 5
+        learning_text += "\n".join(f"- {r}" for r in implicit_rules[-generation_settings.get("rules_window"):])
     
     # Past inconsistencies to avoid - EXPLICIT AND STRONG FEEDBACK
     inconsistencies = story_state.get("inconsistencies", [])
     if inconsistencies:
         learning_text += "\n\nERRORI CRITICI DA NON RIPETERE MAI:\n"
-        for inc in inconsistencies[-3:]:  # Max 3 most recent
+        for inc in inconsistencies[-generation_settings.get("inconsistencies_window"):]:  # Most recent
             inc_type = inc.get('type', 'unknown')
             desc = inc['description']
             learning_text += f"- Turn {inc['turn']} ({inc_type}): {desc}\n"
         
-        # Extract specific anachronistic objects to explicitly block them
-        banned_objects = []
-        for inc in inconsistencies:
-            if inc.get('type') == 'anacronismo':
-                # Extract keywords to ban
-                desc_lower = inc['description'].lower()
-                if 'cannocchial' in desc_lower or 'telescop' in desc_lower:
-                    banned_objects.append('cannocchiale/telescopio')
-                elif 'pistol' in desc_lower or 'armi da fuoco' in desc_lower:
-                    banned_objects.append('pistole/armi da fuoco')
-                elif 'orologio' in desc_lower:
-                    banned_objects.append('orologi')
+        # Anachronistic objects to explicitly block: one label per cluster of violations
+        banned_objects = [cluster["label"] for cluster in session_index(story_state).clusters_of("anacronismo")]
         
         if banned_objects:
-            learning_text += f"\nOGGETTI VIETATI (anacronismi rilevati): {', '.join(set(banned_objects))}\n"
+            learning_text += f"\nOGGETTI VIETATI (anacronismi rilevati): {', '.join(banned_objects)}\n"
             learning_text += "NON menzionare questi oggetti in NESSUN modo (né uso, né possesso, né menzione indiretta).\n"
     
     # Prompt with learning and plot guidance
-    prompt = (
+    prefix = (
         "Continua la storia in italiano, 1-2 paragrafi. "
         "IMPORTANTE: Rispetta tutte le regole del mondo e NON ripetere errori passati.\n"
         + plot_text + "\n"
-        "Stato attuale:\n" + state_text + learning_text + "\n\n" +
-        "Input dell'utente:\n" + user_input + "\n"
+        "Stato attuale:\n" + state_text + learning_text + "\n\n"
     )
     
-    # 1) Generate story WITH feedback and caching
     # Lower temperature for final phase (more adherence to instructions)
-    temp = 0.5 if progress >= 0.85 else 0.7
-    story_chunk = call_gemini(prompt, cached_context=cached_context, temperature=temp)
+    temp = generation_settings.get("final_temperature" if phase == "FASE FINALE" else "temperature")
+    return {"prefix": prefix, "cached_context": cached_context, "temperature": temp, "phase": phase}
 
-    # 2) Update state + detect inconsistencies
-    story_state, memory_raw = update_state_from_output(story_state, story_chunk, turn_id=len(story_state["history"]))
+def build_generation_parts(strategy, story_state, plot_config=None, current_turn=0, max_turns=10):
+    """Prompt parts (prefix, cached_context, temperature, phase) of a generation call for either method."""
+    if strategy == "A":
+        return build_prompt_prefix_method_A(story_state, plot_config, current_turn, max_turns)
+    elif strategy == "B":
+        return {
+            "prefix": build_prompt_prefix_method_B(story_state),
+            "cached_context": None,
+            "temperature": generation_settings.get("temperature"),
+            "phase": plot_phase(current_turn, max_turns),
+        }
+    raise ValueError("Unknown strategy")
 
-    # 3) Update story log
-    append_to_history(story_state, user_input, story_chunk)
-    return story_chunk, story_state, memory_raw
+def run_story_turn(strategy, story_state, user_input, plot_config=None, current_turn=0, max_turns=10):
+    """One turn of a session: generation, analysis and history update.
+    
+    Returns:
+        the generated story chunk
+    """
+    with tracing.span("turn", turn=current_turn + 1, method=strategy), usage.turn(current_turn + 1):
+        if strategy == "A":
+            story_chunk, story_state, _ = generate_story_step_method_A(
+                story_state,
+                user_input,
+                plot_config=plot_config,
+                current_turn=current_turn,
+                max_turns=max_turns,
+            )
+        elif strategy == "B":
+            # Generation only. Optionally can remove update for a baseline
+            story_chunk = generate_story_step_method_B(
+                story_state,
+                user_input,
+                current_turn=current_turn,
+                max_turns=max_turns,
+            )
+            story_state, _ = analyze_turn(
+                "B",
+                story_state,
+                story_chunk,
+                turn_id=len(story_state["history"]),
+            )
+            append_to_history(story_state, user_input, story_chunk)
+        else:
+            raise ValueError("Unknown strategy")
+    return story_chunk
+
+def _record_timeout(deadline_policy, turn, e):
+    """Record a timeout of a turn in the policy; True if the run must stop."""
+    phase = getattr(e, "phase", "generation")
+    deadline_policy.record(turn, phase, e)
+    print(f"[WARNING] Turn {turn+1}: {phase} timed out ({e.scope} deadline)")
+    if e.scope == "run" or deadline_policy.on_timeout == "abort":
+        deadline_policy.aborted_at_turn = turn
+        return True
+    return False
+
+def _end_prefetched_turn(prefetcher, turn, deadline_policy, pending_analyses, metrics_accumulator, story_state):
+    """Close a turn whose analysis ran in background (after wait_prepared/finish); True if the run must stop."""
+    stop_run = False
+    timeout = prefetcher.analysis_timeout()
+    if timeout is not None and deadline_policy is not None:
+        timed_out_turn, turn_id, story_chunk, e = timeout
+        if deadline_policy.on_timeout == "retry_later":
+            pending_analyses.append((story_chunk, turn_id))
+        stop_run = _record_timeout(deadline_policy, timed_out_turn, e)
+    if metrics_accumulator is not None:
+        # The background analysis is merged: the row of the turn includes its facts
+        metrics_accumulator.end_turn(story_state, turn)
+    return stop_run
 
 def run_story_session(
     strategy="A",
@@ -513,6 +934,13 @@ def run_story_session(
     world_config=None,
     initial_facts=None,
     plot_config=None,
+    session_store=None,
+    session_id=None,
+    speculative=False,
+    pregenerate=False,
+    deadline_policy=None,
+    metrics_accumulator=None,
+    inputs=None,
 ):
     """Runs a short story session.
 
@@ -523,68 +951,179 @@ def run_story_session(
     - world_config: world configuration (setting, rules) from JSON
     - initial_facts: list of initial facts
     - plot_config: dict with plot structure (inciting_incident, complications, climax, resolution)
+    - session_store: optional SessionStore (see session_store.py); the state is saved
+      after every turn and an existing session with the same id is resumed
+    - session_id: key of the session inside session_store
+    - speculative: (interactive only) analyze the last turn and prepare the next prompt
+      in background while the user is typing (see speculative.py)
+    - pregenerate: with speculative, also pre-generate the continuation for the
+      suggested default input
+    - deadline_policy: optional DeadlinePolicy (see deadlines.py) with per call/turn/run
+      budgets and the degraded path taken on timeout; timeouts are recorded in it
+    - metrics_accumulator: optional MetricsAccumulator (see metrics_accumulator.py)
+      updated at the end of every turn
+    - inputs: user inputs of the turns, used in turn order and cycled
+      (default: DEFAULT_INPUTS); in interactive mode, the default for an empty input
     """
+    inputs = inputs or DEFAULT_INPUTS
 
-    # Create initial state with custom configuration
-    story_state = init_story_state(
-        characters=characters,
-        world_config=world_config,
-        initial_facts=initial_facts
-    )
-    full_story = []
-
-    # Default inputs for automatic fantasy mode
-    # NOTE: Turn 2 contains an anachronistic element (telescope) to test error detection
-    # NOTE: Turn 4 FORCES the telescope again - TEST if model learned from previous error
-    default_inputs = [
-        "Li Wei scopre le prime tracce del ladro e decide di inseguirlo, mentre gli altri monaci si preparano alla partenza.",
-        "Lin Yao usa il suo cannocchiale per osservare le truppe del Generale Zhao in lontananza. I monaci preparano un piano.",
-        "Mei Lin percepisce che Zhang Hao è in conflitto tra la lealtà al padre e il rispetto per i monaci.",
-        "Il Generale Zhao ordina ai suoi uomini di bloccare i monaci prima che raggiungano la capitale.",
-        "Lin Yao consulta di nuovo il suo fidato cannocchiale per cercare una via di fuga sicura attraverso le montagne.",
-        "Zhang Hao deve fare una scelta: proteggere suo padre o salvare migliaia di innocenti.",
+    # Resume from the session store if the session already exists
+    story_state = None
+    if session_store is not None and session_id is not None:
+        story_state = session_store.get(session_id)
+
+    if story_state is None:
+        # Create initial state with custom configuration
+        story_state = init_story_state(
+            characters=characters,
+            world_config=world_config,
+            initial_facts=initial_facts
+        )
+    full_story = [
+        f"=== Turn {i+1} ===\n{entry['assistant']}\n"
+        for i, entry in enumerate(story_state["history"])
     ]
+    start_turn = len(story_state["history"])
+    if metrics_accumulator is not None:
+        # Initial facts (and the turns of a resumed session)
+        metrics_accumulator.observe(story_state)
 
-    for turn in range(max_turns):
+    pending_analyses = []
+    if deadline_policy is not None:
+        deadline_policy.start_run()
+
+    prefetcher = None
+    handed_off = None  # turn whose analysis runs in background
+    if speculative and interactive:
+        from speculative import SpeculativePrefetcher
+        prefetcher = SpeculativePrefetcher(strategy, plot_config, max_turns, pregenerate=pregenerate)
+
+    for turn in range(start_turn, max_turns):
         # Ask user for input or use default
         if interactive:
             print(f"\n--- Turn {turn+1}/{max_turns} ---")
             print("Suggestions: 'chase', 'clash', 'revelation', 'moral dilemma', 'use of elemental powers'...")
+            if prefetcher is not None and pregenerate:
+                print(f"(Press ENTER to continue with: {inputs[turn % len(inputs)]})")
             user_input = input("Your input for the story: ").strip()
             if not user_input:
-                user_input = default_inputs[turn % len(default_inputs)]
+                user_input = inputs[turn % len(inputs)]
                 print(f"(Using default input: {user_input})")
         else:
-            user_input = default_inputs[turn % len(default_inputs)]
+            user_input = inputs[turn % len(inputs)]
 
-        if strategy == "A":
-            story_chunk, story_state, _ = generate_story_step_method_A(
-                story_state,
-                user_input,
-                plot_config=plot_config,
-                current_turn=turn,
-                max_turns=max_turns,
-            )
-        elif strategy == "B":
-            # Generation only. Optionally can remove update for a baseline
-            story_chunk = generate_story_step_method_B(
-                story_state,
-                user_input,
-            )
-            story_state, _ = update_state_from_output(
-                story_state,
-                story_chunk,
-                turn_id=len(story_state["history"]),
-            )
-            append_to_history(story_state, user_input, story_chunk)
+        if prefetcher is not None:
+            # Same turn scope as run_story_turn; the analysis runs in background (speculative.py)
+            stop_run = False
+            story_chunk = None
+            try:
+                with deadline_policy.turn_scope() if deadline_policy is not None else nullcontext(), \
+                        tracing.span("turn", turn=turn + 1, method=strategy), usage.turn(turn + 1):
+                    parts = None
+                    if handed_off is not None:
+                        # Analysis of the previous turn ran while the user was typing
+                        parts = prefetcher.wait_prepared()
+                        stop_run = _end_prefetched_turn(prefetcher, handed_off, deadline_policy,
+                                                        pending_analyses, metrics_accumulator, story_state)
+                        handed_off = None
+                        if session_store is not None and session_id is not None:
+                            session_store.put(session_id, story_state)
+                        if not stop_run:
+                            story_chunk = prefetcher.take_pregenerated(user_input)
+                    if not stop_run:
+                        if parts is None:
+                            parts = build_generation_parts(strategy, story_state, plot_config, turn, max_turns)
+                        if story_chunk is None:
+                            story_chunk = generate_from_parts(strategy, story_state, user_input, parts)
+
+                        print(f"\n=== Turn {turn+1} ===")
+                        print(story_chunk)
+                        full_story.append(f"=== Turn {turn+1} ===\n{story_chunk}\n")
+
+                        prefetcher.start(
+                            story_state, user_input, story_chunk, turn + 1,
+                            suggested_input=inputs[(turn + 1) % len(inputs)],
+                        )
+                        handed_off = turn
+            except DeadlineExceeded as e:
+                stop_run = _record_timeout(deadline_policy, turn, e)
+            if handed_off != turn and metrics_accumulator is not None:
+                # No chunk for this turn: nothing runs in background
+                metrics_accumulator.end_turn(story_state, turn)
+            progress.record_turn()
+            if stop_run:
+                print(f"[WARNING] Run stopped at turn {turn+1} after a timeout")
+                break
+            continue
+
+        stop_run = False
+        if deadline_policy is None:
+            story_chunk = run_story_turn(strategy, story_state, user_input, plot_config, turn, max_turns)
         else:
-            raise ValueError("Unknown strategy")
+            try:
+                with deadline_policy.turn_scope():
+                    story_chunk = run_story_turn(strategy, story_state, user_input, plot_config, turn, max_turns)
+            except DeadlineExceeded as e:
+                story_chunk = None
+                if getattr(e, "phase", "generation") == "analysis":
+                    # The chunk was generated: keep it, without (or with delayed) analysis
+                    story_chunk = e.story_chunk
+                    if deadline_policy.on_timeout == "retry_later":
+                        pending_analyses.append((story_chunk, len(story_state["history"])))
+                    append_to_history(story_state, user_input, story_chunk)
+                stop_run = _record_timeout(deadline_policy, turn, e)
+
+        if story_chunk is not None:
+            print(f"\n=== Turn {turn+1} ===")
+            print(story_chunk)
+
+            # Accumulate story pieces for file saving
+            full_story.append(f"=== Turn {turn+1} ===\n{story_chunk}\n")
+
+            if session_store is not None and session_id is not None:
+                session_store.put(session_id, story_state)
+
+        if metrics_accumulator is not None:
+            metrics_accumulator.end_turn(story_state, turn)
+        progress.record_turn()
+
+        if stop_run:
+            print(f"[WARNING] Run stopped at turn {turn+1} after a timeout")
+            break
+
+    if prefetcher is not None:
+        prefetcher.finish()
+        if handed_off is not None:
+            _end_prefetched_turn(prefetcher, handed_off, deadline_policy, pending_analyses,
+                                 metrics_accumulator, story_state)
+        if session_store is not None and session_id is not None:
+            session_store.put(session_id, story_state)
+        print(f"\n[INFO] Speculative prefetch: {prefetcher.get_stats()}")
+
+    # Turns still deferred by the analysis gate
+    gate = analysis_gates.get(strategy)
+    if gate is not None:
+        try:
+            with deadline_policy.run_scope() if deadline_policy is not None else nullcontext():
+                gate.flush(story_state)
+        except DeadlineExceeded as e:
+            if deadline_policy is not None:
+                deadline_policy.record(len(story_state["history"]) - 1, "analysis", e)
 
-        print(f"\n=== Turn {turn+1} ===")
-        print(story_chunk)
+    # Analyses postponed by timeouts (on_timeout="retry_later"), within the run budget
+    for story_chunk, turn_id in pending_analyses:
+        openmetrics.inc("llm_retries", reason="analysis_retry")
+        try:
+            with deadline_policy.run_scope():
+                update_state_from_output(story_state, story_chunk, turn_id=turn_id)
+            deadline_policy.retried_analyses += 1
+        except DeadlineExceeded as e:
+            deadline_policy.record(turn_id, "analysis_retry", e)
+            break
 
-        # Accumulate story pieces for file saving
-        full_story.append(f"=== Turn {turn+1} ===\n{story_chunk}\n")
+    if metrics_accumulator is not None:
+        # Analyses completed after the last turn (retry_later, speculative prefetch)
+        metrics_accumulator.observe(story_state)
 
     # Return both final state and complete story text
     return story_state, "\n".join(full_story)
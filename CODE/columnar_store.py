@@ -0,0 +1,248 @@
+"""Columnar store of compare results for analyze_metrics.
+
+comparison_results_full.json holds every run with its full story text: loading
+it to read a few numbers does not scale to thousands of runs. compare also
+writes a columnar store next to it:
+
+    columnar/
+        meta.json           experiment settings, summary, column list
+        <column>.npy        one array per column, memory-mapped on load
+        text.jsonl          story text and state, one run per line (sidecar); blob
+                            references when compare wrote them to a blob store
+
+Columns (one row per run, Method A runs first):
+- per-run scalars: method, run_id, total_facts, total_objects, total_inconsistencies,
+  repeated_inconsistencies, inconsistency_rate, avg_turn_length_words,
+  execution_time_seconds, total_timeouts, prompt_tokens, cached_tokens,
+  output_tokens, cost_usd, turns_completed, text_offset
+- per-turn arrays (runs x turns, NaN past the last turn or when unknown):
+  turn_lengths, facts_by_turn, items_by_turn, inconsistencies_by_turn,
+  prompt_tokens_by_turn, output_tokens_by_turn
+
+Usage:
+    python columnar_store.py --input final_results/     # build from existing JSON results
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from blob_store import BlobStore, load_results, open_store as open_blob_store, pack, resolve
+
+
+STORE_DIRNAME = "columnar"
+
+SCALAR_COLUMNS = [
+    "run_id",
+    "total_facts",
+    "total_objects",
+    "total_inconsistencies",
+    "repeated_inconsistencies",
+    "inconsistency_rate",
+    "avg_turn_length_words",
+    "execution_time_seconds",
+    "total_timeouts",
+]
+USAGE_COLUMNS = ["prompt_tokens", "cached_tokens", "output_tokens", "cost_usd"]
+TURN_COLUMNS = [
+    "turn_lengths",
+    "facts_by_turn",
+    "items_by_turn",
+    "inconsistencies_by_turn",
+    "prompt_tokens_by_turn",
+    "output_tokens_by_turn",
+]
+
+
+def _counts_by_turn(entries, key, max_turns):
+    counts = np.zeros(max_turns)
+    for entry in entries:
+        turn = min(max(int(entry.get(key, 0)), 0), max_turns - 1)
+        counts[turn] += 1
+    return counts
+
+
+def build_columns(results):
+    """Columns, metadata and text records of a compare results dict.
+
+    Returns:
+        (columns, meta, texts): dict name -> np.ndarray, JSON-serializable meta,
+        list of {"method", "run_id", "story_text", "story_state"} in row order
+    """
+    runs = [("A", run) for run in results["method_A"]] + [("B", run) for run in results["method_B"]]
+    max_turns = max(
+        [results["experiment"].get("turns_per_story", 0)] + [len(run["turn_lengths"]) for _, run in runs]
+    )
+    n = len(runs)
+
+    columns = {"method": np.array([method for method, _ in runs], dtype="<U1")}
+    for name in SCALAR_COLUMNS + USAGE_COLUMNS:
+        columns[name] = np.full(n, np.nan)
+    for name in TURN_COLUMNS:
+        columns[name] = np.full((n, max_turns), np.nan)
+    columns["turns_completed"] = np.zeros(n, dtype=np.int32)
+
+    texts = []
+    for row, (method, run) in enumerate(runs):
+        for name in SCALAR_COLUMNS:
+            columns[name][row] = run.get(name, np.nan)
+        completed = len(run["turn_lengths"])
+        columns["turns_completed"][row] = completed
+        columns["turn_lengths"][row, :completed] = run["turn_lengths"]
+
+        state = run.get("story_state")
+        if state is not None:
+            columns["facts_by_turn"][row] = _counts_by_turn(state["facts"], "turn_created", max_turns)
+            columns["items_by_turn"][row] = _counts_by_turn(state["items"], "discovered_turn", max_turns)
+            columns["inconsistencies_by_turn"][row] = _counts_by_turn(
+                state.get("inconsistencies", []), "turn", max_turns
+            )
+
+        usage = run.get("usage")
+        if usage:
+            for name in USAGE_COLUMNS:
+                columns[name][row] = usage[name]
+            # Usage turns are 1-based
+            for entry in usage["per_turn"]:
+                if 1 <= entry["turn"] <= max_turns:
+                    columns["prompt_tokens_by_turn"][row, entry["turn"] - 1] = entry["prompt_tokens"]
+                    columns["output_tokens_by_turn"][row, entry["turn"] - 1] = entry["output_tokens"]
+
+        texts.append({
+            "method": method,
+            "run_id": run["run_id"],
+            "story_text": run.get("story_text"),
+            "story_state": state,
+        })
+
+    meta = {
+        "experiment": results["experiment"],
+        "summary": results.get("summary", {}),
+        "runs": n,
+        "max_turns": max_turns,
+        "columns": sorted(columns) + ["text_offset"],
+    }
+    return columns, meta, texts
+
+
+def write_store(results, path, blobs=None):
+    """Write results as a columnar store in the directory path.
+
+    Args:
+        blobs: optional BlobStore; the sidecar then references the story text
+               and state in it instead of holding a copy
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    columns, meta, texts = build_columns(results)
+    if blobs is not None:
+        meta["blobs"] = os.path.relpath(blobs.path, path)
+
+    offsets = np.zeros(len(texts), dtype=np.int64)
+    with open(path / "text.jsonl", "wb") as f:
+        for row, record in enumerate(texts):
+            if blobs is not None:
+                record = pack(record, blobs)
+            offsets[row] = f.tell()
+            f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+    columns["text_offset"] = offsets
+
+    for name, values in columns.items():
+        np.save(path / f"{name}.npy", values)
+    with open(path / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+
+
+class ColumnarResults:
+    """Compare results as columns (memory-mapped when read from a store).
+
+    Args:
+        meta: store metadata (experiment, summary, max_turns, columns)
+        columns: optional dict name -> array (in-memory results)
+        path: optional store directory; columns are memory-mapped on first access
+        texts: optional in-memory text records (instead of the text.jsonl sidecar)
+    """
+
+    def __init__(self, meta, columns=None, path=None, texts=None):
+        self.meta = meta
+        self.path = Path(path) if path is not None else None
+        self._columns = dict(columns or {})
+        self._texts = texts
+
+    @property
+    def experiment(self):
+        return self.meta["experiment"]
+
+    @property
+    def summary(self):
+        return self.meta["summary"]
+
+    @property
+    def max_turns(self):
+        return self.meta["max_turns"]
+
+    def column(self, name, method=None):
+        """Column array, optionally restricted to the runs of one method."""
+        values = self._columns.get(name)
+        if values is None:
+            values = np.load(self.path / f"{name}.npy", mmap_mode="r")
+            self._columns[name] = values
+        if method is None:
+            return values
+        return values[self.column("method") == method]
+
+    def __getstate__(self):
+        # Worker processes re-map the store instead of receiving copies of the columns
+        state = dict(self.__dict__)
+        if self.path is not None:
+            state["_columns"] = {}
+        return state
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def rows(self, method):
+        """Row indices of the runs of one method."""
+        return np.flatnonzero(self.column("method") == method)
+
+    def story(self, row):
+        """Text record (story_text, story_state) of a run, read from the sidecar."""
+        if self._texts is not None:
+            return self._texts[row]
+        offset = int(self.column("text_offset")[row])
+        with open(self.path / "text.jsonl", "rb") as f:
+            f.seek(offset)
+            record = json.loads(f.readline())
+        if "blobs" in self.meta:
+            record = resolve(record, BlobStore(self.path / self.meta["blobs"]))
+        return record
+
+
+def open_store(path):
+    """Open a columnar store directory (no column is read until used)."""
+    path = Path(path)
+    with open(path / "meta.json", "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return ColumnarResults(meta, path=path)
+
+
+def from_results(results):
+    """In-memory ColumnarResults of a compare results dict (JSON inputs)."""
+    columns, meta, texts = build_columns(results)
+    return ColumnarResults(meta, columns=columns, texts=texts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a columnar store from compare JSON results")
+    parser.add_argument("--input", type=str, required=True,
+                        help="Directory with comparison_results_full.json (or comparison_results.json)")
+    args = parser.parse_args()
+
+    input_dir = Path(args.input)
+    results = load_results(input_dir)
+    blobs = open_blob_store(input_dir)
+    write_store(results, input_dir / STORE_DIRNAME, blobs=blobs if blobs.path.exists() else None)
+    print(f"Columnar store saved in: {input_dir / STORE_DIRNAME}")
@@ -0,0 +1,195 @@
+"""Deadline-aware execution: time budgets per call, per turn and per run.
+
+Deadlines are nested scopes propagated through contextvars, so
+call_gemini always sees the tightest remaining budget without it being
+passed through every function. When a budget expires, the in-flight
+request is abandoned (HTTP timeout + cancellation flag for requests not yet
+sent) and DeadlineExceeded is raised; DeadlinePolicy.on_timeout decides
+the degraded path taken by run_story_session:
+
+- "skip_analysis": skip the analysis of that turn (a timed-out generation skips the turn)
+- "retry_later":   re-run timed-out analyses after the last turn, if the run budget allows
+- "abort":         stop the run and return the partial state
+
+Every timeout is recorded in the policy log (see run_single_experiment metrics).
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+TIMEOUT_ACTIONS = ("skip_analysis", "retry_later", "abort")
+
+# Active deadlines of the current context: tuple of (scope, expires_at)
+_active_deadlines = contextvars.ContextVar("active_deadlines", default=())
+
+# Max duration of a single LLM call in the current context (None = no limit)
+_call_budget = contextvars.ContextVar("call_budget", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the budget of a call, turn or run has expired."""
+
+    def __init__(self, scope, message=None):
+        self.scope = scope
+        super().__init__(message or f"{scope} deadline exceeded")
+
+
+@contextmanager
+def deadline(seconds, scope):
+    """Open a deadline scope of `seconds` (None = no limit)."""
+    if seconds is None:
+        yield
+        return
+    token = _active_deadlines.set(_active_deadlines.get() + ((scope, time.time() + seconds),))
+    try:
+        yield
+    finally:
+        _active_deadlines.reset(token)
+
+
+def tightest():
+    """(scope, remaining_seconds) of the deadline expiring first, or (None, None)."""
+    active = _active_deadlines.get()
+    if not active:
+        return None, None
+    scope, expires_at = min(active, key=lambda d: d[1])
+    return scope, expires_at - time.time()
+
+
+def check():
+    """Raise DeadlineExceeded if any active deadline has expired."""
+    scope, remaining = tightest()
+    if scope is not None and remaining <= 0:
+        raise DeadlineExceeded(scope)
+
+
+def sleep(seconds):
+    """time.sleep that gives up (raising DeadlineExceeded) when the budget runs out first."""
+    scope, remaining = tightest()
+    if scope is not None and remaining < seconds:
+        time.sleep(max(0.0, remaining))
+        raise DeadlineExceeded(scope)
+    time.sleep(seconds)
+
+
+def run_with_timeout(fn, call_budget=True):
+    """Run fn(cancel_event) within the tightest of the active deadlines and the call budget.
+
+    fn receives a threading.Event that is set when the caller gives up, so it
+    can avoid sending a request that nobody will wait for. The call budget
+    is also opened as a "call" deadline inside fn, so tightest() there (the
+    HTTP timeout) includes it. Waits that are not part of the call (rate
+    limiter, key reservation) pass call_budget=False: only the turn and run
+    deadlines bound them.
+    Without any budget fn runs inline.
+    """
+    scope, remaining = tightest()
+    per_call_seconds = _call_budget.get() if call_budget else None
+    if per_call_seconds is not None and (remaining is None or per_call_seconds < remaining):
+        scope, remaining = "call", per_call_seconds
+    cancel = threading.Event()
+    if scope is None:
+        return fn(cancel)
+    if remaining <= 0:
+        raise DeadlineExceeded(scope)
+
+    outcome = {}
+    ctx = contextvars.copy_context()
+
+    def scoped():
+        with deadline(per_call_seconds, "call"):
+            return fn(cancel)
+
+    def target():
+        try:
+            outcome["result"] = ctx.run(scoped)
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(remaining)
+    if worker.is_alive():
+        cancel.set()
+        raise DeadlineExceeded(scope)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+class DeadlinePolicy:
+    """Budgets and degraded path for a session.
+
+    Args:
+        per_call_seconds: max duration of a single LLM call (None = no limit)
+        per_turn_seconds: max duration of a turn (generation + analysis)
+        per_run_seconds: max duration of a whole run
+        on_timeout: "skip_analysis", "retry_later" or "abort"
+    """
+
+    def __init__(self, per_call_seconds=None, per_turn_seconds=None, per_run_seconds=None,
+                 on_timeout="skip_analysis"):
+        if on_timeout not in TIMEOUT_ACTIONS:
+            raise ValueError(f"on_timeout must be one of {TIMEOUT_ACTIONS}")
+        self.per_call_seconds = per_call_seconds
+        self.per_turn_seconds = per_turn_seconds
+        self.per_run_seconds = per_run_seconds
+        self.on_timeout = on_timeout
+        self.timeouts = []
+        self.run_expires_at = None
+        self.aborted_at_turn = None
+        self.retried_analyses = 0
+
+    def start_run(self):
+        """Start the run budget (call once at the beginning of a session)."""
+        self.timeouts = []
+        self.aborted_at_turn = None
+        self.retried_analyses = 0
+        if self.per_run_seconds is not None:
+            self.run_expires_at = time.time() + self.per_run_seconds
+
+    @contextmanager
+    def run_scope(self):
+        """Scope with only the run budget (and the per-call budget) active."""
+        token = _call_budget.set(self.per_call_seconds)
+        try:
+            if self.run_expires_at is None:
+                yield
+            else:
+                with deadline(self.run_expires_at - time.time(), "run"):
+                    yield
+        finally:
+            _call_budget.reset(token)
+
+    @contextmanager
+    def turn_scope(self):
+        """Scope for one turn: run budget, turn budget and per-call budget."""
+        with self.run_scope():
+            with deadline(self.per_turn_seconds, "turn"):
+                yield
+
+    def record(self, turn, phase, error):
+        """Record a timeout (turn, phase = generation/analysis, expired scope, action taken)."""
+        self.timeouts.append({
+            "turn": turn,
+            "phase": phase,
+            "scope": error.scope,
+            "action": self.on_timeout,
+        })
+
+    def summary(self):
+        """Timeout counters for the run metrics."""
+        by_scope = {}
+        for t in self.timeouts:
+            by_scope[t["scope"]] = by_scope.get(t["scope"], 0) + 1
+        return {
+            "on_timeout": self.on_timeout,
+            "total_timeouts": len(self.timeouts),
+            "timeouts_by_scope": by_scope,
+            "aborted_at_turn": self.aborted_at_turn,
+            "retried_analyses": self.retried_analyses,
+            "timeouts": self.timeouts,
+        }
@@ -0,0 +1,61 @@
+"""Tunable generation settings (temperatures, output length, prompt windows).
+
+The defaults are the values the methods were designed with. A run can
+override any of them in a scope: like deadlines and usage, the settings are
+propagated through contextvars, so parallel runs of a sweep (sweep.py) each
+see their own configuration without it being passed through every function.
+
+Usage:
+    with generation_settings.override(temperature=0.9, facts_window=20):
+        run_story_session(...)
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+
+DEFAULTS = {
+    "temperature": 0.7,            # generation (both methods)
+    "final_temperature": 0.5,      # Method A generation in the final plot phase
+    "analysis_temperature": 0.2,   # analysis call (facts, items, violations)
+    "max_output_tokens": 2048,
+    "facts_window": 10,            # last facts shown in the prompt
+    "inconsistencies_window": 3,   # last errors shown in the Method A feedback
+    "rules_window": 5,             # world rules / implicit rules shown in the prompt
+}
+
+_current = contextvars.ContextVar("generation_settings", default=DEFAULTS)
+
+
+def get(name):
+    """Value of a setting in the current context."""
+    return _current.get()[name]
+
+
+def current():
+    """All the settings of the current context."""
+    return dict(_current.get())
+
+
+def validate(settings):
+    """settings with each value cast to the type of its default (ValueError on unknown names)."""
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown generation settings: {', '.join(sorted(unknown))} "
+                         f"(available: {', '.join(DEFAULTS)})")
+    settings = {name: type(DEFAULTS[name])(value) for name, value in settings.items()}
+    for name, value in settings.items():
+        # Windows are slices from the end: 0 would select everything
+        if isinstance(value, int) and value < 1 or value < 0:
+            raise ValueError(f"Invalid value for {name}: {value}")
+    return settings
+
+
+@contextmanager
+def override(**settings):
+    """Scope in which the given settings replace the current ones."""
+    token = _current.set({**_current.get(), **validate(settings)})
+    try:
+        yield
+    finally:
+        _current.reset(token)
@@ -0,0 +1,202 @@
+"""Hedged requests to cut tail latency of LLM calls.
+
+If a call has not returned after a percentile of recent latency (tracked
+online), a duplicate request is fired and the first successful answer wins.
+The number of duplicates is capped by a hedge budget (fraction of calls),
+so quota is not blown. A duplicate is a request of its own for the
+accounting: its tokens and cost are recorded in usage (the loser's too, when
+it completes) and, with a key pool, it reserves and reports on a key.
+Without a key pool a duplicate needs a free slot of the single-key rate
+limiter right away (classes.try_rate_limit): when the next slot is taken,
+no duplicate is sent (counted in rate_limited).
+
+Usage:
+    from classes import set_hedge_policy
+    from hedging import HedgePolicy
+
+    set_hedge_policy(HedgePolicy(percentile=95, budget_ratio=0.1))
+
+    python run.py compare --hedge --hedge-percentile 95 --hedge-budget 0.1
+
+Demo against the local stand-in backend (heavy-tailed latency):
+    python hedging.py --calls 300
+"""
+
+import argparse
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (0 if empty)."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies (seconds)."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = list(self._samples)
+        return percentile(samples, pct)
+
+
+class HedgePolicy:
+    """Fire a duplicate request when the first one is slower than usual.
+
+    Args:
+        percentile: hedge after this percentile of recent latency
+        min_samples: no hedging until this many latencies have been observed
+        budget_ratio: max duplicates as a fraction of calls (0.1 = +10% requests)
+        window: number of recent latencies tracked
+        min_delay: never hedge before this many seconds
+        max_workers: threads available for in-flight requests
+    """
+
+    def __init__(self, percentile=95, min_samples=20, budget_ratio=0.1, window=200,
+                 min_delay=0.0, max_workers=32):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.min_delay = min_delay
+        self.tracker = LatencyTracker(window)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "hedges_fired": 0,
+            "hedge_wins": 0,
+            "budget_exhausted": 0,
+            "rate_limited": 0,  # hedge due but no rate-limit slot free: not sent
+        }
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while still warming up."""
+        if self.tracker.count() < self.min_samples:
+            return None
+        return max(self.min_delay, self.tracker.percentile(self.percentile))
+
+    def call(self, fn, hedge_fn=None, may_hedge=None):
+        """Run fn() with hedging and return the first successful result.
+
+        Args:
+            fn: the request
+            hedge_fn: the duplicate request (default: fn), e.g. with its own key reservation
+            may_hedge: optional callable, checked when a hedge is due: False = no
+                duplicate (e.g. no rate-limit slot free now)
+
+        Both run in a copy of the caller's context (usage recorder, deadlines).
+        The losing request is not cancelled (the client is synchronous):
+        its result is simply discarded.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+
+        start = time.time()
+        primary = self._executor.submit(contextvars.copy_context().run, fn)
+        delay = self.hedge_delay()
+
+        if delay is not None:
+            done, _ = wait([primary], timeout=delay)
+            if not done and self._take_budget():
+                if may_hedge is None or may_hedge():
+                    hedge = self._executor.submit(contextvars.copy_context().run, hedge_fn or fn)
+                    return self._first_success(primary, hedge, start)
+                with self._lock:
+                    self._stats["hedges_fired"] -= 1
+                    self._stats["rate_limited"] += 1
+
+        result = primary.result()
+        self.tracker.record(time.time() - start)
+        return result
+
+    def get_stats(self):
+        """Counters plus the current hedge threshold."""
+        with self._lock:
+            stats = dict(self._stats)
+        delay = self.hedge_delay()
+        stats["hedge_delay_seconds"] = round(delay, 3) if delay is not None else None
+        stats["hedge_rate"] = round(stats["hedges_fired"] / stats["calls"], 3) if stats["calls"] else 0
+        return stats
+
+    def _take_budget(self):
+        with self._lock:
+            if self._stats["hedges_fired"] + 1 > self.budget_ratio * self._stats["calls"]:
+                self._stats["budget_exhausted"] += 1
+                return False
+            self._stats["hedges_fired"] += 1
+            return True
+
+    def _first_success(self, primary, hedge, start):
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.tracker.record(time.time() - start)
+                    if future is hedge:
+                        with self._lock:
+                            self._stats["hedge_wins"] += 1
+                    return future.result()
+                if first_error is None:
+                    first_error = future.exception()
+        raise first_error
+
+
+def _run_demo(calls):
+    """Run `calls` generation calls and return the observed latencies."""
+    from classes import call_gemini
+
+    latencies = []
+    for _ in range(calls):
+        start = time.time()
+        call_gemini("Continua la storia.")
+        latencies.append(time.time() - start)
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hedged requests demo on the local backend")
+    parser.add_argument("--calls", type=int, default=300, help="Calls per configuration")
+    parser.add_argument("--percentile", type=float, default=95, help="Hedge percentile")
+    parser.add_argument("--budget", type=float, default=0.1, help="Hedge budget ratio")
+    parser.add_argument("--seed", type=int, default=7, help="Latency seed")
+    args = parser.parse_args()
+
+    import classes
+    from local_backend import LocalBackendClient, heavy_tailed_latency
+
+    classes.RATE_LIMIT_DELAY = 0
+    for label, policy in [
+        ("no hedging", None),
+        ("hedged", HedgePolicy(percentile=args.percentile, budget_ratio=args.budget)),
+    ]:
+        classes.set_client(LocalBackendClient(latency=heavy_tailed_latency(median=0.01), seed=args.seed))
+        classes.set_hedge_policy(policy)
+        lat = _run_demo(args.calls)
+        print(f"{label:<12} p50={percentile(lat, 50)*1000:.1f}ms "
+              f"p95={percentile(lat, 95)*1000:.1f}ms p99={percentile(lat, 99)*1000:.1f}ms")
+        if policy is not None:
+            print(f"             {policy.get_stats()}")
+    classes.set_hedge_policy(None)
@@ -0,0 +1,237 @@
+"""Credential pool: several API keys/projects, each with its own RPM/TPM limits.
+
+Every call in call_gemini is routed to the key with the most headroom in the
+current window. Keys that return quota (429) or auth (401/403) errors are
+quarantined for a while and the call is retried on another key. Per-key
+utilisation is available in get_stats().
+
+Configuration from environment:
+    GEMINI_API_KEYS="key1,key2,key3"   # comma separated
+    GEMINI_KEY_RPM=5                    # requests per minute per key (default 5)
+    GEMINI_KEY_TPM=250000               # tokens per minute per key (default 250000)
+
+or from a JSON file (--keys-file in run.py):
+    [{"name": "proj-a", "api_key": "...", "rpm": 15, "tpm": 1000000}, ...]
+
+Offline demo with the local stand-in backend:
+    python key_pool.py --keys 1
+    python key_pool.py --keys 4
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+# HTTP codes that put a key in quarantine
+QUOTA_ERROR_CODES = (429,)
+AUTH_ERROR_CODES = (401, 403)
+
+
+def estimate_prompt_tokens(text):
+    """Rough token estimate used for TPM accounting before the call (4 chars/token)."""
+    return max(1, len(text) // 4)
+
+
+def error_code(exc):
+    """HTTP status of a google.genai error (None for other exceptions)."""
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def _default_client_factory(api_key):
+    from google import genai
+    from google.genai import types
+
+    return genai.Client(api_key=api_key, http_options=types.HttpOptions(api_version='v1beta'))
+
+
+class PoolKey:
+    """One credential with its sliding-window usage."""
+
+    def __init__(self, name, api_key, rpm, tpm, client):
+        self.name = name
+        self.api_key = api_key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.client = client
+        self.requests = deque()   # timestamps
+        self.tokens = deque()     # [timestamp, tokens] reservations
+        self.quarantined_until = 0.0
+        self.stats = {"calls": 0, "tokens": 0, "quota_errors": 0, "auth_errors": 0, "quarantines": 0}
+
+
+class KeyPool:
+    """Route calls to the key with the most RPM/TPM headroom.
+
+    Args:
+        keys: list of dicts with name, api_key, rpm, tpm
+        quarantine_seconds: how long a key is skipped after a quota/auth error
+        window_seconds: length of the rate-limit window (60 for per-minute limits)
+        client_factory: callable api_key -> client (default: genai.Client)
+    """
+
+    def __init__(self, keys, quarantine_seconds=60, window_seconds=60, client_factory=None):
+        if not keys:
+            raise ValueError("KeyPool needs at least one key")
+        factory = client_factory or _default_client_factory
+        self.quarantine_seconds = quarantine_seconds
+        self.window_seconds = window_seconds
+        self.keys = [
+            PoolKey(
+                name=k.get("name", f"key_{i+1}"),
+                api_key=k["api_key"],
+                rpm=k.get("rpm", 5),
+                tpm=k.get("tpm", 250000),
+                client=factory(k["api_key"]),
+            )
+            for i, k in enumerate(keys)
+        ]
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.throttled_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """Build a pool from GEMINI_API_KEYS (None if the variable is not set)."""
+        raw = os.environ.get("GEMINI_API_KEYS", "")
+        api_keys = [k.strip() for k in raw.split(",") if k.strip()]
+        if not api_keys:
+            return None
+        rpm = int(os.environ.get("GEMINI_KEY_RPM", "5"))
+        tpm = int(os.environ.get("GEMINI_KEY_TPM", "250000"))
+        keys = [{"name": f"key_{i+1}", "api_key": k, "rpm": rpm, "tpm": tpm}
+                for i, k in enumerate(api_keys)]
+        return cls(keys, **kwargs)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Build a pool from a JSON list of {name, api_key, rpm, tpm}."""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    def acquire(self, estimated_tokens=0):
+        """Block until a key has headroom and reserve one request on it.
+
+        Returns:
+            (key, reservation) - pass both to report_success/report_error
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                best, best_headroom, next_free = None, 0.0, None
+                for key in self.keys:
+                    if key.quarantined_until > now:
+                        next_free = min(next_free or key.quarantined_until, key.quarantined_until)
+                        continue
+                    self._expire(key, now)
+                    headroom = self._headroom(key, estimated_tokens)
+                    if headroom > best_headroom:
+                        best, best_headroom = key, headroom
+                    elif key.requests:
+                        free_at = key.requests[0] + self.window_seconds
+                        next_free = min(next_free or free_at, free_at)
+
+                if best is not None:
+                    reservation = [now, estimated_tokens]
+                    best.requests.append(now)
+                    best.tokens.append(reservation)
+                    best.stats["calls"] += 1
+                    return best, reservation
+
+                wait = max(0.01, (next_free or now + 1) - now)
+            wait = min(wait, 1.0)
+            time.sleep(wait)
+            with self._lock:
+                self.throttled_seconds += wait
+
+    def report_success(self, key, reservation, total_tokens):
+        """Replace the token estimate of the reservation with the real usage."""
+        with self._lock:
+            key.stats["tokens"] += total_tokens
+            reservation[1] = total_tokens
+
+    def report_error(self, key, exc):
+        """Quarantine the key on quota/auth errors.
+
+        Returns:
+            True if the call can be retried on another key
+        """
+        code = error_code(exc)
+        if code not in QUOTA_ERROR_CODES and code not in AUTH_ERROR_CODES:
+            return False
+        with self._lock:
+            if code in QUOTA_ERROR_CODES:
+                key.stats["quota_errors"] += 1
+                duration = self.quarantine_seconds
+            else:
+                key.stats["auth_errors"] += 1
+                # Bad credentials do not heal by themselves
+                duration = self.quarantine_seconds * 60
+            key.stats["quarantines"] += 1
+            key.quarantined_until = time.time() + duration
+        print(f"[WARNING] Key {key.name} quarantined for {duration}s after error {code}")
+        return True
+
+    def get_stats(self):
+        """Per-key utilisation (requests/tokens vs. limits since the pool was created)."""
+        with self._lock:
+            elapsed_windows = max((time.time() - self._started) / self.window_seconds, 1e-9)
+            per_key = {}
+            for key in self.keys:
+                per_key[key.name] = dict(key.stats)
+                per_key[key.name]["rpm_utilisation"] = round(
+                    min(1.0, key.stats["calls"] / (key.rpm * max(elapsed_windows, 1.0))), 3
+                )
+                per_key[key.name]["quarantined"] = key.quarantined_until > time.time()
+            return {"keys": per_key, "throttled_seconds": round(self.throttled_seconds, 2)}
+
+    def _expire(self, key, now):
+        limit = now - self.window_seconds
+        while key.requests and key.requests[0] <= limit:
+            key.requests.popleft()
+        while key.tokens and key.tokens[0][0] <= limit:
+            key.tokens.popleft()
+
+    def _headroom(self, key, estimated_tokens):
+        """Free fraction of the tightest limit after this call (0 = no room)."""
+        rpm_free = (key.rpm - len(key.requests)) / key.rpm
+        used_tokens = sum(t for _, t in key.tokens)
+        # A prompt larger than the whole TPM budget only needs an empty window
+        tpm_free = (key.tpm - used_tokens - min(estimated_tokens, key.tpm)) / key.tpm
+        if tpm_free == 0 and used_tokens == 0:
+            tpm_free = rpm_free
+        return max(0.0, min(rpm_free, tpm_free))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Key pool throughput demo on the local backend")
+    parser.add_argument("--keys", type=int, default=2, help="Number of keys")
+    parser.add_argument("--rpm", type=int, default=10, help="Requests per window per key")
+    parser.add_argument("--calls", type=int, default=60, help="Total calls")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent callers")
+    args = parser.parse_args()
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    import classes
+    from local_backend import LocalBackendClient, constant_latency
+
+    # 1-second window so the demo runs in seconds instead of minutes
+    pool = KeyPool(
+        [{"name": f"key_{i+1}", "api_key": f"local-{i+1}", "rpm": args.rpm} for i in range(args.keys)],
+        window_seconds=1,
+        client_factory=lambda api_key: LocalBackendClient(latency=constant_latency(0.01)),
+    )
+    classes.set_key_pool(pool)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(lambda _: classes.call_gemini("Continua la storia."), range(args.calls)))
+    elapsed = time.time() - start
+
+    print(f"{args.keys} keys: {args.calls} calls in {elapsed:.2f}s ({args.calls / elapsed:.1f} calls/s)")
+    print(json.dumps(pool.get_stats(), indent=2))
@@ -0,0 +1,171 @@
+"""Local stand-in for the Gemini client, for offline testing and benchmarks.
+
+LocalBackendClient exposes the same surface used by classes.call_gemini
+(client.models.generate_content) and returns real google.genai response
+objects, so the whole pipeline runs without network or quota.
+
+Usage:
+    from classes import set_client
+    from local_backend import LocalBackendClient, heavy_tailed_latency
+
+    set_client(LocalBackendClient(latency=heavy_tailed_latency(median=0.05), seed=1))
+"""
+
+import random
+import re
+import threading
+import time
+
+from google.genai import errors, types
+
+
+# Canned answer for analysis prompts (same format parsed by update_state_from_output)
+CANNED_ANALYSIS = """FATTI:
+- I monaci scoprono una nuova traccia del ladro
+- Li Wei decide di proseguire verso la città imperiale
+
+OGGETTI:
+- Fenice di Giada | ladro | rubata
+
+VIOLAZIONI:
+- NESSUNA"""
+
+# Words used to build canned story paragraphs
+_STORY_WORDS = (
+    "il monastero la montagna Li Wei Mei Lin Zhang Hao il generale Zhao "
+    "il vento la neve il tempio il fuoco l'acqua la terra il metallo il legno "
+    "i monaci avanzano lentamente mentre la tempesta si avvicina e il chi scorre"
+).split()
+
+
+def constant_latency(seconds):
+    """Latency model: always the same delay."""
+    return lambda rng: seconds
+
+
+def heavy_tailed_latency(median=0.05, sigma=0.3, tail_prob=0.05, tail_factor=20.0):
+    """Latency model: lognormal body with occasional very slow calls.
+
+    Args:
+        median: median latency in seconds
+        sigma: lognormal spread of the body
+        tail_prob: probability that a call lands in the slow tail
+        tail_factor: slow calls take about tail_factor times the median
+    """
+    import math
+
+    mu = math.log(median)
+
+    def sample(rng):
+        latency = rng.lognormvariate(mu, sigma)
+        if rng.random() < tail_prob:
+            latency *= tail_factor * (0.5 + rng.random())
+        return latency
+
+    return sample
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class _LocalModels:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def generate_content(self, model, contents, config=None):
+        return self._backend._generate(model, contents, config)
+
+
+class LocalBackendClient:
+    """Drop-in replacement for genai.Client (only models.generate_content).
+
+    Args:
+        latency: latency model, a callable taking a random.Random and returning seconds
+        seed: seed for reproducible latency/errors
+        story_words: length of canned story paragraphs (in words)
+        blocked_rate: probability of an empty response blocked by safety filters
+        quota_error_rate: probability of a 429 RESOURCE_EXHAUSTED error
+        analysis_response: text returned for analysis prompts
+    """
+
+    def __init__(
+        self,
+        latency=None,
+        seed=None,
+        story_words=180,
+        blocked_rate=0.0,
+        quota_error_rate=0.0,
+        analysis_response=CANNED_ANALYSIS,
+    ):
+        self.latency = latency or constant_latency(0.0)
+        self.story_words = story_words
+        self.blocked_rate = blocked_rate
+        self.quota_error_rate = quota_error_rate
+        self.analysis_response = analysis_response
+        self.models = _LocalModels(self)
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _generate(self, model, contents, config):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency(self._rng)
+            roll_error = self._rng.random()
+            roll_blocked = self._rng.random()
+            words = [self._rng.choice(_STORY_WORDS) for _ in range(self.story_words)]
+
+        time.sleep(delay)
+
+        if roll_error < self.quota_error_rate:
+            raise errors.ClientError(
+                429,
+                {"error": {"code": 429, "message": "Quota exceeded (local backend)",
+                           "status": "RESOURCE_EXHAUSTED"}},
+            )
+
+        prompt = contents if isinstance(contents, str) else str(contents)
+        if roll_blocked < self.blocked_rate:
+            return types.GenerateContentResponse(
+                candidates=[types.Candidate(finish_reason=types.FinishReason.SAFETY)],
+                usage_metadata=types.GenerateContentResponseUsageMetadata(
+                    prompt_token_count=estimate_tokens(prompt),
+                    candidates_token_count=0,
+                    total_token_count=estimate_tokens(prompt),
+                ),
+            )
+
+        if "Analizza questo frammento" in prompt:
+            text = self.analysis_response
+        elif "Analizza questi" in prompt:
+            # Batched analysis (reanalyze.py): one section per fragment
+            text = "\n\n".join(f"=== FRAMMENTO {n} ===\n{self.analysis_response}"
+                                 for n in re.findall(r"^<<<FRAMMENTO (\d+)>>>$", prompt, re.MULTILINE))
+        else:
+            text = " ".join(words).capitalize() + "."
+
+        # Respect max_output_tokens like the real API (truncate + MAX_TOKENS)
+        finish_reason = types.FinishReason.STOP
+        max_tokens = getattr(config, "max_output_tokens", None) if config is not None else None
+        if max_tokens and estimate_tokens(text) > max_tokens:
+            text = text[: max_tokens * 4]
+            finish_reason = types.FinishReason.MAX_TOKENS
+
+        prompt_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(text)
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=[types.Part(text=text)]),
+                    finish_reason=finish_reason,
+                )
+            ],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
@@ -0,0 +1,120 @@
+"""Streaming story metrics, updated turn by turn.
+
+story_state only grows (facts, items, inconsistencies and history are
+append-only), so the accumulator remembers how many entries of each list it
+has already seen and only looks at the new ones: every fact, item,
+inconsistency or turn costs O(its size) (key terms, word count), instead of
+rescanning the whole state when the session ends.
+
+At the end of each turn it emits a metrics row (new and cumulative counts);
+summary() returns the same fields as the end-of-run metrics and is valid at
+any point, so runs stopped early (timeouts, errors) still produce metrics.
+
+An inconsistency is repeated when it falls in a cluster of the session
+ViolationIndex (violations.session_index, shared with the prompt builder)
+that already holds an earlier one.
+
+Usage:
+    accumulator = MetricsAccumulator(turns=10, on_row=print)
+    run_story_session(..., metrics_accumulator=accumulator)
+    metrics.update(accumulator.summary())
+"""
+
+from violations import session_index
+
+
+class MetricsAccumulator:
+    """Online facts/items/inconsistencies/turn-length metrics of one session.
+
+    Args:
+        turns: planned turns (used for rates until turns are completed)
+        on_row: optional callback(row) called with the metrics row of every turn
+    """
+
+    def __init__(self, turns, on_row=None):
+        self.turns = turns
+        self.on_row = on_row
+        self._seen = {"facts": 0, "items": 0, "inconsistencies": 0, "history": 0}
+        self.total_facts = 0
+        self.total_objects = 0
+        self.total_inconsistencies = 0
+        self.repeated_inconsistencies = 0
+        self.inconsistencies_by_type = {}
+        self.turn_lengths = []
+        self.total_words = 0
+        self.rows = []
+        self.story_state = None  # last state observed (metrics of runs that fail midway)
+
+    def _add_inconsistency(self, inc):
+        self.total_inconsistencies += 1
+        inc_type = inc.get("type", "altro")
+        self.inconsistencies_by_type[inc_type] = self.inconsistencies_by_type.get(inc_type, 0) + 1
+
+    def _add_turn(self, entry):
+        words = len(entry["assistant"].split())
+        self.turn_lengths.append(words)
+        self.total_words += words
+
+    def observe(self, story_state):
+        """Absorb the entries appended to story_state since the last call.
+
+        Returns:
+            dict with the number of new facts, items, inconsistencies and turns
+        """
+        self.story_state = story_state
+        new = {}
+        for key, add in (
+            ("facts", None),
+            ("items", None),
+            ("inconsistencies", self._add_inconsistency),
+            ("history", self._add_turn),
+        ):
+            entries = story_state.get(key, [])
+            start = self._seen[key]
+            new[key] = len(entries) - start
+            if add is not None:
+                for entry in entries[start:]:
+                    add(entry)
+            self._seen[key] = len(entries)
+        self.total_facts += new["facts"]
+        self.total_objects += new["items"]
+        if new["inconsistencies"]:
+            self.repeated_inconsistencies = session_index(story_state).repeated
+        return new
+
+    def end_turn(self, story_state, turn):
+        """Absorb the entries of a finished turn and emit its metrics row."""
+        new = self.observe(story_state)
+        row = {
+            "turn": turn + 1,
+            "words": self.turn_lengths[-1] if new["history"] else 0,
+            "new_facts": new["facts"],
+            "new_objects": new["items"],
+            "new_inconsistencies": new["inconsistencies"],
+            "total_facts": self.total_facts,
+            "total_objects": self.total_objects,
+            "total_inconsistencies": self.total_inconsistencies,
+            "repeated_inconsistencies": self.repeated_inconsistencies,
+        }
+        self.rows.append(row)
+        if self.on_row is not None:
+            self.on_row(row)
+        return row
+
+    def summary(self):
+        """Run metrics (same fields as run.compute_story_metrics) from the turns seen so far."""
+        # Rates over the completed turns, so partial runs are not diluted
+        turns = len(self.turn_lengths) or self.turns or 1
+        avg_turn_length = self.total_words / len(self.turn_lengths) if self.turn_lengths else 0
+        return {
+            "total_facts": self.total_facts,
+            "facts_per_turn": round(self.total_facts / turns, 2),
+            "total_objects": self.total_objects,
+            "total_inconsistencies": self.total_inconsistencies,
+            "inconsistency_rate": round(self.total_inconsistencies / turns, 2),
+            "repeated_inconsistencies": self.repeated_inconsistencies,
+            "inconsistencies_by_type": dict(self.inconsistencies_by_type),
+            "avg_turn_length_words": round(avg_turn_length, 2),
+            "turn_lengths": list(self.turn_lengths),
+            "turns_completed": len(self.turn_lengths),
+        }
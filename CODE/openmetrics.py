@@ -0,0 +1,225 @@
+"""OpenMetrics counters and histograms for story sessions.
+
+Exposes, in the OpenMetrics text format:
+- llm_call_duration_seconds (histogram, by call_type: generation / analysis)
+- llm_tokens_total (by call_type and kind: prompt / cached / output)
+- llm_retries_total (by reason: key_pool / analysis_retry)
+- llm_blocked_responses_total (by call_type)
+- story_facts_extracted, story_items_extracted, story_inconsistencies_detected
+  (histograms of the per-turn counts merged by the analysis parser)
+- analysis_parse_failures_total (by reason: no_sections / error)
+- best_of_n_accepted_rank, best_of_n_added_latency_seconds (histograms, see best_of_n.py)
+
+either on an HTTP endpoint (GET /metrics, for Prometheus scraping) or in a
+file for the node_exporter textfile collector. The endpoint listens on
+localhost only unless another host is given explicitly (e.g. "0.0.0.0"
+to let a remote Prometheus scrape it: the metrics are not authenticated).
+
+Metrics are off unless a registry is enabled: every hook then costs a single
+global lookup. Like progress.py, the registry is process-wide so that worker
+threads report into it.
+
+Usage:
+    registry = MetricsRegistry()
+    with exporting(registry, port=9464, textfile="/var/lib/node_exporter/story.prom"):
+        run_story_session(...)
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from usage import response_tokens
+
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+DEFAULT_HOST = "127.0.0.1"  # loopback only: exposing the endpoint is opt-in
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "llm_call_duration_seconds": ("histogram", "Latency of LLM requests.", LATENCY_BUCKETS),
+    "llm_tokens": ("counter", "Tokens used by LLM calls.", None),
+    "llm_retries": ("counter", "LLM calls retried.", None),
+    "llm_blocked_responses": ("counter", "Responses blocked or empty.", None),
+    "story_facts_extracted": ("histogram", "Facts extracted per analyzed turn.", COUNT_BUCKETS),
+    "story_items_extracted": ("histogram", "New items extracted per analyzed turn.", COUNT_BUCKETS),
+    "story_inconsistencies_detected": ("histogram", "Inconsistencies detected per analyzed turn.", COUNT_BUCKETS),
+    "analysis_parse_failures": ("counter", "Analysis responses that could not be parsed.", None),
+    "best_of_n_accepted_rank": ("histogram", "Arrival rank of the accepted best-of-N candidate.", COUNT_BUCKETS),
+    "best_of_n_added_latency_seconds": ("histogram", "Latency added waiting for best-of-N candidates.",
+                                        LATENCY_BUCKETS),
+}
+
+_registry = None
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter (no-op while metrics are disabled)."""
+    registry = _registry
+    if registry is not None:
+        registry.inc(name, value, labels)
+
+
+def observe(name, value, **labels):
+    """Add an observation to a histogram (no-op while metrics are disabled)."""
+    registry = _registry
+    if registry is not None:
+        registry.observe(name, value, labels)
+
+
+def observe_response(response, call_type, prompt_text=""):
+    """Count the tokens of a generate_content response."""
+    registry = _registry
+    if registry is None:
+        return
+    prompt_tokens, cached_tokens, output_tokens, _ = response_tokens(response, prompt_text)
+    registry.inc("llm_tokens", prompt_tokens, {"call_type": call_type, "kind": "prompt"})
+    registry.inc("llm_tokens", cached_tokens, {"call_type": call_type, "kind": "cached"})
+    registry.inc("llm_tokens", output_tokens, {"call_type": call_type, "kind": "output"})
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class MetricsRegistry:
+    """Counters and histograms of the METRICS families, by label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, label key) -> value
+        self._histograms = {}  # (name, label key) -> {"buckets": [...], "sum", "count"}
+
+    def enable(self):
+        """Make this registry the one the hooks report to."""
+        global _registry
+        _registry = self
+
+    @staticmethod
+    def disable():
+        global _registry
+        _registry = None
+
+    def inc(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        bounds = METRICS[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = {"buckets": [0] * len(bounds), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render(self):
+        """All metrics in the OpenMetrics text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]}
+                          for key, v in self._histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text, bounds) in METRICS.items():
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"# HELP {name} {help_text}")
+            if metric_type == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}_total{_format_labels(labels)} {value}")
+                continue
+            for (metric, labels), entry in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                # Buckets are cumulative: each counts the observations <= le
+                for bound, count in zip(bounds, entry["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_bound(bound))])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {entry['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {entry['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {entry['count']}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write the metrics for the textfile collector (atomic rename)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def serve(registry, port, host=DEFAULT_HOST):
+    """Serve GET /metrics in a background thread; returns the server (call shutdown())."""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextmanager
+def exporting(registry, port=None, textfile=None, interval=15.0, host=DEFAULT_HOST):
+    """Enable registry and export it (HTTP endpoint on host:port and/or textfile refreshed every interval s)."""
+    registry.enable()
+    server = serve(registry, port, host) if port else None
+    stop = threading.Event()
+    writer = None
+    if textfile:
+        def write_loop():
+            while not stop.wait(interval):
+                registry.write_textfile(textfile)
+        writer = threading.Thread(target=write_loop, daemon=True)
+        writer.start()
+        print(f"[INFO] OpenMetrics textfile: {textfile}")
+    if server is not None:
+        print(f"[INFO] OpenMetrics endpoint: http://{host}:{server.server_address[1]}/metrics")
+    try:
+        yield registry
+    finally:
+        stop.set()
+        if writer is not None:
+            writer.join()
+            registry.write_textfile(textfile)
+        if server is not None:
+            server.shutdown()
+        MetricsRegistry.disable()
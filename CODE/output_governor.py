@@ -0,0 +1,183 @@
+"""Adaptive max_output_tokens per call type and plot phase.
+
+Every call used to request the full max_output_tokens (2048) although a
+turn is "1-2 paragrafi" and the analysis answer a short list. The governor
+tracks the output length of recent calls per (call type, plot phase) and,
+after a warmup, caps the next calls at a high percentile of it times a
+headroom. A call that hits the cap (finish reason MAX_TOKENS) is handled
+in one of two ways:
+- early stop: a generation that already reached the usual length of its
+  key is accepted, trimmed to its last complete sentence. Runaway answers
+  stop at the cap instead of decoding up to 2048 tokens;
+- retry: anything else (short generations, every analysis, which would
+  lose its VIOLAZIONI section) is sent again with the cap doubled, up to
+  the max_output_tokens setting.
+
+get_stats() reports, per key, the current cap, the truncations, retries and
+early stops, the output tokens spent on discarded truncated answers and an
+estimate of the decode time saved. An early-stopped answer is assumed to go
+on as long as the uncapped answers of the same call type that passed its cap
+(0 if none did), at the observed seconds per output token; the API time of
+discarded truncated answers is subtracted.
+
+Usage:
+    from classes import set_output_governor
+    from output_governor import OutputGovernor
+
+    set_output_governor(OutputGovernor())
+
+    python run.py compare --runs 3 --adaptive-output
+"""
+
+import math
+import re
+import statistics
+import threading
+from collections import deque
+
+from hedging import percentile
+
+
+# Trim point of an early-stopped generation: end of the last complete sentence
+_SENTENCE_END = re.compile(r"[.!?…»\"”](?=\s|$)")
+
+
+class OutputGovernor:
+    """Learned output-token caps with truncation detection.
+
+    Args:
+        percentile: cap at this percentile of the recent output lengths of a key
+        headroom: multiplier over the percentile
+        min_tokens: never cap below this many tokens
+        warmup: calls of a key observed with the full cap before capping it
+        window: recent output lengths kept per key
+        early_stop: accept truncated generations that already reached the usual length
+    """
+
+    def __init__(self, percentile=95, headroom=1.3, min_tokens=128, warmup=5, window=100, early_stop=True):
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_tokens = min_tokens
+        self.warmup = warmup
+        self.window = window
+        self.early_stop = early_stop
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._uncapped = {}  # call type -> output tokens of answers sent with the full cap
+
+    def _key(self, call_type, phase):
+        key = (call_type, phase)
+        if key not in self._keys:
+            self._keys[key] = {
+                "lengths": deque(maxlen=self.window),  # output tokens of complete answers
+                "seconds_per_token": deque(maxlen=self.window),
+                "ceiling": None,
+                "early_stop_caps": [],
+                "calls": 0,
+                "truncations": 0,
+                "retries": 0,
+                "early_stops": 0,
+                "retry_output_tokens": 0,
+                "retry_seconds": 0.0,
+                "capped_tokens": 0,  # sum of the caps requested
+            }
+        return self._keys[key]
+
+    def cap(self, call_type, phase, ceiling):
+        """max_output_tokens for the next call of a key (the ceiling while warming up)."""
+        with self._lock:
+            entry = self._key(call_type, phase)
+            if len(entry["lengths"]) < self.warmup:
+                return ceiling
+            learned = percentile(list(entry["lengths"]), self.percentile) * self.headroom
+        return int(min(ceiling, max(self.min_tokens, math.ceil(learned))))
+
+    def review(self, call_type, phase, text, output_tokens, truncated, cap, ceiling, seconds):
+        """Decide what to do with an answer.
+
+        Args:
+            text: answer text ("" if the response had none)
+            output_tokens: output tokens of the answer
+            truncated: True if the finish reason was MAX_TOKENS
+            cap: max_output_tokens the call was sent with
+            ceiling: max_output_tokens setting (largest cap allowed)
+            seconds: API time of the call
+
+        Returns:
+            ("accept", None), ("trim", trimmed text) or ("retry", larger cap)
+        """
+        with self._lock:
+            entry = self._key(call_type, phase)
+            entry["calls"] += 1
+            entry["capped_tokens"] += cap
+            entry["ceiling"] = ceiling
+            if output_tokens:
+                entry["seconds_per_token"].append(seconds / output_tokens)
+
+            if not truncated:
+                entry["lengths"].append(output_tokens)
+                if cap >= ceiling:
+                    self._uncapped.setdefault(call_type, deque(maxlen=self.window)).append(output_tokens)
+                return "accept", None
+
+            entry["truncations"] += 1
+            if cap >= ceiling:
+                # Already at the ceiling: nothing larger to ask for
+                return "accept", None
+
+            usual = statistics.median(entry["lengths"]) if entry["lengths"] else None
+            if self.early_stop and call_type == "generation" and usual is not None and output_tokens >= usual:
+                trimmed = _trim_to_sentence(text)
+                if trimmed:
+                    entry["early_stops"] += 1
+                    entry["early_stop_caps"].append(cap)
+                    entry["lengths"].append(output_tokens)
+                    return "trim", trimmed
+
+            entry["retries"] += 1
+            entry["retry_output_tokens"] += output_tokens
+            entry["retry_seconds"] += seconds
+        return "retry", min(ceiling, cap * 2)
+
+    def get_stats(self):
+        """Per-key counters, current caps and the estimated decode time saved."""
+        with self._lock:
+            keys = {key: {**entry, "lengths": list(entry["lengths"]),
+                          "seconds_per_token": list(entry["seconds_per_token"]),
+                          "early_stop_caps": list(entry["early_stop_caps"])}
+                    for key, entry in self._keys.items()}
+            uncapped = {call_type: list(values) for call_type, values in self._uncapped.items()}
+        stats = {"keys": {}, "decode_seconds_saved": 0.0}
+        for (call_type, phase), entry in sorted(keys.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            lengths = entry["lengths"]
+            cap = None
+            if len(lengths) >= self.warmup:
+                cap = min(entry["ceiling"], max(self.min_tokens,
+                                                math.ceil(percentile(lengths, self.percentile) * self.headroom)))
+            seconds_per_token = statistics.median(entry["seconds_per_token"]) if entry["seconds_per_token"] else 0.0
+            avoided = 0.0
+            for stop_cap in entry["early_stop_caps"]:
+                over = [n - stop_cap for n in uncapped.get(call_type, []) if n > stop_cap]
+                avoided += statistics.mean(over) if over else 0.0
+            saved = avoided * seconds_per_token - entry["retry_seconds"]
+            stats["keys"][f"{call_type}/{phase}" if phase else call_type] = {
+                "calls": entry["calls"],
+                "cap": cap,
+                "median_output_tokens": statistics.median(lengths) if lengths else None,
+                "truncations": entry["truncations"],
+                "retries": entry["retries"],
+                "early_stops": entry["early_stops"],
+                "retry_output_tokens": entry["retry_output_tokens"],
+                "output_tokens_avoided": round(avoided),
+                "mean_cap": round(entry["capped_tokens"] / entry["calls"]) if entry["calls"] else None,
+                "decode_seconds_saved": round(saved, 3),
+            }
+            stats["decode_seconds_saved"] += saved
+        stats["decode_seconds_saved"] = round(stats["decode_seconds_saved"], 3)
+        return stats
+
+
+def _trim_to_sentence(text):
+    """text up to the end of its last complete sentence ("" if there is none)."""
+    ends = list(_SENTENCE_END.finditer(text))
+    return text[:ends[-1].end()].strip() if ends else ""
@@ -2,6 +2,7 @@
 
 Functions:
 - load_story_config(): loads configuration JSON
+- validate_story_config(): problems of a configuration (missing world, plot, characters)
 """
 
 import json
@@ -11,19 +12,53 @@ import os
 STORY_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "story_config.json")
 
 
-def load_story_config():
+def load_story_config(path=None, verbose=True):
     """Loads the complete story configuration from JSON file.
-    
+
+    Args:
+        path: configuration file (default: story_config.json in the CODE directory)
+        verbose: print the path being loaded
+
     Returns:
         dict containing: world, plot, characters, narrative_config
     """
-    if not os.path.exists(STORY_CONFIG_PATH):
+    path = path or STORY_CONFIG_PATH
+    if not os.path.exists(path):
         raise FileNotFoundError(
-            f"Configuration file not found: {STORY_CONFIG_PATH}\n"
+            f"Configuration file not found: {path}\n"
             "Make sure story_config.json exists in the CODE directory."
         )
-    
-    print(f"[INFO] Loading configuration from: {STORY_CONFIG_PATH}")
-    with open(STORY_CONFIG_PATH, 'r', encoding='utf-8') as f:
+
+    if verbose:
+        print(f"[INFO] Loading configuration from: {path}")
+    with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+
+def validate_story_config(config):
+    """Problems of a story configuration that would make a run fail.
+
+    Returns:
+        list of messages (empty if the configuration is usable)
+    """
+    if not isinstance(config, dict):
+        return ["configuration is not a JSON object"]
+    problems = []
+    world = config.get("world")
+    if not isinstance(world, dict):
+        problems.append("missing 'world' object")
+    elif not isinstance(world.get("rules", []), list):
+        problems.append("'world.rules' must be a list")
+    plot = config.get("plot")
+    if not isinstance(plot, dict):
+        problems.append("missing 'plot' object")
+    elif not plot.get("inciting_incident"):
+        problems.append("missing 'plot.inciting_incident'")
+    characters = config.get("characters")
+    if not isinstance(characters, list) or not characters:
+        problems.append("'characters' must be a non-empty list")
+    else:
+        for i, character in enumerate(characters):
+            if not isinstance(character, dict) or not character.get("name"):
+                problems.append(f"character #{i + 1} has no 'name'")
+    return problems
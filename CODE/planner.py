@@ -0,0 +1,261 @@
+"""Dry-run forecast of a compare: calls, tokens, cost and wall-clock time.
+
+Nothing is sent to the model:
+- the turn-0 prompts of both methods are built from story_config.json with the
+  real prompt builders and their tokens estimated locally (~4 chars/token);
+- the growth of the prompts over the turns comes from stored runs: the state of
+  every stored run is replayed turn by turn (facts, items and inconsistencies
+  known at the start of each turn) through the same builders, and the mean
+  growth is added to the turn-0 prompts (extrapolated linearly past the last
+  stored turn). Output tokens are estimated from the stored turn texts and
+  from the facts/items/violations the analysis returned;
+- the wall-clock time follows the configured rate limits: one call every
+  RATE_LIMIT_DELAY for the whole process (shared by the workers), or the
+  RPM/TPM of the key pool.
+
+Usage:
+    python run.py compare --runs 10 --turns 10 --workers 2 --plan
+"""
+
+import math
+import statistics
+from pathlib import Path
+
+import classes
+from blob_store import load_results
+from classes import (
+    DEFAULT_INPUTS,
+    build_analysis_prompt,
+    build_generation_parts,
+    format_user_input_section,
+)
+from reanalyze import initial_state, split_story_text
+from usage import call_cost, estimate_tokens
+
+
+CALLS_PER_TURN = 2  # generation + analysis
+DEFAULT_LATENCY = 2.0  # seconds per call when no stored run tells otherwise
+# Output tokens per call when there is no stored run
+DEFAULT_OUTPUT_TOKENS = {"generation": 400, "analysis": 250}
+
+
+def load_stored_runs(results_dir):
+    """Stored runs with their state and text, by method ({} if there are none)."""
+    if not (Path(results_dir) / "comparison_results_full.json").exists():
+        return {}
+    results = load_results(results_dir)
+    return {
+        method: [run for run in results.get(f"method_{method}", [])
+                 if run.get("story_state") and run.get("story_text")]
+        for method in ("A", "B")
+    }
+
+
+def _prompt_tokens(strategy, story_state, plot_config, turn, turns, chunk):
+    """(generation, analysis) prompt tokens of one turn, built by the real builders."""
+    parts = build_generation_parts(strategy, story_state, plot_config, turn, turns)
+    generation = parts["prefix"] + format_user_input_section(DEFAULT_INPUTS[turn % len(DEFAULT_INPUTS)])
+    if parts["cached_context"]:
+        generation = parts["cached_context"] + "\n\n" + generation
+    return estimate_tokens(generation), estimate_tokens(build_analysis_prompt(story_state, chunk))
+
+
+def _analysis_output(facts, items, inconsistencies):
+    """Text the analysis call returns for the given new entries (same format as the model answer)."""
+    return "\n".join(
+        ["FATTI:"] + [f"- {f.get('description', '')}" for f in facts]
+        + ["", "OGGETTI:"] + [f"- {it.get('name', '')} | {it.get('location', '')} | {it.get('status', '')}"
+                              for it in items]
+        + ["", "VIOLAZIONI:"] + ([f"- {inc.get('description', '')}" for inc in inconsistencies] or ["- NESSUNA"])
+    )
+
+
+def replay_run(strategy, run, config, turns):
+    """Per-turn token estimates of a stored run, replaying its state through the prompt builders.
+
+    Returns:
+        list of dicts (one per stored turn) with generation/analysis prompt and output tokens
+    """
+    plot_config = config.get("plot")
+    base = initial_state(config)
+    stored = run["story_state"]
+    chunks = split_story_text(run["story_text"])
+    initial = len(base["facts"])
+    new_facts = stored["facts"][initial:]
+
+    per_turn = []
+    for turn, chunk in enumerate(chunks[:turns]):
+        state = dict(base)
+        state["world"] = base["world"]
+        state["facts"] = base["facts"] + [f for f in new_facts if f.get("turn_created", 0) < turn]
+        state["items"] = [it for it in stored["items"] if it.get("discovered_turn", 0) < turn]
+        state["inconsistencies"] = [inc for inc in stored.get("inconsistencies", []) if inc.get("turn", 0) < turn]
+        generation_prompt, analysis_prompt = _prompt_tokens(strategy, state, plot_config, turn, turns, chunk)
+        analysis_text = _analysis_output(
+            [f for f in new_facts if f.get("turn_created") == turn],
+            [it for it in stored["items"] if it.get("discovered_turn") == turn],
+            [inc for inc in stored.get("inconsistencies", []) if inc.get("turn") == turn],
+        )
+        per_turn.append({
+            "generation_prompt": generation_prompt,
+            "analysis_prompt": analysis_prompt,
+            "generation_output": estimate_tokens(chunk),
+            "analysis_output": estimate_tokens(analysis_text),
+        })
+    return per_turn
+
+
+def _extend(values, turns):
+    """values padded to `turns` entries, extrapolating the trend of the second half.
+
+    The last stored turn is the final plot phase (longer conclusion): it stays last.
+    """
+    if len(values) >= turns:
+        return values[:turns]
+    if len(values) < 2:
+        return (values or [0.0]) * turns
+    body, final = values[:-1], values[-1]
+    tail = body[len(body) // 2:]
+    slope = (tail[-1] - tail[0]) / (len(tail) - 1) if len(tail) > 1 else 0.0
+    return body + [body[-1] + slope * (i + 1) for i in range(turns - 1 - len(body))] + [final]
+
+
+def forecast_run(strategy, turns, config, stored_runs):
+    """Per-turn token forecast of one run of a method.
+
+    Returns:
+        dict with per_turn (list of token dicts), totals and the number of stored runs used
+    """
+    replays = [replay_run(strategy, run, config, turns) for run in stored_runs]
+    replays = [replay for replay in replays if replay]
+
+    def mean_by_turn(key):
+        values = []
+        for turn in range(max((len(r) for r in replays), default=0)):
+            at_turn = [r[turn][key] for r in replays if len(r) > turn]
+            values.append(sum(at_turn) / len(at_turn))
+        return _extend(values, turns)
+
+    # Turn 0 from the current config, growth from the stored runs
+    chunk_tokens = mean_by_turn("generation_output")[0] if replays else DEFAULT_OUTPUT_TOKENS["generation"]
+    placeholder_chunk = "x" * int(chunk_tokens * 4)
+    base = _prompt_tokens(strategy, initial_state(config), config.get("plot"), 0, turns, placeholder_chunk)
+
+    per_turn = []
+    columns = {key: mean_by_turn(key) for key in
+               ("generation_prompt", "analysis_prompt", "generation_output", "analysis_output")}
+    for turn in range(turns):
+        entry = {}
+        for i, call_type in enumerate(("generation", "analysis")):
+            growth = columns[f"{call_type}_prompt"][turn] - columns[f"{call_type}_prompt"][0] if replays else 0
+            entry[f"{call_type}_prompt"] = round(base[i] + growth)
+            output = columns[f"{call_type}_output"][turn] if replays else DEFAULT_OUTPUT_TOKENS[call_type]
+            entry[f"{call_type}_output"] = round(output)
+        per_turn.append(entry)
+
+    prompt_tokens = sum(e["generation_prompt"] + e["analysis_prompt"] for e in per_turn)
+    output_tokens = sum(e["generation_output"] + e["analysis_output"] for e in per_turn)
+    return {
+        "per_turn": per_turn,
+        "calls": CALLS_PER_TURN * turns,
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "cost_usd": round(call_cost(prompt_tokens, 0, output_tokens), 6),
+        "stored_runs": len(replays),
+    }
+
+
+def stored_latency(stored, rate_limit_delay):
+    """API seconds per call in the stored runs (median run time per call).
+
+    Paced runs take max(delay, latency) per call: a median within the
+    current delay hides the latency, DEFAULT_LATENCY (capped at it) is used.
+    """
+    per_call = [run["execution_time_seconds"] / (CALLS_PER_TURN * max(len(run.get("turn_lengths", [])), 1))
+                for runs in stored.values() for run in runs if run.get("execution_time_seconds")]
+    if not per_call:
+        return DEFAULT_LATENCY
+    # Median: a single run stuck on retries must not inflate the forecast
+    median = statistics.median(per_call)
+    return median if median > rate_limit_delay else min(median, DEFAULT_LATENCY)
+
+
+def wall_clock(runs, calls_per_run, tokens_per_call, workers, latency, rate_limit_delay, key_pool=None):
+    """Forecast wall-clock seconds and the bottleneck that sets it."""
+    waves = math.ceil(runs / max(workers, 1))
+    total_calls = runs * calls_per_run
+    workers_bound = {f"{workers} worker(s) at {latency:.1f}s latency per call": waves * calls_per_run * latency}
+    if key_pool is None:
+        # One call every RATE_LIMIT_DELAY for the whole process, whatever the number of workers
+        bounds = {f"single-key rate limit (one call every {rate_limit_delay:g}s)": total_calls * rate_limit_delay,
+                  **workers_bound}
+        bottleneck = max(bounds, key=bounds.get)
+        return bounds[bottleneck], bottleneck
+    rpm = sum(key.rpm for key in key_pool.keys)
+    tpm = sum(key.tpm for key in key_pool.keys)
+    bounds = {
+        f"key pool RPM ({rpm}/min over {len(key_pool.keys)} keys)": total_calls / rpm * 60,
+        f"key pool TPM ({tpm}/min)": total_calls * tokens_per_call / tpm * 60,
+        **workers_bound,
+    }
+    bottleneck = max(bounds, key=bounds.get)
+    return bounds[bottleneck], bottleneck
+
+
+def plan_compare(runs_per_method, turns, workers, config, results_dir, key_pool=None, rate_limit_delay=None):
+    """Forecast of a compare run (see module docstring)."""
+    if rate_limit_delay is None:
+        rate_limit_delay = classes.RATE_LIMIT_DELAY
+    stored = load_stored_runs(results_dir)
+    methods = {m: forecast_run(m, turns, config, stored.get(m, [])) for m in ("A", "B")}
+
+    calls = sum(f["calls"] for f in methods.values()) * runs_per_method
+    prompt_tokens = sum(f["prompt_tokens"] for f in methods.values()) * runs_per_method
+    output_tokens = sum(f["output_tokens"] for f in methods.values()) * runs_per_method
+    latency = stored_latency(stored, rate_limit_delay)
+    seconds, bottleneck = wall_clock(
+        2 * runs_per_method, CALLS_PER_TURN * turns, (prompt_tokens + output_tokens) / max(calls, 1),
+        workers, latency, rate_limit_delay, key_pool,
+    )
+    return {
+        "runs_per_method": runs_per_method,
+        "turns": turns,
+        "workers": workers,
+        "results_dir": str(results_dir),
+        "methods": methods,
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "cost_usd": round(sum(f["cost_usd"] for f in methods.values()) * runs_per_method, 4),
+        "latency_seconds": round(latency, 2),
+        "wall_clock_seconds": round(seconds),
+        "bottleneck": bottleneck,
+    }
+
+
+def _duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m" if hours else f"{rest // 60}m{rest % 60:02d}s"
+
+
+def format_plan(plan):
+    """Forecast for the terminal."""
+    lines = [
+        "COMPARE PLAN (dry run, no model calls)",
+        f"   - Runs: {plan['runs_per_method']} per method, {plan['turns']} turns, {plan['workers']} worker(s)",
+    ]
+    for method, forecast in plan["methods"].items():
+        source = (f"growth from {forecast['stored_runs']} stored runs" if forecast["stored_runs"]
+                  else "no stored runs: flat prompts, default output lengths")
+        first, last = forecast["per_turn"][0], forecast["per_turn"][-1]
+        lines.append(
+            f"   - Method {method}: {forecast['calls']} calls/run, {forecast['prompt_tokens']} prompt + "
+            f"{forecast['output_tokens']} output tokens/run, ${forecast['cost_usd']:.4f}/run "
+            f"(generation prompt {first['generation_prompt']} -> {last['generation_prompt']} tokens; {source})"
+        )
+    lines += [
+        f"   - Total: {plan['calls']} calls, {plan['prompt_tokens']} prompt tokens, "
+        f"{plan['output_tokens']} output tokens, ~${plan['cost_usd']:.4f}",
+        f"   - Wall clock: ~{_duration(plan['wall_clock_seconds'])} (bound by {plan['bottleneck']})",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,251 @@
+"""Live progress and ETA for long compare runs.
+
+A ProgressMonitor follows the runs of an experiment (serial or parallel):
+runs done / in flight per method, turns per minute, rolling API latency,
+time spent throttled (rate-limit waits, summed over workers), errors and an
+ETA from the observed turn throughput. Every `interval` seconds it prints a
+status block on stderr (the story text stays on stdout) and rewrites a status
+JSON file that another process can poll.
+
+The monitor is process-wide (worker threads of the pool do not inherit
+contextvars): the record_* hooks are no-ops while no monitor is active.
+
+Usage:
+    monitor = ProgressMonitor({"A": 10, "B": 10}, turns=10, status_path="results/status.json")
+    with monitor.activate():
+        run_experiment_jobs(...)
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from hedging import percentile
+
+
+_monitor = None
+_current_run = contextvars.ContextVar("current_progress_run", default=None)
+
+_NO_SCOPE = nullcontext()
+
+
+def record_call(seconds):
+    """Latency of one API request."""
+    monitor = _monitor
+    if monitor is not None:
+        monitor.record_call(seconds)
+
+
+def record_throttle(seconds):
+    """Time spent waiting for the rate limiter / key pool."""
+    monitor = _monitor
+    if monitor is not None:
+        monitor.record_throttle(seconds)
+
+
+def record_error(kind):
+    """A failed LLM call (kind: exception class name)."""
+    monitor = _monitor
+    if monitor is not None:
+        monitor.record_error(kind)
+
+
+def record_turn():
+    """A turn of the current run has been processed."""
+    monitor = _monitor
+    if monitor is not None:
+        monitor.record_turn(_current_run.get())
+
+
+def run(strategy, run_id):
+    """Scope of one run: marks it in flight, then done or failed (no-op without a monitor)."""
+    monitor = _monitor
+    if monitor is None:
+        return _NO_SCOPE
+    return monitor.run(strategy, run_id)
+
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    return f"{minutes}m{secs:02d}s"
+
+
+class ProgressMonitor:
+    """Progress of the runs of one experiment.
+
+    Args:
+        runs_per_method: dict method -> number of runs planned
+        turns: turns per run
+        status_path: optional JSON file refreshed every interval
+        interval: seconds between two status refreshes (terminal and file)
+        stream: where the status block is printed (default: stderr, None = silent)
+        latency_window: number of recent API calls in the rolling latency
+    """
+
+    def __init__(self, runs_per_method, turns, status_path=None, interval=10.0,
+                 stream=sys.stderr, latency_window=50):
+        self.runs_per_method = dict(runs_per_method)
+        self.turns = turns
+        self.status_path = status_path
+        self.interval = interval
+        self.stream = stream
+        self.started = None
+        self.latencies = deque(maxlen=latency_window)
+        self.calls = 0
+        self.throttled_seconds = 0.0
+        self.errors = {}
+        self.runs = {}  # (method, run_id) -> {"state", "turns"}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @contextmanager
+    def activate(self):
+        """Make this monitor current and refresh the status in background until exit."""
+        global _monitor
+        previous = _monitor
+        _monitor = self
+        self.started = time.time()
+        self._stop.clear()
+        refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+        refresher.start()
+        try:
+            yield self
+        finally:
+            self._stop.set()
+            refresher.join()
+            _monitor = previous
+            self.refresh(final=True)
+
+    @contextmanager
+    def run(self, strategy, run_id):
+        key = (strategy, run_id)
+        with self._lock:
+            self.runs[key] = {"state": "running", "turns": 0}
+        token = _current_run.set(key)
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self.runs[key]["state"] = "failed"
+            raise
+        else:
+            with self._lock:
+                self.runs[key]["state"] = "done"
+        finally:
+            _current_run.reset(token)
+
+    def record_call(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(seconds)
+
+    def record_throttle(self, seconds):
+        with self._lock:
+            self.throttled_seconds += seconds
+
+    def record_error(self, kind):
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def record_turn(self, key):
+        with self._lock:
+            if key in self.runs:
+                self.runs[key]["turns"] += 1
+
+    def snapshot(self):
+        """Current status as a JSON-serializable dict."""
+        now = time.time()
+        with self._lock:
+            runs = {key: dict(entry) for key, entry in self.runs.items()}
+            latencies = list(self.latencies)
+            calls = self.calls
+            throttled = self.throttled_seconds
+            errors = dict(self.errors)
+        elapsed = now - self.started if self.started else 0.0
+
+        methods = {}
+        turns_done = 0
+        turns_remaining = 0
+        for method, planned in self.runs_per_method.items():
+            entries = [entry for (m, _), entry in runs.items() if m == method]
+            done = sum(1 for entry in entries if entry["state"] == "done")
+            failed = sum(1 for entry in entries if entry["state"] == "failed")
+            running = sum(1 for entry in entries if entry["state"] == "running")
+            method_turns = sum(entry["turns"] for entry in entries)
+            turns_done += method_turns
+            # Runs still to start, plus the turns left in the running ones
+            turns_remaining += (planned - len(entries)) * self.turns
+            turns_remaining += sum(max(0, self.turns - entry["turns"])
+                                   for entry in entries if entry["state"] == "running")
+            methods[method] = {
+                "planned": planned,
+                "done": done,
+                "running": running,
+                "failed": failed,
+                "turns_done": method_turns,
+            }
+
+        turns_per_minute = turns_done / elapsed * 60 if elapsed > 0 else 0.0
+        eta = turns_remaining / turns_per_minute * 60 if turns_per_minute > 0 else None
+        return {
+            "updated": now,
+            "elapsed_seconds": round(elapsed, 1),
+            "methods": methods,
+            "turns_done": turns_done,
+            "turns_total": turns_done + turns_remaining,
+            "turns_per_minute": round(turns_per_minute, 2),
+            "api_calls": calls,
+            "api_latency_seconds": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+            },
+            "throttled_seconds": round(throttled, 1),
+            "errors": errors,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+        }
+
+    def render(self, status):
+        """Status block for the terminal."""
+        per_method = " | ".join(
+            f"{method}: {m['done']}/{m['planned']} done, {m['running']} running"
+            + (f", {m['failed']} failed" if m["failed"] else "")
+            for method, m in status["methods"].items()
+        )
+        errors = sum(status["errors"].values())
+        latency = status["api_latency_seconds"]
+        return (
+            f"[PROGRESS] {_format_duration(status['elapsed_seconds'])} elapsed | {per_method}\n"
+            f"[PROGRESS] turns {status['turns_done']}/{status['turns_total']} "
+            f"({status['turns_per_minute']}/min) | API p50 {latency['p50']}s p95 {latency['p95']}s | "
+            f"throttled {_format_duration(status['throttled_seconds'])} | errors {errors} | "
+            f"ETA {_format_duration(status['eta_seconds'])}"
+        )
+
+    def refresh(self, final=False):
+        """Print the status block and rewrite the status file."""
+        status = self.snapshot()
+        status["finished"] = final
+        if self.stream is not None:
+            print(self.render(status), file=self.stream, flush=True)
+        if self.status_path:
+            # Write-then-rename: pollers never see a half-written file
+            tmp_path = f"{self.status_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(status, f, indent=2)
+            os.replace(tmp_path, self.status_path)
+        return status
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
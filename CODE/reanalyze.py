@@ -0,0 +1,291 @@
+"""Re-analysis of stored runs with batched analysis requests.
+
+Evaluating a change to the analysis prompt (classes.ANALYSIS_TASKS) used to
+mean regenerating the stories. The stored story_text of every run already
+holds all its turns, so reanalyze only repeats the analysis:
+- the turns of each run are split back out of story_text;
+- batch_size turns go in one analysis request, each between
+  <<<FRAMMENTO N>>> / <<<FINE FRAMMENTO N>>> delimiters, and the model
+  answers with one "=== FRAMMENTO N ===" section per turn in the usual
+  FATTI / OGGETTI / VIOLAZIONI format;
+- the answer is split on the section headers (tolerating markdown around
+  them, missing or extra sections); a section only counts if it reaches
+  VIOLAZIONI, so an answer truncated by max_output_tokens does not yield
+  half an analysis. Turns without a complete section are re-analyzed alone,
+  with the regular single-turn prompt;
+- the batches of all runs share one thread pool; every request goes through
+  call_gemini, so RATE_LIMIT_DELAY or the key pool still applies;
+- once every batch of a run is back, the sections are merged turn by turn
+  with apply_analysis_result (the parser of the live runs) and the metrics
+  recomputed by MetricsAccumulator.
+
+Results go to <input>/reanalysis/: one method_X_run_N.json per run (new
+facts, items, inconsistencies and metrics, next to the original metrics)
+and reanalysis_summary.json (per-method means before/after, calls made).
+
+Usage:
+    python run.py reanalyze --input final_results/ --batch-size 4 --workers 2
+"""
+
+import contextvars
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import generation_settings
+from blob_store import BlobView, open_store
+from classes import (
+    ANALYSIS_FORMAT,
+    ANALYSIS_TASKS,
+    append_to_history,
+    apply_analysis_result,
+    build_analysis_prompt,
+    build_characters_from_config,
+    call_gemini,
+    format_world_rules,
+    init_story_state,
+)
+from metrics_accumulator import MetricsAccumulator
+from usage import UsageRecorder
+
+
+DEFAULT_BATCH_SIZE = 4
+REANALYSIS_DIRNAME = "reanalysis"
+
+# Metrics compared before/after in the summary
+COMPARED_METRICS = [
+    "total_facts",
+    "total_objects",
+    "total_inconsistencies",
+    "repeated_inconsistencies",
+    "inconsistency_rate",
+]
+
+_TURN_HEADER = re.compile(r"^=== Turno? \d+ ===\n", re.MULTILINE)  # older results: "Turno"
+# Section header of a batched answer: "=== FRAMMENTO 3 ===", "**FRAMMENTO 3**", "## Frammento 3:" ...
+_SECTION_HEADER = re.compile(r"^[ \t#*=\-<>\[]*FRAMMENTO\s+(\d+)\b[^\n]*$", re.IGNORECASE | re.MULTILINE)
+
+
+def split_story_text(story_text):
+    """Turn texts of a stored story_text ("=== Turn N ===" headers), in order."""
+    return [chunk.strip() for chunk in _TURN_HEADER.split(story_text or "") if chunk.strip()]
+
+
+def initial_state(config):
+    """Story state of a run at turn 0 (characters, world, inciting incident)."""
+    plot_config = config.get("plot")
+    initial_facts = [{"id": 1, "description": plot_config["inciting_incident"], "turn_created": 0}]
+    return init_story_state(
+        characters=build_characters_from_config(config["characters"]),
+        world_config=config["world"],
+        initial_facts=initial_facts,
+    )
+
+
+def load_run_files(results_dir, methods=("A", "B")):
+    """Stored runs (method_X_run_N.json, blob references resolved lazily) as (method, run)."""
+    results_dir = Path(results_dir)
+    store = open_store(results_dir)
+    runs = []
+    for method in methods:
+        for path in results_dir.glob(f"method_{method}_run_*.json"):
+            with open(path, "r", encoding="utf-8") as f:
+                runs.append((method, BlobView(json.load(f), store)))
+    runs.sort(key=lambda item: (item[0], item[1]["run_id"]))
+    return runs
+
+
+def build_batch_prompt(world, chunks):
+    """Analysis prompt of several turns of one story.
+
+    Args:
+        world: world config of the story
+        chunks: list of (turn, text); fragments are numbered turn + 1, like the story_text headers
+    """
+    fragments = "\n\n".join(
+        f"<<<FRAMMENTO {turn + 1}>>>\n{text}\n<<<FINE FRAMMENTO {turn + 1}>>>" for turn, text in chunks
+    )
+    headers = ", ".join(f"=== FRAMMENTO {turn + 1} ===" for turn, _ in chunks)
+    return f"""Analizza questi {len(chunks)} frammenti di storia ambientati in: {world.get('setting', '')}
+Sono turni consecutivi della stessa storia: analizza ogni frammento separatamente.
+
+REGOLE ESPLICITE DEL MONDO:
+{format_world_rules(world)}
+
+Frammenti da analizzare:
+{fragments}
+
+Per ogni frammento:
+
+{ANALYSIS_TASKS}
+
+Rispondi con una sezione per frammento, nell'ordine ({headers}).
+Ogni sezione inizia con la sua intestazione ed è in questo formato:
+
+=== FRAMMENTO N ===
+{ANALYSIS_FORMAT}
+
+Risposta:"""
+
+
+def split_batch_response(text, turns):
+    """Complete analysis section of each turn in a batched answer.
+
+    Args:
+        text: model answer
+        turns: turns of the batch
+
+    Returns:
+        dict turn -> section text, only for turns whose section reaches VIOLAZIONI
+    """
+    expected = {turn + 1: turn for turn in turns}  # fragment number -> turn
+    headers = [(m.start(), m.end(), expected[int(m.group(1))]) for m in _SECTION_HEADER.finditer(text)
+               if int(m.group(1)) in expected and "FINE" not in m.group(0).upper()]
+    sections = {}
+    for i, (_, end, turn) in enumerate(headers):
+        stop = headers[i + 1][0] if i + 1 < len(headers) else len(text)
+        body = text[end:stop].strip()
+        # First section of a turn wins; a truncated one (no VIOLAZIONI yet) is dropped
+        if turn not in sections and "VIOLAZIONI" in body.upper():
+            sections[turn] = body
+    return sections
+
+
+def make_batches(chunks, batch_size):
+    """chunks (list of (turn, text)) in consecutive groups of batch_size."""
+    batch_size = max(1, batch_size)
+    return [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+
+def analyze_batch(story_state, chunks):
+    """Analysis text of every turn of a batch (one request, single-turn retries for the gaps).
+
+    Returns:
+        (dict turn -> analysis text, number of calls made)
+    """
+    temperature = generation_settings.get("analysis_temperature")
+    calls = 0
+    sections = {}
+    if len(chunks) > 1:
+        answer = call_gemini(build_batch_prompt(story_state["world"], chunks), temperature=temperature,
+                             call_type="analysis")
+        calls += 1
+        sections = split_batch_response(answer, [turn for turn, _ in chunks])
+    for turn, text in chunks:
+        if turn not in sections:
+            if len(chunks) > 1:
+                print(f"[WARNING] No complete section for turn {turn} in the batched answer: analyzing it alone")
+            sections[turn] = call_gemini(build_analysis_prompt(story_state, text), temperature=temperature,
+                                         call_type="analysis")
+            calls += 1
+    return sections, calls
+
+
+def rebuild_run(chunks, analyses, config):
+    """Story state and metrics of a run from its turns and their analysis texts.
+
+    Turns are merged in order, as in the live run (items are deduplicated
+    against the ones found in earlier turns).
+    """
+    story_state = initial_state(config)
+    accumulator = MetricsAccumulator(turns=len(chunks))
+    accumulator.observe(story_state)
+    for turn, text in enumerate(chunks):
+        if turn in analyses:
+            apply_analysis_result(story_state, analyses[turn], text, turn)
+        append_to_history(story_state, "", text)
+        accumulator.end_turn(story_state, turn)
+    return story_state, accumulator.summary()
+
+
+def reanalyze_runs(runs, config, batch_size=DEFAULT_BATCH_SIZE, workers=1, on_result=None):
+    """Re-analyze stored runs, batching turns of the same run into one request.
+
+    Args:
+        runs: list of (method, run) with story_text
+        config: story config (world, characters, plot)
+        batch_size: turns per analysis request
+        workers: analysis requests in flight
+        on_result: optional callback(method, run, result) called as runs complete
+
+    Returns:
+        list of result dicts (see _finish), in the order of runs
+    """
+    base = initial_state(config)
+
+    def run_batch(job, batch):
+        # Each batch records its usage in the recorder of its run (contextvars)
+        with job["recorder"].activate():
+            return analyze_batch(base, batch)
+
+    jobs = []
+    results = [None] * len(runs)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {}
+        for index, (_, run) in enumerate(runs):
+            job = {"chunks": split_story_text(run.get("story_text")), "analyses": {}, "calls": 0,
+                   "failed": 0, "pending": 0, "recorder": UsageRecorder()}
+            jobs.append(job)
+            for batch in make_batches(list(enumerate(job["chunks"])), batch_size):
+                futures[executor.submit(contextvars.copy_context().run, run_batch, job, batch)] = (index, batch)
+                job["pending"] += 1
+        for index, job in enumerate(jobs):
+            if not job["pending"]:
+                results[index] = _finish(runs[index], job, config, batch_size, on_result)
+
+        for future in as_completed(futures):
+            index, batch = futures[future]
+            job = jobs[index]
+            try:
+                analyses, calls = future.result()
+                job["analyses"].update(analyses)
+                job["calls"] += calls
+            except Exception as e:
+                job["failed"] += len(batch)
+                print(f"[WARNING] Analysis of turns {batch[0][0]}-{batch[-1][0]} failed: {e}")
+            job["pending"] -= 1
+            if not job["pending"]:
+                results[index] = _finish(runs[index], job, config, batch_size, on_result)
+    return results
+
+
+def _finish(method_run, job, config, batch_size, on_result):
+    method, run = method_run
+    story_state, metrics = rebuild_run(job["chunks"], job["analyses"], config)
+    result = {
+        "run_id": run["run_id"],
+        "strategy": method,
+        "reanalyzed_at": datetime.now().isoformat(),
+        "batch_size": batch_size,
+        "calls": job["calls"],
+        "unanalyzed_turns": job["failed"],
+        **metrics,
+        "usage": job["recorder"].summary(),
+        "original": {name: run.get(name) for name in COMPARED_METRICS},
+        "story_state": {key: story_state[key] for key in ("facts", "items", "inconsistencies")},
+    }
+    if on_result:
+        on_result(method, run, result)
+    return result
+
+
+def summarize(results):
+    """Per-method means of COMPARED_METRICS before and after, and the calls made."""
+    summary = {"methods": {}}
+    for method in sorted({r["strategy"] for r in results}):
+        selected = [r for r in results if r["strategy"] == method]
+        entry = {"runs": len(selected)}
+        for name in COMPARED_METRICS:
+            before = [r["original"][name] for r in selected if r["original"].get(name) is not None]
+            after = [r[name] for r in selected]
+            entry[name] = {
+                "original": round(sum(before) / len(before), 2) if before else None,
+                "reanalyzed": round(sum(after) / len(after), 2),
+            }
+        summary["methods"][method] = entry
+    summary["turns"] = sum(r["turns_completed"] for r in results)
+    summary["calls"] = sum(r["calls"] for r in results)
+    summary["cost_usd"] = round(sum(r["usage"]["cost_usd"] for r in results), 6)
+    return summary
@@ -6,24 +6,56 @@ Usage:
     python run.py single --method B                # Method B, 10 turns
     python run.py single --method A --turns 5      # Method A, 5 turns
     python run.py single --interactive             # Interactive mode
+    python run.py single -i --speculative          # Interactive, prefetch next turn while typing
 
     # Compare Method A vs B (experiments)
     python run.py compare                          # 3 runs, 10 turns
     python run.py compare --runs 10 --turns 10     # 10 runs, 10 turns
     python run.py compare --output results/        # Save to custom folder
+    python run.py compare --workers 4 --keys-file keys.json  # Parallel runs over a key pool
+    python run.py compare --runs 10 --turns 10 --plan  # Forecast calls, tokens and time, no model calls
+    python run.py compare --adaptive-output        # Tight max_output_tokens learned per call type/phase
+    python run.py compare --hedge                  # Duplicate calls slower than p95 latency (10% budget)
+    python run.py compare --best-of 3              # Method A: best of 3 concurrent generations per turn
+    python run.py compare --analysis-gate A B      # Analyze, defer or skip each turn by local novelty
+    python run.py compare --analysis-gate A B --gate-recall   # + recall of the gated analysis (shadow calls)
+
+    # Sweep generation settings (grid or random search, see sweep.py)
+    python run.py sweep --spec sweep.json --runs 5 --workers 4
+
+    # Many story configurations and input scripts from a JSONL job file (see batch_jobs.py)
+    python run.py batch --jobs jobs.jsonl --workers 4
+
+    # Re-run the analysis on stored stories (several turns per request, see reanalyze.py)
+    python run.py reanalyze --input final_results/ --batch-size 4 --workers 2
 
     # Analyze results
     python run.py analyze --input final_results/   # Generate charts
+    python run.py analyze --input final_results/ --preview  # Quick low-dpi charts (in <output>/preview/)
 """
 
 import argparse
 import json
 import os
+import threading
 import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
 
+import classes
 from classes import build_characters_from_config, run_story_session
+from deadlines import TIMEOUT_ACTIONS, DeadlinePolicy
+import generation_settings
+from key_pool import KeyPool
+from metrics_accumulator import MetricsAccumulator
+from openmetrics import MetricsRegistry, exporting
+import progress
+from progress import ProgressMonitor
+from tracing import Tracer, span, write_chrome_trace, write_otel_trace
+from usage import UsageRecorder
+from violations import storable_state
 from persona_utils import load_story_config
 
 
@@ -31,7 +63,50 @@ from persona_utils import load_story_config
 # FUNCTIONS FOR SINGLE STORY
 # =============================================================================
 
-def run_single_story_mode(method, turns, interactive):
+def print_governor_stats(stats):
+    """Output-length governor report (see output_governor.py)."""
+    print("\nOutput length governor:")
+    for key, key_stats in stats["keys"].items():
+        print(f"  - {key}: {key_stats['calls']} calls, cap {key_stats['cap'] or 'warming up'} "
+              f"(median output {key_stats['median_output_tokens']}), {key_stats['truncations']} truncated, "
+              f"{key_stats['retries']} retried, {key_stats['early_stops']} early stops "
+              f"(~{key_stats['output_tokens_avoided']} output tokens avoided)")
+    print(f"  Estimated decode time saved: {stats['decode_seconds_saved']:.1f}s (net of retries)")
+
+
+def print_best_of_n_stats(stats):
+    """Best-of-N generation report (see best_of_n.py)."""
+    print(f"\nBest-of-{stats['n']} generation (budget {stats['budget_seconds']}s after the first candidate):")
+    print(f"  - {stats['turns']} turns, {stats['candidates_fired']} candidates "
+          f"({stats['candidates_scored']} scored, {stats['candidates_discarded']} late, "
+          f"{stats['candidates_failed']} failed)")
+    if stats["candidates_not_fired"]:
+        print(f"  - {stats['candidates_not_fired']} candidates not fired (single-key rate limit, no key pool)")
+    ranks = ", ".join(f"#{rank}: {count}" for rank, count in stats["accepted_ranks"].items())
+    print(f"  - Accepted arrival rank: {ranks or '-'}")
+    print(f"  - Added latency: mean {stats['mean_added_seconds']:.2f}s, p95 {stats['p95_added_seconds']:.2f}s")
+    print(f"  - Winner arrival after the first: mean {stats['mean_winner_delay_seconds']:.2f}s, "
+          f"p95 {stats['p95_winner_delay_seconds']:.2f}s")
+    print(f"  - Penalty per turn: {stats['mean_winner_penalty']} (first arrival: {stats['mean_first_penalty']}), "
+          f"{stats['banned_hits_avoided']} banned-term hits and {stats['conflicts_avoided']} state conflicts avoided")
+
+
+def print_analysis_gate_stats(stats_by_method):
+    """Analysis gate report per method (see analysis_gate.py)."""
+    print("\nAnalysis gate:")
+    for method, stats in stats_by_method.items():
+        print(f"  - Method {method}: {stats['turns']} turns -> {stats['requests']} analysis requests "
+              f"({stats['calls_saved']} saved; analyze {stats['analyze']}, defer {stats['defer']}, "
+              f"skip {stats['skip']}, mean novelty {stats['mean_novelty']})")
+        if "shadow_cost_usd" in stats:
+            print(f"    Violation recall vs per-turn analysis: {stats['violation_recall']} "
+                  f"({stats['matched_violations']}/{stats['reference_violations']}, {stats['shadow_calls']} "
+                  f"shadow calls, ${stats['shadow_cost_usd']})")
+        if stats["requeued"] or stats["unanalyzed"]:
+            print(f"    Failed batches: {stats['requeued']} turns requeued, {stats['unanalyzed']} unanalyzed")
+
+
+def run_single_story_mode(method, turns, interactive, speculative=False, pregenerate=False):
     """Runs a single story and saves the results."""
     
     print("=" * 70)
@@ -65,6 +140,8 @@ def run_single_story_mode(method, turns, interactive):
         world_config=world_config,
         initial_facts=initial_facts,
         plot_config=config.get("plot", {}),
+        speculative=speculative,
+        pregenerate=pregenerate,
     )
     elapsed_time = time.time() - start_time
     
@@ -75,7 +152,7 @@ def run_single_story_mode(method, turns, interactive):
     metrics_path = os.path.join(base_dir, "story_metrics.json")
     
     with open(state_path, "w", encoding="utf-8") as f:
-        json.dump(final_state, f, ensure_ascii=False, indent=2)
+        json.dump(storable_state(final_state), f, ensure_ascii=False, indent=2)
     
     with open(story_path, "w", encoding="utf-8") as f:
         f.write(full_story)
@@ -135,13 +212,29 @@ def run_single_story_mode(method, turns, interactive):
 # FUNCTIONS FOR COMPARISON
 # =============================================================================
 
-def run_single_experiment(strategy, turns, run_id):
-    """Runs a single story for the experiment and returns metrics."""
+def compute_story_metrics(story_state, turns):
+    """Metrics of a finished story (facts, objects, inconsistencies, turn lengths)."""
+    accumulator = MetricsAccumulator(turns)
+    accumulator.observe(story_state)
+    return accumulator.summary()
+
+
+def run_single_experiment(strategy, turns, run_id, deadline_settings=None, tracer=None, settings=None,
+                          config=None, inputs=None):
+    """Runs a single story for the experiment and returns metrics.
+    
+    deadline_settings: optional kwargs for DeadlinePolicy (per call/turn/run budgets)
+    tracer: optional Tracer (see tracing.py); its phase breakdown is added to the metrics
+    settings: optional generation settings overriding the defaults (see generation_settings.py)
+    config: story configuration already loaded (default: story_config.json, read for this run)
+    inputs: optional user-input script of the turns (default: classes.DEFAULT_INPUTS)
+    """
     print(f"\n{'='*70}")
     print(f"RUN #{run_id} - Method {strategy} - {turns} turns")
     print(f"{'='*70}")
     
-    config = load_story_config()
+    if config is None:
+        config = load_story_config()
     characters = config["characters"]
     world_config = config["world"]
     plot_config = config.get("plot")
@@ -156,59 +249,66 @@ def run_single_experiment(strategy, turns, run_id):
     
     prepared_chars = build_characters_from_config(characters)
     
-    start_time = time.time()
-    story_state, full_story = run_story_session(
-        strategy=strategy,
-        max_turns=turns,
-        characters=prepared_chars,
-        interactive=False,
-        world_config=world_config,
-        initial_facts=initial_facts,
-        plot_config=plot_config,
-    )
-    elapsed_time = time.time() - start_time
-    
-    # Calculate metrics
-    total_facts = len(story_state["facts"])
-    total_objects = len(story_state["items"])
-    total_inconsistencies = len(story_state.get("inconsistencies", []))
+    # One policy per run: budgets and timeout log are per run
+    deadline_policy = DeadlinePolicy(**deadline_settings) if deadline_settings else None
     
-    inc_by_type = {}
-    repeated_inconsistencies = 0
-    seen_violations = set()
+    settings = {**generation_settings.current(), **generation_settings.validate(settings or {})}
     
-    for inc in story_state.get("inconsistencies", []):
-        inc_type = inc.get("type", "altro")
-        inc_by_type[inc_type] = inc_by_type.get(inc_type, 0) + 1
-        
-        desc_lower = inc.get("description", "").lower()
-        for keyword in ["cannocchial", "telescop", "pistol", "orologio"]:
-            if keyword in desc_lower:
-                if keyword in seen_violations:
-                    repeated_inconsistencies += 1
-                seen_violations.add(keyword)
+    recorder = UsageRecorder()
+    # Metrics are updated turn by turn: valid even if the run stops midway
+    accumulator = MetricsAccumulator(turns)
+    error = None
     
-    turn_lengths = []
-    for entry in story_state["history"]:
-        turn_lengths.append(len(entry["assistant"].split()))
+    start_time = time.time()
+    try:
+        with progress.run(strategy, run_id), tracer.activate() if tracer else nullcontext(), recorder.activate(), \
+                generation_settings.override(**settings):
+            story_state, full_story = run_story_session(
+                strategy=strategy,
+                max_turns=turns,
+                characters=prepared_chars,
+                interactive=False,
+                world_config=world_config,
+                initial_facts=initial_facts,
+                plot_config=plot_config,
+                deadline_policy=deadline_policy,
+                metrics_accumulator=accumulator,
+                inputs=inputs,
+            )
+    except Exception as e:
+        story_state = accumulator.story_state
+        if story_state is None:
+            raise
+        accumulator.observe(story_state)
+        error = f"{type(e).__name__}: {e}"
+        print(f"[WARNING] Run #{run_id} failed after {len(story_state['history'])} turns: {error}")
+        full_story = "\n".join(
+            f"=== Turn {i+1} ===\n{entry['assistant']}\n" for i, entry in enumerate(story_state["history"])
+        )
+    elapsed_time = time.time() - start_time
     
-    avg_turn_length = sum(turn_lengths) / len(turn_lengths) if turn_lengths else 0
+    # Calculate metrics
+    story_metrics = accumulator.summary()
+    total_facts = story_metrics["total_facts"]
+    total_objects = story_metrics["total_objects"]
+    total_inconsistencies = story_metrics["total_inconsistencies"]
+    repeated_inconsistencies = story_metrics["repeated_inconsistencies"]
+    avg_turn_length = story_metrics["avg_turn_length_words"]
     
     metrics = {
         "run_id": run_id,
         "strategy": strategy,
         "turns": turns,
+        "generation_settings": settings,
         "timestamp": datetime.now().isoformat(),
         "execution_time_seconds": round(elapsed_time, 2),
-        "total_facts": total_facts,
-        "facts_per_turn": round(total_facts / turns, 2),
-        "total_objects": total_objects,
-        "total_inconsistencies": total_inconsistencies,
-        "inconsistency_rate": round(total_inconsistencies / turns, 2),
-        "repeated_inconsistencies": repeated_inconsistencies,
-        "inconsistencies_by_type": inc_by_type,
-        "avg_turn_length_words": round(avg_turn_length, 2),
-        "turn_lengths": turn_lengths,
+        **story_metrics,
+        "total_timeouts": len(deadline_policy.timeouts) if deadline_policy else 0,
+        "timeouts": deadline_policy.summary() if deadline_policy else None,
+        "trace_summary": tracer.summary() if tracer else None,
+        "usage": recorder.summary(),
+        "per_turn_metrics": accumulator.rows,
+        "error": error,
         "story_text": full_story,
         "story_state": {
             "facts": story_state["facts"],
@@ -223,69 +323,164 @@ def run_single_experiment(strategy, turns, run_id):
     print(f"  - Inconsistencies: {total_inconsistencies} ({metrics['inconsistency_rate']}/turn)")
     print(f"  - Repeated inconsistencies: {repeated_inconsistencies}")
     print(f"  - Avg turn length: {round(avg_turn_length)} words")
+    print(f"  - Tokens: {metrics['usage']['prompt_tokens']} in / {metrics['usage']['output_tokens']} out "
+          f"(${metrics['usage']['cost_usd']:.4f})")
     print(f"  - Execution time: {round(elapsed_time/60, 1)} minutes")
+    if deadline_policy and deadline_policy.timeouts:
+        print(f"  - Timeouts: {len(deadline_policy.timeouts)} ({deadline_policy.on_timeout})")
     
     return metrics
 
 
-def compare_methods_mode(runs_per_method, turns, output_dir):
-    """Runs full comparison between Method A and B."""
+def run_experiment_jobs(jobs, turns, workers=1, on_result=None, deadline_settings=None, tracers=None, config=None):
+    """Runs (strategy, run_id) jobs serially or on a shared thread pool.
+    
+    Args:
+        jobs: list of (strategy, run_id)
+        turns: turns per story
+        workers: number of runs executed in parallel (1 = serial)
+        on_result: optional callback(strategy, run_id, metrics) called as runs complete
+        deadline_settings: optional DeadlinePolicy kwargs applied to every run
+        tracers: optional dict (strategy, run_id) -> Tracer
+        config: story configuration shared by the runs (default: each run reads story_config.json)
+        
+    Returns:
+        list of metrics, in the same order as jobs
+    """
+    results = [None] * len(jobs)
+    tracers = tracers or {}
+    
+    if workers <= 1:
+        for index, (strategy, run_id) in enumerate(jobs):
+            results[index] = run_single_experiment(strategy, turns, run_id, deadline_settings,
+                                                   tracers.get((strategy, run_id)), config=config)
+            if on_result:
+                on_result(strategy, run_id, results[index])
+        return results
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_single_experiment, strategy, turns, run_id, deadline_settings,
+                            tracers.get((strategy, run_id)), config=config): index
+            for index, (strategy, run_id) in enumerate(jobs)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            strategy, run_id = jobs[index]
+            results[index] = future.result()
+            if on_result:
+                on_result(strategy, run_id, results[index])
+    return results
+
+
+def compare_methods_mode(runs_per_method, turns, output_dir, workers=1, deadline_settings=None, trace=False,
+                         progress_interval=10.0):
+    """Runs full comparison between Method A and B.
+    
+    With trace=True every phase of every run is traced (tracing.py): the spans are
+    written to trace.json (chrome://tracing, Perfetto) and trace_otel.json.
+    Every progress_interval seconds a status block (runs, turns/min, latency, ETA) is
+    printed on stderr and status.json is refreshed in output_dir (0 = disabled).
+    """
+    # NumPy-based modules: loaded only by the commands that aggregate results
+    from blob_store import is_ref, open_store, pack
+    from columnar_store import STORE_DIRNAME, build_columns, write_store
+    from experiment_stats import compare_methods, method_stats
+    
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
+    # Story text and state are written once, compressed; the JSON files reference them
+    blobs = open_store(output_path)
+    blob_refs = {}  # (strategy, run_id) -> {field: reference} written by save_run
     
     results = {
         "experiment": {
             "date": datetime.now().isoformat(),
             "runs_per_method": runs_per_method,
             "turns_per_story": turns,
+            "workers": workers,
+            "deadlines": deadline_settings,
         },
         "method_A": [],
         "method_B": [],
     }
     
-    # Method A
-    print(f"\n{'#'*70}")
-    print(f"# STARTING TEST METHOD A (with learning)")
-    print(f"{'#'*70}")
+    jobs = [("A", i+1) for i in range(runs_per_method)] + [("B", i+1) for i in range(runs_per_method)]
+    tracers = {}
+    if trace:
+        tracers = {(s, r): Tracer(method=s, run=r) for s, r in jobs}
     
-    for i in range(runs_per_method):
-        metrics = run_single_experiment("A", turns, i+1)
-        results["method_A"].append(metrics)
-        
-        with open(output_path / f"method_A_run_{i+1}.json", "w", encoding="utf-8") as f:
-            json.dump(metrics, f, indent=2, ensure_ascii=False)
+    def save_run(strategy, run_id, metrics):
+        tracer = tracers.get((strategy, run_id))
+        with tracer.activate() if tracer else nullcontext(), span("file_io"):
+            packed = pack(metrics, blobs)
+            blob_refs[(strategy, run_id)] = {k: v for k, v in packed.items() if is_ref(v)}
+            with open(output_path / f"method_{strategy}_run_{run_id}.json", "w", encoding="utf-8") as f:
+                json.dump(packed, f, indent=2, ensure_ascii=False)
     
-    # Method B
     print(f"\n{'#'*70}")
-    print(f"# STARTING TEST METHOD B (without learning)")
+    print(f"# STARTING TEST METHOD A (with learning) AND METHOD B (without learning)")
+    print(f"#   {workers} parallel worker(s)")
     print(f"{'#'*70}")
     
-    for i in range(runs_per_method):
-        metrics = run_single_experiment("B", turns, i+1)
-        results["method_B"].append(metrics)
-        
-        with open(output_path / f"method_B_run_{i+1}.json", "w", encoding="utf-8") as f:
-            json.dump(metrics, f, indent=2, ensure_ascii=False)
-    
-    # Aggregated statistics
-    def calc_stats(method_data):
-        return {
-            "avg_facts": round(sum(m["total_facts"] for m in method_data) / len(method_data), 2),
-            "avg_objects": round(sum(m["total_objects"] for m in method_data) / len(method_data), 2),
-            "avg_inconsistencies": round(sum(m["total_inconsistencies"] for m in method_data) / len(method_data), 2),
-            "avg_repeated_inconsistencies": round(sum(m["repeated_inconsistencies"] for m in method_data) / len(method_data), 2),
-            "avg_inconsistency_rate": round(sum(m["inconsistency_rate"] for m in method_data) / len(method_data), 3),
-            "avg_turn_length": round(sum(m["avg_turn_length_words"] for m in method_data) / len(method_data), 2),
-        }
+    monitor = None
+    if progress_interval:
+        monitor = ProgressMonitor({"A": runs_per_method, "B": runs_per_method}, turns,
+                                  status_path=output_path / "status.json", interval=progress_interval)
+    with monitor.activate() if monitor else nullcontext():
+        all_metrics = run_experiment_jobs(jobs, turns, workers=workers, on_result=save_run,
+                                          deadline_settings=deadline_settings, tracers=tracers,
+                                          config=load_story_config())
+    results["method_A"] = all_metrics[:runs_per_method]
+    results["method_B"] = all_metrics[runs_per_method:]
     
-    results["summary"] = {
-        "method_A_stats": calc_stats(results["method_A"]),
-        "method_B_stats": calc_stats(results["method_B"]),
-    }
+    if trace:
+        # Refresh the breakdown so it includes the file I/O of each run
+        for (strategy, run_id), metrics in zip(jobs, all_metrics):
+            metrics["trace_summary"] = tracers[(strategy, run_id)].summary()
+        write_chrome_trace(output_path / "trace.json", tracers.values())
+        write_otel_trace(output_path / "trace_otel.json", tracers.values())
     
-    # Save results
+    pool = classes.key_pool
+    if pool is not None:
+        results["experiment"]["key_pool"] = pool.get_stats()
+    governor = classes.output_governor
+    if governor is not None:
+        results["experiment"]["output_governor"] = governor.get_stats()
+    selector = classes.best_of_n
+    if selector is not None:
+        results["experiment"]["best_of_n"] = selector.get_stats()
+    hedge = classes.hedge_policy
+    if hedge is not None:
+        results["experiment"]["hedging"] = hedge.get_stats()
+    gates = dict(sorted(classes.analysis_gates.items()))
+    if gates:
+        results["experiment"]["analysis_gate"] = {method: gate.get_stats() for method, gate in gates.items()}
+    
+    # Aggregated statistics (vectorized over the runs, with bootstrap CIs and p-values).
+    # Runs stopped by an error cover fewer turns: they stay in the results but not in the
+    # A/B aggregates, which only count them (and what they cost)
+    completed = {**results,
+                 "method_A": [run for run in results["method_A"] if not run.get("error")],
+                 "method_B": [run for run in results["method_B"] if not run.get("error")]}
+    columns, _, _ = build_columns(completed)
+    results["summary"] = {}
+    for method in ("A", "B"):
+        failed = [run for run in results[f"method_{method}"] if run.get("error")]
+        results["summary"][f"method_{method}_stats"] = {
+            **method_stats(columns, method),
+            "completed_runs": len(completed[f"method_{method}"]),
+            "failed_runs": len(failed),
+            "failed_runs_cost_usd": round(sum(run["usage"]["cost_usd"] for run in failed), 6),
+        }
+    results["summary"]["comparison"] = compare_methods(columns)
+    
+    # Save results (story text and state referenced in the blobs written by save_run)
+    results_full = {**results,
+                    "method_A": [{**run, **blob_refs[("A", run["run_id"])]} for run in results["method_A"]],
+                    "method_B": [{**run, **blob_refs[("B", run["run_id"])]} for run in results["method_B"]]}
     with open(output_path / "comparison_results_full.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+        json.dump(results_full, f, indent=2, ensure_ascii=False)
     
     results_light = {
         "experiment": results["experiment"],
@@ -298,6 +493,9 @@ def compare_methods_mode(runs_per_method, turns, output_dir):
     with open(output_path / "comparison_results.json", "w", encoding="utf-8") as f:
         json.dump(results_light, f, indent=2, ensure_ascii=False)
     
+    # Columnar copy for analyze_metrics (numeric columns memory-mapped, text in a sidecar)
+    write_store(results, output_path / STORE_DIRNAME, blobs=blobs)
+    
     # Print results
     print(f"\n{'='*70}")
     print("COMPARATIVE RESULTS")
@@ -308,12 +506,17 @@ def compare_methods_mode(runs_per_method, turns, output_dir):
     stats_a = results["summary"]["method_A_stats"]
     stats_b = results["summary"]["method_B_stats"]
     
+    print(f"{'Completed runs':<35} {stats_a['completed_runs']:<15} {stats_b['completed_runs']:<15}")
+    print(f"{'Failed runs (not aggregated)':<35} {stats_a['failed_runs']:<15} {stats_b['failed_runs']:<15}")
     print(f"{'Avg facts':<35} {stats_a['avg_facts']:<15} {stats_b['avg_facts']:<15}")
     print(f"{'Avg objects':<35} {stats_a['avg_objects']:<15} {stats_b['avg_objects']:<15}")
     print(f"{'Avg inconsistencies':<35} {stats_a['avg_inconsistencies']:<15} {stats_b['avg_inconsistencies']:<15}")
     print(f"{'Avg repeated inconsistencies':<35} {stats_a['avg_repeated_inconsistencies']:<15} {stats_b['avg_repeated_inconsistencies']:<15}")
     print(f"{'Inconsistency rate/turn':<35} {stats_a['avg_inconsistency_rate']:<15} {stats_b['avg_inconsistency_rate']:<15}")
     print(f"{'Avg turn length (words)':<35} {stats_a['avg_turn_length']:<15} {stats_b['avg_turn_length']:<15}")
+    print(f"{'Avg prompt tokens/run':<35} {stats_a['avg_prompt_tokens']:<15} {stats_b['avg_prompt_tokens']:<15}")
+    print(f"{'Avg output tokens/run':<35} {stats_a['avg_output_tokens']:<15} {stats_b['avg_output_tokens']:<15}")
+    print(f"{'Avg cost/run (USD)':<35} {stats_a['avg_cost_usd']:<15} {stats_b['avg_cost_usd']:<15}")
     
     improvement_inc = ((stats_b['avg_inconsistencies'] - stats_a['avg_inconsistencies']) / stats_b['avg_inconsistencies'] * 100) if stats_b['avg_inconsistencies'] > 0 else 0
     improvement_rep = ((stats_b['avg_repeated_inconsistencies'] - stats_a['avg_repeated_inconsistencies']) / stats_b['avg_repeated_inconsistencies'] * 100) if stats_b['avg_repeated_inconsistencies'] > 0 else 0
@@ -321,25 +524,254 @@ def compare_methods_mode(runs_per_method, turns, output_dir):
     print("\n" + "="*70)
     print(f"Method A reduces inconsistencies by {improvement_inc:.1f}%")
     print(f"Method A reduces repeated inconsistencies by {improvement_rep:.1f}%")
+    for metric, comparison in results["summary"]["comparison"].items():
+        low, high = comparison["ci_diff"]
+        print(f"  {metric}: A - B = {comparison['diff']:.3g} "
+              f"(95% CI {low:.3g} .. {high:.3g}, p = {comparison['p_value']:.4f})")
     print("="*70)
     
+    if pool is not None:
+        print("\nKey pool utilisation:")
+        for name, key_stats in results["experiment"]["key_pool"]["keys"].items():
+            print(f"  - {name}: {key_stats['calls']} calls, {key_stats['tokens']} tokens, "
+                  f"RPM utilisation {key_stats['rpm_utilisation']:.0%}, quarantines {key_stats['quarantines']}")
+    
+    if governor is not None:
+        print_governor_stats(results["experiment"]["output_governor"])
+    if selector is not None:
+        print_best_of_n_stats(results["experiment"]["best_of_n"])
+    if hedge is not None:
+        print(f"\nHedged requests: {results['experiment']['hedging']}")
+    if gates:
+        print_analysis_gate_stats(results["experiment"]["analysis_gate"])
+    
+    if trace:
+        print(f"Trace saved in: {output_path / 'trace.json'} (open in chrome://tracing or Perfetto)")
     print(f"\nResults saved in: {output_path}")
     
     return results
 
 
+def sweep_mode(spec_path, method, runs, turns, output_dir, workers=1, objective="total_inconsistencies",
+               maximize=False, min_runs=3, confirm=True):
+    """Runs a parameter sweep (see sweep.py) and writes one comparable results table.
+    
+    Every configuration of the spec runs `runs` stories with `method`; configurations
+    whose objective is clearly worse than the best one are stopped early.
+    """
+    from blob_store import open_store, pack
+    from sweep import expand_spec, format_table, load_spec, run_sweep, sweep_table, write_table
+    
+    spec = load_spec(spec_path)
+    configs = expand_spec(spec)
+    setting_names = []
+    for config in configs:
+        setting_names += [name for name in config if name not in setting_names]
+    
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    blobs = open_store(output_path)  # shared by the config_<i>/ run files
+    
+    print(f"\nPARAMETER SWEEP - Method {method}")
+    print(f"   - Configurations: {len(configs)} ({', '.join(setting_names)})")
+    print(f"   - Runs per configuration: {runs} (up to {len(configs) * runs} runs)")
+    print(f"   - Turns per story: {turns}")
+    print(f"   - Objective: {'max' if maximize else 'min'} {objective}"
+          + (f", early stop after {min_runs} runs" if min_runs else ""))
+    print(f"   - Parallel workers: {workers}")
+    if confirm:
+        input("\nPress ENTER to start...")
+    
+    config = load_story_config()
+    
+    def run_config(index, settings, run_id):
+        return run_single_experiment(method, turns, run_id, settings=settings, config=config)
+    
+    def save_run(index, run_id, metrics):
+        config_path = output_path / f"config_{index}"
+        config_path.mkdir(exist_ok=True)
+        with open(config_path / f"method_{method}_run_{run_id}.json", "w", encoding="utf-8") as f:
+            json.dump(pack(metrics, blobs), f, indent=2, ensure_ascii=False)
+    
+    entries = run_sweep(configs, runs, run_config, workers=workers, objective=objective, maximize=maximize,
+                        min_runs=min_runs, on_result=save_run)
+    rows = sweep_table(entries, objective, maximize)
+    
+    results = {
+        "experiment": {
+            "date": datetime.now().isoformat(),
+            "spec": spec,
+            "method": method,
+            "runs_per_config": runs,
+            "turns_per_story": turns,
+            "workers": workers,
+            "objective": objective,
+            "maximize": maximize,
+            "min_runs": min_runs,
+        },
+        "table": rows,
+        "configs": [
+            {**{k: v for k, v in entry.items() if k != "runs"},
+             "runs": [{k: v for k, v in run.items() if k not in ["story_text", "story_state"]}
+                      for run in entry["runs"]]}
+            for entry in entries
+        ],
+    }
+    with open(output_path / "sweep_results.json", "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    write_table(rows, output_path / "sweep_table.csv")
+    
+    print(f"\n{'='*70}")
+    print("SWEEP RESULTS (best first)")
+    print(f"{'='*70}")
+    print(format_table(rows, objective, setting_names))
+    print(f"\nResults saved in: {output_path} (sweep_table.csv, sweep_results.json)")
+    return results
+
+
+def batch_mode(jobs_path, output_dir, workers=1, methods=None, runs=None, turns=None, confirm=True):
+    """Runs every job of a JSONL job file on one shared worker pool (see batch_jobs.py).
+    
+    Each run is written as it completes to <output_dir>/<job id>/method_X_run_N.json
+    (story text and state in the blob store) and appended to batch_journal.jsonl;
+    batch_summary.json holds the per-job means and throughput.
+    """
+    from batch_jobs import job_runs, load_jobs, run_jobs
+    from blob_store import open_store, pack
+    from sweep import TABLE_METRICS, metric_value
+    
+    # Parsed and validated once, before any run: all the problems at once
+    jobs = load_jobs(jobs_path, methods=methods, runs=runs, turns=turns)
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    blobs = open_store(output_path)
+    
+    print(f"\nBATCH RUN - {jobs_path}")
+    for job in jobs:
+        print(f"   - {job['id']}: {job['config']['world'].get('name', '?')}, methods {'/'.join(job['methods'])}, "
+              f"{job['runs']} run(s) x {job['turns']} turns, "
+              f"{len(job['inputs']) if job['inputs'] else 'default'} inputs"
+              + (f", settings {job['settings']}" if job['settings'] else ""))
+    print(f"   - Total runs: {len(job_runs(jobs))}")
+    print(f"   - Parallel workers: {workers}")
+    print(f"   - Output directory: {output_path}")
+    if confirm:
+        input("\nPress ENTER to start...")
+    
+    journal_lock = threading.Lock()
+    journal = open(output_path / "batch_journal.jsonl", "a", encoding="utf-8")
+    
+    def run_one(job, method, run_id):
+        return run_single_experiment(method, job["turns"], run_id, settings=job["settings"],
+                                     config=job["config"], inputs=job["inputs"])
+    
+    def save_run(job, method, run_id, metrics):
+        job_path = output_path / job["id"]
+        job_path.mkdir(exist_ok=True)
+        with open(job_path / f"method_{method}_run_{run_id}.json", "w", encoding="utf-8") as f:
+            json.dump(pack(metrics, blobs), f, indent=2, ensure_ascii=False)
+        entry = {"job": job["id"], "method": method,
+                 **{k: v for k, v in metrics.items() if k not in ["story_text", "story_state", "per_turn_metrics"]}}
+        with journal_lock:
+            journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            journal.flush()
+    
+    try:
+        job_results = run_jobs(jobs, run_one, workers=workers, on_result=save_run)
+    finally:
+        journal.close()
+    
+    summary = {"date": datetime.now().isoformat(), "jobs_file": str(jobs_path), "workers": workers, "jobs": {}}
+    for job in jobs:
+        entry = job_results[job["id"]]
+        methods_summary = {}
+        for method in job["methods"]:
+            selected = [m for m in entry["runs"] if m["strategy"] == method]
+            methods_summary[method] = {
+                name: round(sum(metric_value(m, name) for m in selected) / len(selected), 4) if selected else None
+                for name in TABLE_METRICS
+            }
+        summary["jobs"][job["id"]] = {"methods": methods_summary, "throughput": entry["throughput"]}
+    with open(output_path / "batch_summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    
+    print(f"\n{'='*70}")
+    print("BATCH RESULTS")
+    print(f"{'='*70}")
+    print(f"{'Job':<20} {'Runs':>5} {'Turns/min':>10} {'Tok/s':>8} {'Wall s':>8}  Inconsistencies (A / B)")
+    for job_id, entry in summary["jobs"].items():
+        t = entry["throughput"]
+        inconsistencies = " / ".join(
+            "-" if entry["methods"].get(m, {}).get("total_inconsistencies") is None
+            else f"{entry['methods'][m]['total_inconsistencies']:.2f}" for m in ("A", "B"))
+        print(f"{job_id:<20} {t['runs']:>5} {t['turns_per_minute']:>10.1f} {t['output_tokens_per_second']:>8.1f} "
+              f"{t['wall_seconds']:>8.1f}  {inconsistencies}")
+    print(f"\nResults saved in: {output_path} (batch_journal.jsonl, batch_summary.json)")
+    return summary
+
+
+def reanalyze_mode(input_dir, output_dir=None, methods=("A", "B"), batch_size=4, workers=1, confirm=True):
+    """Re-analyzes the stored stories of a results directory (see reanalyze.py).
+    
+    Fresh facts, items, inconsistencies and metrics are written to output_dir
+    (default: <input_dir>/reanalysis), next to the original runs.
+    """
+    from reanalyze import REANALYSIS_DIRNAME, load_run_files, make_batches, reanalyze_runs, split_story_text, summarize
+    
+    runs = load_run_files(input_dir, methods)
+    if not runs:
+        raise FileNotFoundError(f"No method_*_run_*.json files in: {input_dir}")
+    output_path = Path(output_dir) if output_dir else Path(input_dir) / REANALYSIS_DIRNAME
+    output_path.mkdir(parents=True, exist_ok=True)
+    
+    turns = [len(split_story_text(run.get("story_text"))) for _, run in runs]
+    requests = sum(len(make_batches(range(n), batch_size)) for n in turns)
+    print(f"\nRE-ANALYSIS OF STORED RUNS")
+    print(f"   - Runs: {len(runs)} ({sum(turns)} turns)")
+    print(f"   - Turns per request: {batch_size} ({requests} requests instead of {sum(turns)})")
+    print(f"   - Parallel requests: {workers}")
+    print(f"   - Output directory: {output_path}")
+    if confirm:
+        input("\nPress ENTER to start...")
+    
+    def save_run(method, run, result):
+        with open(output_path / f"method_{method}_run_{run['run_id']}.json", "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"[INFO] Method {method} run #{run['run_id']}: {result['total_inconsistencies']} inconsistencies "
+              f"(was {result['original']['total_inconsistencies']}), {result['calls']} calls")
+    
+    results = reanalyze_runs(runs, load_story_config(), batch_size=batch_size, workers=workers,
+                             on_result=save_run)
+    summary = {
+        "date": datetime.now().isoformat(),
+        "input": str(input_dir),
+        "batch_size": batch_size,
+        **summarize(results),
+    }
+    with open(output_path / "reanalysis_summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    
+    print(f"\n{'Metric':<35} {'Original':<15} {'Re-analyzed':<15}")
+    print("-" * 70)
+    for method, entry in summary["methods"].items():
+        for name, values in entry.items():
+            if name != "runs":
+                print(f"{f'{name} ({method})':<35} {str(values['original']):<15} {values['reanalyzed']:<15}")
+    print(f"\n{summary['calls']} analysis calls for {summary['turns']} turns, ${summary['cost_usd']:.4f}")
+    print(f"Results saved in: {output_path}")
+    return summary
+
+
 # =============================================================================
 # FUNCTION FOR ANALYSIS
 # =============================================================================
 
-def analyze_mode(input_dir, output_dir):
-    """Runs analyze_metrics.py with specified parameters."""
-    import subprocess
-    import sys
+def analyze_mode(input_dir, output_dir, preview=False, workers=None, force=False):
+    """Runs the analyze_metrics analysis in this process."""
+    # matplotlib is imported only here: single/compare do not pay for it
+    from analyze_metrics import analyze_and_plot
     
-    cmd = [sys.executable, "analyze_metrics.py", "--input", input_dir, "--output", output_dir]
-    print(f"Executing: {' '.join(cmd)}")
-    subprocess.run(cmd)
+    analyze_and_plot(input_dir, output_dir, preview=preview, workers=workers, force=force)
 
 
 # =============================================================================
@@ -356,6 +788,7 @@ Examples:
   python run.py single --method B --turns 5   # One story with Method B, 5 turns
   python run.py single --interactive          # Interactive mode
   python run.py compare --runs 10 --turns 10  # Full comparison
+  python run.py reanalyze --input final_results  # Re-score stored stories
   python run.py analyze --input final_results # Generate charts
         """
     )
@@ -370,6 +803,32 @@ Examples:
                                help="Number of turns. Default: 10")
     single_parser.add_argument("--interactive", "-i", action="store_true",
                                help="Interactive mode (enter input at each turn)")
+    single_parser.add_argument("--speculative", action="store_true",
+                               help="Interactive only: analyze and prepare the next turn while you type")
+    single_parser.add_argument("--pregenerate", action="store_true",
+                               help="With --speculative: pre-generate the suggested continuation")
+    single_parser.add_argument("--adaptive-output", action="store_true",
+                               help="Learn max_output_tokens per call type and plot phase (see output_governor.py)")
+    single_parser.add_argument("--hedge", action="store_true",
+                               help="Duplicate calls slower than usual, first answer wins; without a key pool "
+                                    "only when a rate-limit slot is free (see hedging.py)")
+    single_parser.add_argument("--hedge-percentile", type=float, default=95,
+                               help="With --hedge: latency percentile after which a call is duplicated. Default: 95")
+    single_parser.add_argument("--hedge-budget", type=float, default=0.1,
+                               help="With --hedge: max duplicates as a fraction of calls. Default: 0.1")
+    single_parser.add_argument("--best-of", type=int, default=None, metavar="N",
+                               help="Method A: generate N candidates per turn concurrently, keep the best (see best_of_n.py)")
+    single_parser.add_argument("--best-of-budget", type=float, default=2.0,
+                               help="With --best-of: seconds to wait for more candidates after the first. Default: 2")
+    single_parser.add_argument("--analysis-gate", action="store_true",
+                               help="Analyze, defer or skip each turn by its local novelty (see analysis_gate.py)")
+    single_parser.add_argument("--metrics-port", type=int, default=None,
+                               help="Expose OpenMetrics on http://HOST:PORT/metrics")
+    single_parser.add_argument("--metrics-host", type=str, default="127.0.0.1",
+                               help="Interface of the --metrics-port endpoint (0.0.0.0 = all, unauthenticated). "
+                                    "Default: 127.0.0.1")
+    single_parser.add_argument("--metrics-file", type=str, default=None,
+                               help="Write OpenMetrics to this file (node_exporter textfile collector)")
     
     # Subparser for 'compare'
     compare_parser = subparsers.add_parser("compare", help="Compare Method A vs B")
@@ -379,6 +838,116 @@ Examples:
                                 help="Number of turns per story. Default: 10")
     compare_parser.add_argument("--output", type=str, default="comparison_results",
                                 help="Output directory. Default: comparison_results")
+    compare_parser.add_argument("--workers", type=int, default=1,
+                                help="Runs executed in parallel (scale with the number of API keys). Default: 1")
+    compare_parser.add_argument("--keys-file", type=str, default=None,
+                                help="JSON list of API keys with their RPM/TPM limits (see key_pool.py)")
+    compare_parser.add_argument("--call-timeout", type=float, default=None,
+                                help="Max seconds per LLM call (default: no limit)")
+    compare_parser.add_argument("--turn-timeout", type=float, default=None,
+                                help="Max seconds per turn (default: no limit)")
+    compare_parser.add_argument("--run-timeout", type=float, default=None,
+                                help="Max seconds per run (default: no limit)")
+    compare_parser.add_argument("--on-timeout", type=str, choices=TIMEOUT_ACTIONS, default="skip_analysis",
+                                help="Degraded path on timeout. Default: skip_analysis")
+    compare_parser.add_argument("--adaptive-output", action="store_true",
+                                help="Learn max_output_tokens per call type and plot phase (see output_governor.py)")
+    compare_parser.add_argument("--hedge", action="store_true",
+                                help="Duplicate calls slower than usual, first answer wins; without a key pool "
+                                     "only when a rate-limit slot is free (see hedging.py)")
+    compare_parser.add_argument("--hedge-percentile", type=float, default=95,
+                                help="With --hedge: latency percentile after which a call is duplicated. Default: 95")
+    compare_parser.add_argument("--hedge-budget", type=float, default=0.1,
+                                help="With --hedge: max duplicates as a fraction of calls. Default: 0.1")
+    compare_parser.add_argument("--best-of", type=int, default=None, metavar="N",
+                                help="Method A: generate N candidates per turn concurrently, keep the best (see best_of_n.py)")
+    compare_parser.add_argument("--best-of-budget", type=float, default=2.0,
+                                help="With --best-of: seconds to wait for more candidates after the first. Default: 2")
+    compare_parser.add_argument("--analysis-gate", type=str, nargs="+", choices=["A", "B"], default=None,
+                                help="Methods whose analysis is gated by local novelty (see analysis_gate.py). "
+                                     "Gate both for a like-for-like comparison")
+    compare_parser.add_argument("--gate-analyze-ratio", type=float, default=None,
+                                help="With --analysis-gate: novelty to analyze a turn at once. Default: 0.7")
+    compare_parser.add_argument("--gate-defer-ratio", type=float, default=None,
+                                help="With --analysis-gate: novelty to defer a turn (skipped below). Default: 0.3")
+    compare_parser.add_argument("--gate-recall", action="store_true",
+                                help="With --analysis-gate: also analyze batched and skipped turns alone to measure "
+                                     "the recall of the gated analysis (extra calls, not billed to the runs)")
+    compare_parser.add_argument("--trace", action="store_true",
+                                help="Record per-phase spans (trace.json for chrome://tracing / Perfetto)")
+    compare_parser.add_argument("--metrics-port", type=int, default=None,
+                                help="Expose OpenMetrics on http://HOST:PORT/metrics")
+    compare_parser.add_argument("--metrics-host", type=str, default="127.0.0.1",
+                                help="Interface of the --metrics-port endpoint (0.0.0.0 = all, unauthenticated). "
+                                     "Default: 127.0.0.1")
+    compare_parser.add_argument("--metrics-file", type=str, default=None,
+                                help="Write OpenMetrics to this file (node_exporter textfile collector)")
+    compare_parser.add_argument("--progress-interval", type=float, default=10.0,
+                                help="Seconds between progress/ETA updates on stderr and in status.json "
+                                     "(0 = disabled). Default: 10")
+    compare_parser.add_argument("--plan", action="store_true",
+                                help="Dry run: forecast calls, tokens, cost and wall-clock time, then exit")
+    compare_parser.add_argument("--plan-from", type=str,
+                                default=str(Path(__file__).resolve().parent.parent / "final_results"),
+                                help="Stored results used by --plan for the per-turn growth. Default: final_results")
+    
+    # Subparser for 'sweep'
+    sweep_parser = subparsers.add_parser("sweep", help="Sweep generation settings (grid or random search)")
+    sweep_parser.add_argument("--spec", type=str, required=True,
+                              help="JSON sweep spec with a 'grid' or 'random' section (see sweep.py)")
+    sweep_parser.add_argument("--method", type=str, choices=["A", "B"], default="A",
+                              help="Method used by every configuration. Default: A")
+    sweep_parser.add_argument("--runs", type=int, default=5,
+                              help="Runs per configuration. Default: 5")
+    sweep_parser.add_argument("--turns", type=int, default=10,
+                              help="Number of turns per story. Default: 10")
+    sweep_parser.add_argument("--output", type=str, default="sweep_results",
+                              help="Output directory. Default: sweep_results")
+    sweep_parser.add_argument("--workers", type=int, default=1,
+                              help="Runs executed in parallel, across configurations. Default: 1")
+    sweep_parser.add_argument("--keys-file", type=str, default=None,
+                              help="JSON list of API keys with their RPM/TPM limits (see key_pool.py)")
+    sweep_parser.add_argument("--objective", type=str, default="total_inconsistencies",
+                              choices=["total_inconsistencies", "repeated_inconsistencies", "inconsistency_rate",
+                                       "total_facts", "total_objects", "avg_turn_length_words", "cost_usd"],
+                              help="Metric the configurations are ranked on. Default: total_inconsistencies")
+    sweep_parser.add_argument("--maximize", action="store_true",
+                              help="Higher objective is better (default: lower is better)")
+    sweep_parser.add_argument("--min-runs", type=int, default=3,
+                              help="Runs before a clearly worse configuration is stopped (0 = never, else at least 2; "
+                                   "Student-t CIs, see sweep.py). Default: 3")
+    
+    # Subparser for 'batch'
+    batch_parser = subparsers.add_parser("batch", help="Run many story configurations from a JSONL job file")
+    batch_parser.add_argument("--jobs", type=str, required=True,
+                              help="JSONL job file: config, inputs, methods, runs, turns per line (see batch_jobs.py)")
+    batch_parser.add_argument("--output", type=str, default="batch_results",
+                              help="Output directory. Default: batch_results")
+    batch_parser.add_argument("--workers", type=int, default=1,
+                              help="Runs executed in parallel, across jobs. Default: 1")
+    batch_parser.add_argument("--methods", type=str, nargs="+", choices=["A", "B"], default=None,
+                              help="Methods of the jobs that do not set them. Default: A B")
+    batch_parser.add_argument("--runs", type=int, default=None,
+                              help="Runs per method of the jobs that do not set them. Default: 1")
+    batch_parser.add_argument("--turns", type=int, default=None,
+                              help="Turns per story of the jobs that do not set them. Default: 10")
+    batch_parser.add_argument("--keys-file", type=str, default=None,
+                              help="JSON list of API keys with their RPM/TPM limits (see key_pool.py)")
+    
+    # Subparser for 'reanalyze'
+    reanalyze_parser = subparsers.add_parser("reanalyze", help="Re-run the analysis on stored stories")
+    reanalyze_parser.add_argument("--input", type=str, default="final_results",
+                                  help="Directory with method_*_run_*.json files. Default: final_results")
+    reanalyze_parser.add_argument("--output", type=str, default=None,
+                                  help="Output directory. Default: <input>/reanalysis")
+    reanalyze_parser.add_argument("--methods", type=str, nargs="+", choices=["A", "B"], default=["A", "B"],
+                                  help="Methods whose runs are re-analyzed. Default: A B")
+    reanalyze_parser.add_argument("--batch-size", type=int, default=4,
+                                  help="Turns analyzed per request. Default: 4")
+    reanalyze_parser.add_argument("--workers", type=int, default=1,
+                                  help="Requests in flight (scale with the number of API keys). Default: 1")
+    reanalyze_parser.add_argument("--keys-file", type=str, default=None,
+                                  help="JSON list of API keys with their RPM/TPM limits (see key_pool.py)")
     
     # Subparser for 'analyze'
     analyze_parser = subparsers.add_parser("analyze", help="Analyze results and generate charts")
@@ -386,23 +955,115 @@ Examples:
                                 help="Directory with results. Default: final_results")
     analyze_parser.add_argument("--output", type=str, default="analysis_graphs",
                                 help="Output directory for charts. Default: analysis_graphs")
+    analyze_parser.add_argument("--preview", action="store_true",
+                                help="Fast low-resolution charts (72 dpi) in <output>/preview/")
+    analyze_parser.add_argument("--workers", type=int, default=None,
+                                help="Chart worker processes (1 = render inline). Default: one per chart")
+    analyze_parser.add_argument("--force", action="store_true",
+                                help="Redraw every chart, ignoring the cache")
     
     args = parser.parse_args()
     
+    if getattr(args, "adaptive_output", False):
+        from output_governor import OutputGovernor
+        classes.set_output_governor(OutputGovernor())
+    if getattr(args, "hedge", False):
+        from hedging import HedgePolicy
+        classes.set_hedge_policy(HedgePolicy(percentile=args.hedge_percentile, budget_ratio=args.hedge_budget))
+    if getattr(args, "best_of", None) and args.best_of > 1:
+        from best_of_n import BestOfNSelector
+        classes.set_best_of_n(BestOfNSelector(n=args.best_of, budget=args.best_of_budget))
+    if getattr(args, "analysis_gate", None):
+        from analysis_gate import DEFAULT_ANALYZE_RATIO, DEFAULT_DEFER_RATIO, AnalysisGate
+        gated = [args.method] if args.command == "single" else args.analysis_gate
+        analyze_ratio = getattr(args, "gate_analyze_ratio", None)
+        defer_ratio = getattr(args, "gate_defer_ratio", None)
+        analyze_ratio = DEFAULT_ANALYZE_RATIO if analyze_ratio is None else analyze_ratio
+        defer_ratio = DEFAULT_DEFER_RATIO if defer_ratio is None else defer_ratio
+        # Same settings for every gated method, one gate each (separate stats)
+        for method in gated:
+            classes.set_analysis_gate(method, AnalysisGate(analyze_ratio=analyze_ratio, defer_ratio=defer_ratio,
+                                                           measure_recall=getattr(args, "gate_recall", False)))
+        if args.command == "compare" and len(set(gated)) < 2:
+            print(f"[WARNING] Analysis gate only on method {gated[0]}: the comparison is not like for like")
+    
+    # OpenMetrics counters/histograms, only when an export target is given
+    metrics_scope = nullcontext()
+    if getattr(args, "metrics_port", None) or getattr(args, "metrics_file", None):
+        metrics_scope = exporting(MetricsRegistry(), port=args.metrics_port, textfile=args.metrics_file,
+                                  host=args.metrics_host)
+    
     if args.command == "single":
-        run_single_story_mode(args.method, args.turns, args.interactive)
+        with metrics_scope:
+            run_single_story_mode(args.method, args.turns, args.interactive,
+                                  speculative=args.speculative, pregenerate=args.pregenerate)
+        if classes.output_governor is not None:
+            print_governor_stats(classes.output_governor.get_stats())
+        if classes.best_of_n is not None:
+            print_best_of_n_stats(classes.best_of_n.get_stats())
+        if classes.hedge_policy is not None:
+            print(f"\nHedged requests: {classes.hedge_policy.get_stats()}")
+        if classes.analysis_gates:
+            print_analysis_gate_stats({method: gate.get_stats() for method, gate in classes.analysis_gates.items()})
     
     elif args.command == "compare":
         print(f"\nCOMPARISON METHOD A vs B")
         print(f"   - Runs per method: {args.runs}")
         print(f"   - Turns per story: {args.turns}")
         print(f"   - Output directory: {args.output}")
+        print(f"   - Parallel workers: {args.workers}")
+        
+        # Multiple keys: from --keys-file or GEMINI_API_KEYS
+        pool = KeyPool.from_file(args.keys_file) if args.keys_file else KeyPool.from_env()
+        if pool is not None:
+            classes.set_key_pool(pool)
+            print(f"   - API keys in pool: {len(pool.keys)}")
+        
+        deadline_settings = None
+        if args.call_timeout or args.turn_timeout or args.run_timeout:
+            deadline_settings = {
+                "per_call_seconds": args.call_timeout,
+                "per_turn_seconds": args.turn_timeout,
+                "per_run_seconds": args.run_timeout,
+                "on_timeout": args.on_timeout,
+            }
+        
+        if args.plan:
+            from planner import format_plan, plan_compare
+            plan = plan_compare(args.runs, args.turns, args.workers, load_story_config(), args.plan_from,
+                                key_pool=pool)
+            print("\n" + format_plan(plan))
+            raise SystemExit(0)
         
         input("\nPress ENTER to start...")
-        compare_methods_mode(args.runs, args.turns, args.output)
+        with metrics_scope:
+            compare_methods_mode(args.runs, args.turns, args.output, workers=args.workers,
+                                 deadline_settings=deadline_settings, trace=args.trace,
+                                 progress_interval=args.progress_interval)
+    
+    elif args.command == "sweep":
+        pool = KeyPool.from_file(args.keys_file) if args.keys_file else KeyPool.from_env()
+        if pool is not None:
+            classes.set_key_pool(pool)
+        sweep_mode(args.spec, args.method, args.runs, args.turns, args.output, workers=args.workers,
+                   objective=args.objective, maximize=args.maximize, min_runs=args.min_runs)
+    
+    elif args.command == "batch":
+        pool = KeyPool.from_file(args.keys_file) if args.keys_file else KeyPool.from_env()
+        if pool is not None:
+            classes.set_key_pool(pool)
+        batch_mode(args.jobs, args.output, workers=args.workers, methods=args.methods, runs=args.runs,
+                   turns=args.turns)
+    
+    elif args.command == "reanalyze":
+        pool = KeyPool.from_file(args.keys_file) if args.keys_file else KeyPool.from_env()
+        if pool is not None:
+            classes.set_key_pool(pool)
+        reanalyze_mode(args.input, args.output, methods=args.methods, batch_size=args.batch_size,
+                       workers=args.workers)
     
     elif args.command == "analyze":
-        analyze_mode(args.input, args.output)
+        analyze_mode(args.input, args.output, preview=args.preview, workers=args.workers, force=args.force)
     
     else:
         parser.print_help()
@@ -0,0 +1,184 @@
+"""Bounded session store for story states.
+
+Keeps recently used story states in memory (LRU, capped by bytes) and
+spills cold sessions to an on-disk SQLite tier. Cold sessions are loaded
+lazily on the next access.
+
+Usage:
+    store = SessionStore(max_memory_bytes=32 * 1024 * 1024, db_path="sessions.db")
+    run_story_session(..., session_store=store, session_id="user-42")
+    print(store.get_stats())
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from violations import storable_state
+
+
+DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+
+
+def _serialize(state):
+    """Serialize a story state to compact UTF-8 JSON bytes."""
+    return json.dumps(storable_state(state), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class SessionStore:
+    """Two-tier session store: in-memory LRU + SQLite spill.
+
+    Args:
+        max_memory_bytes: cap on the serialized size of states kept in RAM
+        db_path: SQLite file for the disk tier (":memory:" keeps it in-process,
+                 None disables the disk tier and evicted sessions are dropped)
+    """
+
+    def __init__(self, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES, db_path=":memory:"):
+        self.max_memory_bytes = max_memory_bytes
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        # session_id -> (state, size_bytes, dirty)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "disk_loads": 0,
+            "evictions": 0,
+            "spilled_bytes": 0,
+        }
+
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get(self, session_id):
+        """Return the story state for session_id, or None if unknown.
+
+        Memory hits are promoted to most-recently-used; disk hits are
+        loaded back into the memory tier.
+        """
+        with self._lock:
+            entry = self._memory.get(session_id)
+            if entry is not None:
+                self._memory.move_to_end(session_id)
+                self._stats["hits"] += 1
+                return entry[0]
+
+            data = self._load_from_disk(session_id)
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["disk_loads"] += 1
+            state = json.loads(data.decode("utf-8"))
+            # Already persisted: not dirty
+            self._insert(session_id, state, len(data), dirty=False)
+            return state
+
+    def put(self, session_id, state):
+        """Store (or refresh) the state of a session in the memory tier."""
+        size = len(_serialize(state))
+        with self._lock:
+            self._remove_from_memory(session_id)
+            self._insert(session_id, state, size, dirty=True)
+
+    def delete(self, session_id):
+        """Remove a session from both tiers."""
+        with self._lock:
+            self._remove_from_memory(session_id)
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._db.commit()
+
+    def __contains__(self, session_id):
+        with self._lock:
+            if session_id in self._memory:
+                return True
+            if self._db is None:
+                return False
+            row = self._db.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            return row is not None
+
+    def flush(self):
+        """Write every dirty in-memory session to the disk tier."""
+        with self._lock:
+            if self._db is None:
+                return
+            for session_id, (state, size, dirty) in self._memory.items():
+                if dirty:
+                    self._write_to_disk(session_id, _serialize(state))
+                    self._memory[session_id] = (state, size, False)
+
+    def close(self):
+        """Flush and close the disk tier."""
+        with self._lock:
+            self.flush()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get_stats(self):
+        """Return hit/miss/eviction counters and current memory usage."""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_loads"] + self._stats["misses"]
+            stats = dict(self._stats)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["sessions_in_memory"] = len(self._memory)
+            stats["hit_rate"] = round(self._stats["hits"] / lookups, 3) if lookups else 0
+            return stats
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _insert(self, session_id, state, size, dirty):
+        self._memory[session_id] = (state, size, dirty)
+        self._memory_bytes += size
+        self._evict()
+
+    def _remove_from_memory(self, session_id):
+        entry = self._memory.pop(session_id, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+
+    def _evict(self):
+        """Spill least-recently-used sessions until under the byte cap.
+
+        The most recent session is always kept, even if alone it exceeds the cap.
+        """
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            session_id, (state, size, dirty) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+            self._stats["evictions"] += 1
+            if dirty and self._db is not None:
+                self._write_to_disk(session_id, _serialize(state))
+                self._stats["spilled_bytes"] += size
+
+    def _write_to_disk(self, session_id, data):
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, state) VALUES (?, ?)",
+            (session_id, data),
+        )
+        self._db.commit()
+
+    def _load_from_disk(self, session_id):
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else None
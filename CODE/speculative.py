@@ -0,0 +1,183 @@
+"""Speculative prefetch for interactive sessions.
+
+While the user is typing the next input, the model would otherwise sit idle.
+The prefetcher uses that time to:
+- run the analysis of the turn just displayed (analyze_turn: the analysis
+  gate of the method applies)
+- append it to the history and prepare the next prompt (fixed cached context
+  and state text), so only the user input is missing
+- optionally pre-generate the continuation for the suggested default input,
+  used instantly if the user accepts the suggestion (empty input)
+
+Each start() creates a new job: a pre-generation still running from an
+earlier turn writes into its own job and is ignored. An analysis timeout
+does not fail the job: the chunk is still added to the history and the
+timeout is handed to the session (analysis_timeout), like a timeout of the
+regular path.
+
+Hit rate and latency saved are collected in get_stats().
+"""
+
+import contextvars
+import threading
+import time
+
+from classes import (
+    analyze_turn,
+    append_to_history,
+    build_generation_parts,
+    generate_from_parts,
+)
+from deadlines import DeadlineExceeded
+
+
+class SpeculativePrefetcher:
+    """Background preparation of the next turn of an interactive session.
+
+    Args:
+        strategy: "A" or "B"
+        plot_config: plot structure (used by Method A for the phase guidance)
+        max_turns: total turns of the session
+        pregenerate: if True, also generate the continuation for the default input
+    """
+
+    def __init__(self, strategy, plot_config=None, max_turns=10, pregenerate=False):
+        self.strategy = strategy
+        self.plot_config = plot_config
+        self.max_turns = max_turns
+        self.pregenerate = pregenerate
+
+        self._job = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "turns_prefetched": 0,
+            "analysis_seconds_hidden": 0.0,
+            "pregenerations": 0,
+            "pregeneration_hits": 0,
+            "generation_seconds_saved": 0.0,
+        }
+
+    def start(self, story_state, user_input, story_chunk, next_turn, suggested_input=None):
+        """Start background work for a turn that has just been displayed."""
+        job = {
+            "turn": next_turn - 1,
+            "turn_id": len(story_state["history"]),  # analysis turn id (history length)
+            "story_chunk": story_chunk,
+            "prepared": threading.Event(),
+            "parts": None,
+            "prepare_seconds": 0.0,
+            "error": None,
+            "analysis_timeout": None,
+            "suggested_input": suggested_input if self.pregenerate else None,
+            "pregenerated": None,
+            "pregenerate_seconds": 0.0,
+        }
+        # Copy the context so active deadlines (deadlines.py) also apply in background
+        ctx = contextvars.copy_context()
+        job["thread"] = threading.Thread(
+            target=ctx.run,
+            args=(self._work, job, story_state, user_input, story_chunk, next_turn),
+            daemon=True,
+        )
+        self._job = job
+        job["thread"].start()
+
+    def wait_prepared(self):
+        """Block until the analysis of the previous turn is merged into the state.
+
+        Returns:
+            dict with prefix, cached_context, temperature, phase for the next prompt
+            (None after the last turn)
+        """
+        job = self._job
+        wait_start = time.time()
+        job["prepared"].wait()
+        waited = time.time() - wait_start
+        if job["error"] is not None:
+            raise job["error"]
+
+        with self._lock:
+            self._stats["turns_prefetched"] += 1
+            self._stats["analysis_seconds_hidden"] += max(0.0, job["prepare_seconds"] - waited)
+        return job["parts"]
+
+    def analysis_timeout(self):
+        """(turn, turn_id, chunk, DeadlineExceeded) if the analysis of the last started turn timed out, else None."""
+        job = self._job
+        if job is None or job["analysis_timeout"] is None:
+            return None
+        return job["turn"], job["turn_id"], job["story_chunk"], job["analysis_timeout"]
+
+    def take_pregenerated(self, user_input):
+        """Return the pre-generated continuation if user_input is the suggestion, else None."""
+        job = self._job
+        if job["suggested_input"] is None or user_input != job["suggested_input"]:
+            return None
+
+        wait_start = time.time()
+        job["thread"].join()
+        waited = time.time() - wait_start
+        if job["pregenerated"] is None:
+            return None
+
+        with self._lock:
+            self._stats["pregeneration_hits"] += 1
+            self._stats["generation_seconds_saved"] += max(0.0, job["pregenerate_seconds"] - waited)
+        return job["pregenerated"]
+
+    def finish(self):
+        """Wait for the background work of the last turn (the state must be complete)."""
+        job = self._job
+        if job is not None:
+            job["thread"].join()
+            if job["error"] is not None:
+                raise job["error"]
+
+    def get_stats(self):
+        """Return prefetch counters, hit rate and total latency saved (seconds)."""
+        with self._lock:
+            stats = dict(self._stats)
+        pregenerations = stats["pregenerations"]
+        stats["pregeneration_hit_rate"] = (
+            round(stats["pregeneration_hits"] / pregenerations, 3) if pregenerations else 0
+        )
+        stats["analysis_seconds_hidden"] = round(stats["analysis_seconds_hidden"], 2)
+        stats["generation_seconds_saved"] = round(stats["generation_seconds_saved"], 2)
+        stats["latency_saved_seconds"] = round(
+            stats["analysis_seconds_hidden"] + stats["generation_seconds_saved"], 2
+        )
+        return stats
+
+    def _work(self, job, story_state, user_input, story_chunk, next_turn):
+        try:
+            start = time.time()
+            try:
+                analyze_turn(self.strategy, story_state, story_chunk, turn_id=job["turn_id"])
+            except DeadlineExceeded as e:
+                # Keep the chunk without (or with delayed) analysis: the session records the timeout
+                job["analysis_timeout"] = e
+            append_to_history(story_state, user_input, story_chunk)
+            if next_turn < self.max_turns:
+                job["parts"] = build_generation_parts(
+                    self.strategy, story_state, self.plot_config, next_turn, self.max_turns
+                )
+            job["prepare_seconds"] = time.time() - start
+        except Exception as e:
+            job["error"] = e
+            return
+        finally:
+            job["prepared"].set()
+
+        if job["parts"] is None or job["suggested_input"] is None or job["analysis_timeout"] is not None:
+            return
+
+        # Pre-generate the continuation for the suggested input
+        with self._lock:
+            self._stats["pregenerations"] += 1
+        start = time.time()
+        try:
+            job["pregenerated"] = generate_from_parts(self.strategy, story_state, job["suggested_input"],
+                                                      job["parts"])
+        except Exception as e:
+            print(f"[WARNING] Speculative generation failed: {e}")
+        job["pregenerate_seconds"] = time.time() - start
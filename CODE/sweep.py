@@ -0,0 +1,246 @@
+"""Parameter sweeps over the generation settings, with early stopping.
+
+A sweep spec (JSON file) lists the values to try for the settings of
+generation_settings.DEFAULTS, as a full grid or as a random search:
+
+    {"grid": {"temperature": [0.5, 0.7, 0.9], "facts_window": [5, 10, 20]}}
+
+    {"random": {"temperature": {"min": 0.3, "max": 1.0}, "facts_window": [5, 10, 20]},
+     "samples": 8, "seed": 1}
+
+Every configuration gets `runs` runs, all scheduled on one shared thread
+pool and interleaved (run 1 of every configuration first), so every
+configuration has a few results early. Once a configuration has min_runs
+results, the CI of its objective is compared with the one of the best
+configuration so far: when the two intervals do not overlap, the
+configuration is clearly worse, its pending runs are cancelled and it is
+reported as stopped early.
+
+Stopping rule: with 3-5 runs a percentile bootstrap CI is far too narrow
+(it collapses to a point when the runs agree, e.g. 0 inconsistencies in all
+three), so the CIs are Student-t intervals of the mean whose standard
+deviation is floored at the within-configuration standard deviation pooled
+over every configuration with at least 2 results. A configuration is only
+stopped when it is worse beyond that shared run-to-run noise. min_runs must
+be at least 2 (a t interval needs a standard deviation).
+
+Usage:
+    python run.py sweep --spec sweep.json --runs 5 --turns 10 --workers 4
+"""
+
+import csv
+import itertools
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import generation_settings
+from experiment_stats import t_ci
+
+
+# Metrics in the results table (objective candidates); True = higher is better
+TABLE_METRICS = {
+    "total_inconsistencies": False,
+    "repeated_inconsistencies": False,
+    "inconsistency_rate": False,
+    "total_facts": True,
+    "total_objects": True,
+    "avg_turn_length_words": True,
+    "cost_usd": False,
+}
+
+
+def load_spec(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def expand_spec(spec):
+    """List of settings dicts (validated, duplicates removed) described by a sweep spec."""
+    if "grid" in spec:
+        names = list(spec["grid"])
+        configs = [dict(zip(names, values)) for values in itertools.product(*spec["grid"].values())]
+    elif "random" in spec:
+        rng = random.Random(spec.get("seed", 0))
+        configs = []
+        for _ in range(spec.get("samples", 8)):
+            config = {}
+            for name, space in spec["random"].items():
+                if isinstance(space, dict):
+                    low, high = space["min"], space["max"]
+                    if isinstance(generation_settings.DEFAULTS.get(name), int):
+                        config[name] = rng.randint(int(low), int(high))
+                    else:
+                        config[name] = round(rng.uniform(low, high), 3)
+                else:
+                    config[name] = rng.choice(space)
+            configs.append(config)
+    else:
+        raise ValueError("Sweep spec needs a 'grid' or a 'random' section")
+
+    unique = []
+    for config in configs:
+        config = generation_settings.validate(config)
+        if config not in unique:
+            unique.append(config)
+    return unique
+
+
+def metric_value(metrics, name):
+    """Value of a table metric in the metrics of a run (usage fields included)."""
+    if name in metrics:
+        return metrics[name]
+    return (metrics.get("usage") or {}).get(name, float("nan"))
+
+
+def _values(entry, objective):
+    return np.array([metric_value(m, objective) for m in entry["runs"]], dtype=float)
+
+
+def pooled_std(entries, objective):
+    """Within-configuration standard deviation of the objective, pooled over the configurations."""
+    squares, dof = 0.0, 0
+    for entry in entries:
+        values = _values(entry, objective)
+        values = values[~np.isnan(values)]
+        if values.size >= 2:
+            squares += float(((values - values.mean()) ** 2).sum())
+            dof += values.size - 1
+    return float(np.sqrt(squares / dof)) if dof else 0.0
+
+
+def objective_intervals(entries, objective, min_runs=2, confidence=0.95):
+    """{config: (mean, (low, high))} of the configurations with at least min_runs results.
+
+    Student-t CIs with the standard deviation floored at pooled_std (see the stopping rule).
+    """
+    floor = pooled_std(entries, objective)
+    cis = {}
+    for entry in entries:
+        values = _values(entry, objective)
+        if np.count_nonzero(~np.isnan(values)) >= max(min_runs, 2):
+            cis[entry["config"]] = (np.nanmean(values), t_ci(values, confidence, min_std=floor))
+    return cis
+
+
+def clearly_worse(entries, objective, maximize=False, min_runs=3, confidence=0.95):
+    """Running configurations whose objective CI is entirely worse than the best one's."""
+    cis = objective_intervals(entries, objective, min_runs, confidence)
+    if len(cis) < 2:
+        return []
+    sign = -1 if maximize else 1
+    best = min(cis, key=lambda config: sign * cis[config][0])
+    best_low, best_high = cis[best][1]
+    worse = []
+    for entry in entries:
+        config = entry["config"]
+        if config == best or config not in cis or entry["status"] != "running":
+            continue
+        low, high = cis[config][1]
+        if (high < best_low) if maximize else (low > best_high):
+            worse.append(entry)
+    return worse
+
+
+def run_sweep(configs, runs, run_config, workers=1, objective="total_inconsistencies", maximize=False,
+              min_runs=3, confidence=0.95, on_result=None):
+    """Run every configuration `runs` times on a shared pool, stopping clearly worse ones.
+
+    Args:
+        configs: list of settings dicts (see expand_spec)
+        runs: runs per configuration
+        run_config: callable(config index, settings, run_id) -> run metrics
+        workers: runs executed in parallel
+        objective: metric the configurations are compared on (see TABLE_METRICS)
+        maximize: True if a higher objective is better
+        min_runs: runs of a configuration before it can be stopped (0 = never stop, else at least 2)
+        on_result: optional callback(config index, run_id, metrics)
+
+    Returns:
+        list of {"config", "settings", "runs", "status"} (status: complete / stopped_early)
+    """
+    if min_runs == 1:
+        raise ValueError("min_runs must be 0 (never stop) or at least 2")
+    entries = [{"config": i, "settings": settings, "runs": [], "status": "running"}
+               for i, settings in enumerate(configs)]
+    pending = {i: [] for i in range(len(configs))}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {}
+        for run_id in range(1, runs + 1):
+            for i, settings in enumerate(configs):
+                future = executor.submit(run_config, i, settings, run_id)
+                futures[future] = (i, run_id)
+                pending[i].append(future)
+
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            i, run_id = futures[future]
+            metrics = future.result()
+            entries[i]["runs"].append(metrics)
+            if on_result:
+                on_result(i, run_id, metrics)
+            if not min_runs:
+                continue
+            for entry in clearly_worse(entries, objective, maximize, min_runs, confidence):
+                entry["status"] = "stopped_early"
+                cancelled = sum(f.cancel() for f in pending[entry["config"]])
+                print(f"[INFO] Config #{entry['config']} {entry['settings']} is clearly worse on "
+                      f"{objective}: stopped after {len(entry['runs'])} runs ({cancelled} cancelled)")
+
+    for entry in entries:
+        if entry["status"] == "running":
+            entry["status"] = "complete"
+        entry["runs"].sort(key=lambda m: m["run_id"])
+    return entries
+
+
+def sweep_table(entries, objective, maximize=False, confidence=0.95):
+    """One row per configuration, best objective first.
+
+    Row fields: config, settings, runs, status, the mean of every TABLE_METRICS
+    metric and the CI (objective_low, objective_high) of the objective, the
+    same interval the stopping rule compares (None with fewer than 2 runs).
+    """
+    cis = objective_intervals(entries, objective, confidence=confidence)
+    rows = []
+    for entry in entries:
+        row = {"config": entry["config"], **entry["settings"], "runs": len(entry["runs"]),
+               "status": entry["status"]}
+        for name in TABLE_METRICS:
+            values = _values(entry, name)
+            row[name] = round(float(np.nanmean(values)), 4) if np.any(~np.isnan(values)) else None
+        low, high = cis[entry["config"]][1] if entry["config"] in cis else (None, None)
+        row["objective_low"] = None if low is None else round(low, 4)
+        row["objective_high"] = None if high is None else round(high, 4)
+        rows.append(row)
+    sign = -1 if maximize else 1
+    rows.sort(key=lambda row: (row[objective] is None, sign * (row[objective] or 0)))
+    return rows
+
+
+def write_table(rows, path):
+    """Write the sweep table as CSV (settings as columns, same order for every row)."""
+    columns = []
+    for row in rows:
+        columns += [name for name in row if name not in columns]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def format_table(rows, objective, setting_names):
+    """Results table for the terminal."""
+    header = ["#"] + setting_names + ["runs", "status", objective, "CI"]
+    lines = [header]
+    for row in rows:
+        ci = "-" if row["objective_low"] is None else f"{row['objective_low']:.3g} .. {row['objective_high']:.3g}"
+        value = "-" if row[objective] is None else f"{row[objective]:.3g}"
+        lines.append([str(row["config"])] + [str(row.get(name, "")) for name in setting_names]
+                     + [str(row["runs"]), row["status"], value, ci])
+    widths = [max(len(line[col]) for line in lines) for col in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)) for line in lines)
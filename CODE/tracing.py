@@ -0,0 +1,170 @@
+"""Per-turn tracing spans for story sessions.
+
+Nested spans are recorded for every phase of the hot path (rate-limit wait,
+prompt build, request in flight, response parse, state merge, file I/O),
+attributed to session, run, turn and method. Spans can be exported as:
+- Chrome trace JSON (open in chrome://tracing or https://ui.perfetto.dev)
+- OpenTelemetry-style JSON (traceId/spanId/parentSpanId, unix nano timestamps)
+and summarized per phase for the run metrics.
+
+Tracing is off unless a Tracer is activated: span() then costs a single
+ContextVar lookup.
+
+Usage:
+    tracer = Tracer(run_id=1, method="A")
+    with tracer.activate():
+        run_story_session(...)
+    metrics["trace_summary"] = tracer.summary()
+    write_chrome_trace("trace.json", [tracer])
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+_current_tracer = contextvars.ContextVar("current_tracer", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_span_attributes = contextvars.ContextVar("span_attributes", default={})
+
+_NO_SPAN = nullcontext()
+
+
+class Tracer:
+    """Collects the spans of one run.
+
+    Args:
+        **attributes: attributes attached to every span (run_id, method, session...)
+    """
+
+    _next_pid = 1
+    _pid_lock = threading.Lock()
+
+    def __init__(self, **attributes):
+        self.attributes = attributes
+        self.spans = []
+        self.trace_id = os.urandom(16).hex()
+        self._lock = threading.Lock()
+        with Tracer._pid_lock:
+            self.pid = Tracer._next_pid
+            Tracer._next_pid += 1
+
+    @contextmanager
+    def activate(self, **attributes):
+        """Make this tracer current for the code (and threads copying the context) inside."""
+        tracer_token = _current_tracer.set(self)
+        attr_token = _span_attributes.set({**self.attributes, **attributes})
+        try:
+            yield self
+        finally:
+            _span_attributes.reset(attr_token)
+            _current_tracer.reset(tracer_token)
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Total seconds and count per span name, plus the slowest turn."""
+        by_name = {}
+        turns = {}
+        for s in self.spans:
+            entry = by_name.setdefault(s["name"], {"count": 0, "total_seconds": 0.0})
+            entry["count"] += 1
+            entry["total_seconds"] += s["duration"]
+            if s["name"] == "turn":
+                turns[s["attributes"].get("turn")] = s["duration"]
+        for entry in by_name.values():
+            entry["total_seconds"] = round(entry["total_seconds"], 4)
+        summary = {"phases": by_name}
+        if turns:
+            slowest = max(turns, key=turns.get)
+            summary["slowest_turn"] = {"turn": slowest, "seconds": round(turns[slowest], 4)}
+        return summary
+
+    def chrome_events(self):
+        """Spans as Chrome trace 'complete' events (one process per tracer)."""
+        label = " ".join(f"{k}={v}" for k, v in self.attributes.items()) or f"tracer {self.pid}"
+        events = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": label}}]
+        for s in self.spans:
+            events.append({
+                "name": s["name"],
+                "cat": s["attributes"].get("method", "story"),
+                "ph": "X",
+                "ts": s["start"] * 1e6,
+                "dur": s["duration"] * 1e6,
+                "pid": self.pid,
+                "tid": s["thread"],
+                "args": s["attributes"],
+            })
+        return events
+
+    def otel_spans(self):
+        """Spans in an OpenTelemetry-like JSON layout."""
+        return [
+            {
+                "traceId": self.trace_id,
+                "spanId": s["span_id"],
+                "parentSpanId": s["parent_id"],
+                "name": s["name"],
+                "startTimeUnixNano": int(s["start"] * 1e9),
+                "endTimeUnixNano": int((s["start"] + s["duration"]) * 1e9),
+                "attributes": s["attributes"],
+            }
+            for s in self.spans
+        ]
+
+
+def span(name, **attributes):
+    """Context manager timing a phase (no-op when no tracer is active)."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NO_SPAN
+    return _record_span(tracer, name, attributes)
+
+
+@contextmanager
+def _record_span(tracer, name, attributes):
+    attrs = {**_span_attributes.get(), **attributes}
+    span_id = os.urandom(8).hex()
+    parent_id = _current_span.get()
+    span_token = _current_span.set(span_id)
+    # Attributes of this span (e.g. turn) are inherited by nested spans
+    attr_token = _span_attributes.set(attrs)
+    start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+        _span_attributes.reset(attr_token)
+        _current_span.reset(span_token)
+        tracer.record({
+            "name": name,
+            "start": start,
+            "duration": duration,
+            "thread": threading.get_ident(),
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "attributes": attrs,
+        })
+
+
+def write_chrome_trace(path, tracers):
+    """Write the spans of several tracers in one Chrome trace file."""
+    events = []
+    for tracer in tracers:
+        events.extend(tracer.chrome_events())
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def write_otel_trace(path, tracers):
+    """Write the spans of several tracers as OpenTelemetry-style JSON."""
+    spans = []
+    for tracer in tracers:
+        spans.extend(tracer.otel_spans())
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"spans": spans}, f)
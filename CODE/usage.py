@@ -0,0 +1,143 @@
+"""Token and cost accounting per call, turn, run and method.
+
+call_gemini reports the usage metadata of every response (prompt, cached
+and output tokens) to the UsageRecorder active in the current context; the
+recorder aggregates it per turn and per call type, and prices it with
+PRICES_PER_MILLION (USD per 1M tokens, overridable via environment).
+
+Usage:
+    recorder = UsageRecorder()
+    with recorder.activate():
+        run_story_session(...)
+    metrics["usage"] = recorder.summary()
+"""
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+# USD per 1M tokens (Gemini Flash Lite list prices)
+PRICES_PER_MILLION = {
+    "input": float(os.environ.get("GEMINI_PRICE_INPUT", "0.10")),
+    "cached_input": float(os.environ.get("GEMINI_PRICE_CACHED_INPUT", "0.025")),
+    "output": float(os.environ.get("GEMINI_PRICE_OUTPUT", "0.40")),
+}
+
+_current_recorder = contextvars.ContextVar("current_usage_recorder", default=None)
+_current_turn = contextvars.ContextVar("current_usage_turn", default=None)
+
+_NO_SCOPE = nullcontext()
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def call_cost(prompt_tokens, cached_tokens, output_tokens, prices=None):
+    """Cost in USD of one call (cached tokens are billed at the cached price)."""
+    prices = prices or PRICES_PER_MILLION
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (
+        uncached * prices["input"]
+        + cached_tokens * prices["cached_input"]
+        + output_tokens * prices["output"]
+    ) / 1_000_000
+
+
+def turn(turn_id):
+    """Attribute the calls made inside to turn_id (no-op without an active recorder)."""
+    if _current_recorder.get() is None:
+        return _NO_SCOPE
+    return _turn_scope(turn_id)
+
+
+@contextmanager
+def _turn_scope(turn_id):
+    token = _current_turn.set(turn_id)
+    try:
+        yield
+    finally:
+        _current_turn.reset(token)
+
+
+def record_response(response, call_type, prompt_text=""):
+    """Record the usage of a generate_content response in the active recorder.
+
+    Falls back to a local estimate when the response has no usage metadata.
+    """
+    recorder = _current_recorder.get()
+    if recorder is None:
+        return
+    recorder.record(call_type, *response_tokens(response, prompt_text))
+
+
+def response_tokens(response, prompt_text=""):
+    """(prompt, cached, output, estimated) token counts of a generate_content response."""
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    output_tokens = getattr(usage, "candidates_token_count", None)
+    cached_tokens = getattr(usage, "cached_content_token_count", None) or 0
+    estimated = prompt_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(prompt_text)
+    if output_tokens is None:
+        output_tokens = estimate_tokens(getattr(response, "text", None) or "")
+    return prompt_tokens, cached_tokens, output_tokens, estimated
+
+
+class UsageRecorder:
+    """Aggregates token usage of one run."""
+
+    def __init__(self, prices=None):
+        self.prices = prices or PRICES_PER_MILLION
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        token = _current_recorder.set(self)
+        try:
+            yield self
+        finally:
+            _current_recorder.reset(token)
+
+    def record(self, call_type, prompt_tokens, cached_tokens, output_tokens, estimated=False):
+        with self._lock:
+            self.calls.append({
+                "turn": _current_turn.get(),
+                "call_type": call_type,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "output_tokens": output_tokens,
+                "estimated": estimated,
+            })
+
+    def summary(self):
+        """Totals, per call type and per turn (with cost in USD)."""
+        with self._lock:
+            calls = list(self.calls)
+
+        def aggregate(selected):
+            totals = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+            for c in selected:
+                totals["calls"] += 1
+                totals["prompt_tokens"] += c["prompt_tokens"]
+                totals["cached_tokens"] += c["cached_tokens"]
+                totals["output_tokens"] += c["output_tokens"]
+            totals["cost_usd"] = round(call_cost(
+                totals["prompt_tokens"], totals["cached_tokens"], totals["output_tokens"], self.prices
+            ), 6)
+            return totals
+
+        call_types = sorted({c["call_type"] for c in calls})
+        turns = sorted({c["turn"] for c in calls if c["turn"] is not None})
+        summary = aggregate(calls)
+        summary["estimated_calls"] = sum(1 for c in calls if c["estimated"])
+        summary["by_call_type"] = {t: aggregate([c for c in calls if c["call_type"] == t]) for t in call_types}
+        summary["per_turn"] = [
+            {"turn": t, **aggregate([c for c in calls if c["turn"] == t])} for t in turns
+        ]
+        return summary
@@ -0,0 +1,340 @@
+"""Fingerprinting and clustering of detected violations.
+
+The analysis call describes the same error in many ways ("Cannocchiale di
+ottone. Sebbene...", "Lin Yao non usò alcun cannocchiale (...)"). A violation
+is reduced to its key terms: the head of the description (up to the first
+".", "|" or "("), without the type label, stopwords and character names,
+each word stemmed (plural/gender endings dropped, accents removed) and mapped
+through SYNONYMS. Its signature is a hash of (type, sorted key terms).
+
+ViolationIndex clusters near-duplicates: an exact signature match, or a
+cluster of the same type sharing at least `threshold` of the smaller term
+set (candidates come from an inverted index term -> clusters, so adding a
+violation costs O(its terms), not O(clusters)). The index is incremental
+(add one violation at a time during a run) and works in bulk over the runs
+of a results file (cluster_runs).
+
+A session keeps one index of all its violations in story_state
+(session_index): the prompt builder, the analysis gate, the best-of-N scorer
+and the metrics share it, and each call only fingerprints the violations
+appended since the previous one. The index is runtime-only: storable_state()
+leaves it out of the serialized state.
+
+Usage:
+    index = ViolationIndex(ignore_terms=character_terms(story_state["characters"]))
+    cluster, repeated = index.add(inconsistency)
+
+    anachronisms = session_index(story_state).clusters_of("anacronismo")
+
+    python violations.py --input final_results/    # clusters over stored runs
+"""
+
+import argparse
+import hashlib
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+
+DEFAULT_THRESHOLD = 0.5
+MAX_TERMS = 8  # key terms kept per violation (head of the description)
+SESSION_INDEX_KEY = "_violation_index"  # story_state key of the session index (not serialized)
+
+TYPE_LABELS = ["ANACRONISMO", "IMPOSSIBILITÀ STORICA", "IMPOSSIBILITÀ", "IMPOSSIBILITA", "CONTRADDIZIONE"]
+
+STOPWORDS = {
+    "il", "lo", "la", "le", "gli", "un", "uno", "una", "del", "dello", "della", "dei", "degli",
+    "delle", "al", "allo", "alla", "ai", "agli", "alle", "dal", "dalla", "dai", "nel", "nello",
+    "nella", "nei", "negli", "nelle", "sul", "sulla", "sui", "con", "per", "tra", "fra", "che",
+    "chi", "non", "piu", "come", "anche", "ancora", "sebbene", "ma", "se", "suo", "sua", "suoi",
+    "sue", "loro", "questo", "questa", "quello", "quella", "alcun", "alcuno", "alcuna", "ogni",
+    "molto", "poco", "stesso", "stessa", "gia", "era", "sono", "essere", "stato", "stata", "viene",
+    "usa", "uso", "usare", "usato", "usata", "utilizza", "utilizzo", "menziona", "menzionato",
+    "presenza", "riferimento", "testo", "storia", "turno", "epoca", "periodo", "nessuna",
+}
+
+# Stem -> canonical stem (different words for the same object)
+SYNONYMS = {
+    "telescop": "cannocchial",
+    "archibug": "pistol",
+    "moschett": "pistol",
+    "fucil": "pistol",
+}
+
+_HEAD_END = re.compile(r"[.|(\[;]")
+_WORD = re.compile(r"[a-z]+")
+
+
+def _strip_accents(text):
+    if text.isascii():
+        return text
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def stem(word):
+    """Light Italian stem: drops the final vowel (or -io/-ia/-ie/-ii), keeps -c/-g hard."""
+    if len(word) <= 4:
+        return word
+    if word[-2:] in ("io", "ia", "ie", "ii"):
+        word = word[:-2]
+    elif word[-1] in "aeiou":
+        word = word[:-1]
+    # cannocchiali / banchi: keep the stem of the singular (banc-o)
+    if word.endswith(("ch", "gh")):
+        word = word[:-1]
+    return SYNONYMS.get(word, word)
+
+
+def _strip_type_label(description):
+    text = description.strip()
+    upper = text[:24].upper()
+    for label in TYPE_LABELS:
+        if upper.startswith(label):
+            return text[len(label):].lstrip(" :-")
+    return text
+
+
+def description_head(description):
+    """Part of a description naming the error (before the explanation)."""
+    text = _strip_type_label(description)
+    head = _HEAD_END.split(text, 1)[0].strip()
+    return head or text
+
+
+@lru_cache(maxsize=16384)
+def _word_stem(word):
+    """Stem of a normalized word, or None for stopwords and short words."""
+    if len(word) < 3 or word in STOPWORDS:
+        return None
+    return stem(word)
+
+
+def key_terms(description, ignore_terms=frozenset()):
+    """(stem, surface word) pairs of the key terms of a description, in order."""
+    text = _strip_type_label(description)
+    head = _HEAD_END.split(text, 1)[0]
+    terms = {}  # stem -> first surface word (insertion ordered)
+    # Fall back to the whole description only if the head has no key term
+    for source in (head, text):
+        for word in _WORD.findall(_strip_accents(source.lower())):
+            if word in ignore_terms:
+                continue
+            term = _word_stem(word)
+            if term is not None and term not in terms:
+                terms[term] = word
+                if len(terms) >= MAX_TERMS:
+                    break
+        if terms:
+            break
+    return list(terms.items())
+
+
+def text_stems(text, ignore_terms=frozenset()):
+    """Set of the key term stems of a free text (e.g. a generated turn)."""
+    stems = set()
+    for word in set(_WORD.findall(_strip_accents(text.lower()))):
+        if word not in ignore_terms:
+            term = _word_stem(word)
+            if term is not None:
+                stems.add(term)
+    return stems
+
+
+def character_terms(characters):
+    """Lowercase words of the character names (ignored in fingerprints)."""
+    terms = set()
+    for character in characters or []:
+        terms.update(_WORD.findall(_strip_accents(character.get("name", "").lower())))
+    return frozenset(terms)
+
+
+def signature(violation_type, stems):
+    """Stable hashed signature of (type, key term stems)."""
+    text = violation_type + "|" + " ".join(sorted(stems))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ViolationIndex:
+    """Clusters of near-duplicate violations.
+
+    Args:
+        threshold: share of the smaller term set two violations must have in common
+        ignore_terms: words left out of the fingerprints (e.g. character names)
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, ignore_terms=frozenset()):
+        self.threshold = threshold
+        self.ignore_terms = frozenset(ignore_terms)
+        self.clusters = []
+        self._by_key = {}        # (type, stems) -> cluster index (exact fingerprint match)
+        self._by_term = {}       # (type, stem) -> [cluster index]
+        self._synced = 0         # violations of the tracked list already added (sync)
+        self._lock = threading.Lock()
+
+    def fingerprint(self, violation):
+        """(type, key term stems, surface words) of an inconsistency dict."""
+        violation_type = violation.get("type", "altro")
+        pairs = key_terms(violation.get("description", ""), self.ignore_terms)
+        return violation_type, frozenset(s for s, _ in pairs), [w for _, w in pairs]
+
+    def _find(self, violation_type, stems):
+        found = self._by_key.get((violation_type, stems))
+        if found is not None or not stems:
+            return found
+        shared = {}
+        for term in stems:
+            for candidate in self._by_term.get((violation_type, term), ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best, best_score = None, 0.0
+        for candidate, common in shared.items():
+            score = common / min(len(stems), len(self.clusters[candidate]["terms"]))
+            if score >= self.threshold and score > best_score:
+                best, best_score = candidate, score
+        return best
+
+    def match(self, violation):
+        """Cluster an inconsistency belongs to (None if new), without adding it."""
+        violation_type, stems, _ = self.fingerprint(violation)
+        found = self._find(violation_type, stems)
+        return self.clusters[found] if found is not None else None
+
+    def add(self, violation, run=None):
+        """Add an inconsistency.
+
+        Returns:
+            (cluster dict, True if it repeats an error already in the cluster)
+        """
+        violation_type, stems, words = self.fingerprint(violation)
+        found = self._find(violation_type, stems)
+        if found is None:
+            found = len(self.clusters)
+            self.clusters.append({
+                "id": signature(violation_type, stems),
+                "type": violation_type,
+                "terms": stems,
+                "label": " ".join(words) or description_head(violation.get("description", "")),
+                "count": 0,
+                "first_turn": violation.get("turn"),
+                "runs": set(),
+            })
+            for term in stems:
+                self._by_term.setdefault((violation_type, term), []).append(found)
+        self._by_key.setdefault((violation_type, stems), found)
+
+        cluster = self.clusters[found]
+        repeated = cluster["count"] > 0
+        cluster["count"] += 1
+        if run is not None:
+            cluster["runs"].add(run)
+        return cluster, repeated
+
+    def sync(self, violations):
+        """Add the violations appended to an append-only list since the last sync.
+
+        A list shorter than the one already synced (replaced or truncated)
+        rebuilds the index from scratch.
+
+        Returns:
+            the index itself
+        """
+        with self._lock:
+            if len(violations) < self._synced:
+                self.clusters, self._by_key, self._by_term, self._synced = [], {}, {}, 0
+            for violation in violations[self._synced:]:
+                self.add(violation)
+            self._synced = len(violations)
+        return self
+
+    def clusters_of(self, violation_type):
+        """Clusters of one violation type, in order of first appearance."""
+        return [cluster for cluster in self.clusters if cluster["type"] == violation_type]
+
+    @property
+    def repeated(self):
+        """Violations that repeat an earlier one (all clusters)."""
+        return sum(cluster["count"] - 1 for cluster in self.clusters)
+
+    @classmethod
+    def from_violations(cls, violations, **kwargs):
+        index = cls(**kwargs)
+        for violation in violations:
+            index.add(violation)
+        return index
+
+
+def session_index(story_state):
+    """ViolationIndex of all the violations of a story state, kept in the state.
+
+    Built on first use (character names ignored), then brought up to date
+    with the violations appended since the previous call.
+    """
+    index = story_state.get(SESSION_INDEX_KEY)
+    if index is None:
+        index = story_state.setdefault(
+            SESSION_INDEX_KEY, ViolationIndex(ignore_terms=character_terms(story_state.get("characters")))
+        )
+    return index.sync(story_state.get("inconsistencies", []))
+
+
+def storable_state(story_state):
+    """story_state without the runtime-only session index (for JSON serialization)."""
+    if SESSION_INDEX_KEY not in story_state:
+        return story_state
+    return {key: value for key, value in story_state.items() if key != SESSION_INDEX_KEY}
+
+
+def cluster_runs(runs, threshold=DEFAULT_THRESHOLD, ignore_terms=frozenset()):
+    """Cluster the violations of many stored runs in one index.
+
+    Args:
+        runs: iterable of (run key, inconsistencies list)
+
+    Returns:
+        (index, repeated): the shared ViolationIndex (cluster "runs" = run keys)
+        and dict run key -> violations repeated within that run
+    """
+    index = ViolationIndex(threshold, ignore_terms)
+    repeated = {}
+    for key, inconsistencies in runs:
+        seen = set()
+        repeated[key] = 0
+        for violation in inconsistencies:
+            cluster, _ = index.add(violation, run=key)
+            # Repeats are counted within the run; the clusters span all runs
+            if cluster["id"] in seen:
+                repeated[key] += 1
+            seen.add(cluster["id"])
+    return index, repeated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster the violations of stored compare runs")
+    parser.add_argument("--input", type=str, required=True,
+                        help="Directory with comparison_results_full.json (or comparison_results.json)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Share of common key terms to merge two violations. Default: {DEFAULT_THRESHOLD}")
+    parser.add_argument("--top", type=int, default=15, help="Clusters listed. Default: 15")
+    args = parser.parse_args()
+
+    from blob_store import load_results
+    from persona_utils import load_story_config
+
+    results = load_results(args.input)
+
+    runs = [
+        ((method, run["run_id"]), (run.get("story_state") or {}).get("inconsistencies", []))
+        for method in ("A", "B")
+        for run in results[f"method_{method}"]
+    ]
+    names = character_terms(load_story_config().get("characters", []))
+    index, repeated = cluster_runs(runs, args.threshold, names)
+
+    print(f"{len(index.clusters)} clusters from {sum(c['count'] for c in index.clusters)} violations "
+          f"in {len(runs)} runs")
+    for cluster in sorted(index.clusters, key=lambda c: -c["count"])[:args.top]:
+        print(f"  {cluster['count']:>4}x in {len(cluster['runs']):>3} runs  [{cluster['type']}] {cluster['label']}")
+    for method in ("A", "B"):
+        values = [count for (m, _), count in repeated.items() if m == method]
+        if values:
+            print(f"Method {method}: {sum(values) / len(values):.2f} repeated violations per run")